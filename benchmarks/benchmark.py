@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import io
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src/OneDriveCLI'))
+from mock_graph_server import MockGraphServer
+from OneDriveCLI import OneDriveCLI, QuickXorHash, run_command
+
+# Drives OneDriveCLI end to end against the mock Graph server and reports the wall time, throughput and number of
+# HTTP requests of each command. Results can be saved and later runs compared against them, which fails if a command
+# now needs more requests or has lost more than --tolerance of its throughput. Runs are only compared with ones made
+# with the same options.
+
+class BenchmarkTokenHandler:
+
+    def get_token(self):
+        return 'benchmark-token'
+
+class Benchmark:
+
+    def __init__(self, work_dir, latency, bandwidth, throttle_rate) -> None:
+        self._work_dir = work_dir
+        self._server = MockGraphServer(latency=latency, bandwidth=bandwidth, throttle_rate=throttle_rate, retry_after=0,
+                                       hash_function=lambda content: QuickXorHash(bytes(content)).b64digest()).start()
+        self._odc = OneDriveCLI(f'{work_dir}/settings.db')
+        self._odc.ONEDRIVE_ENDPOINT = f'{self._server.base_url}/v1.0'
+        self._odc._token_handler_instance = BenchmarkTokenHandler()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self._odc.initialise()
+
+    def make_local_files(self, local_dir, count, size):
+        os.makedirs(local_dir, exist_ok=True)
+        for i in range(count):
+            with open(f'{local_dir}/file-{i:05}.bin', 'wb') as local_file:
+                local_file.write(os.urandom(size))
+
+    def run(self, name, args, setup=None):
+        if setup is not None:
+            setup()
+        self._odc.cd('/')
+        self._server.reset_stats()
+        # Answers yes to rm's confirmation
+        sys.stdin = io.StringIO('Y\n')
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(output := io.StringIO()):
+            exit_code = run_command(self._odc, args)
+        seconds = time.perf_counter() - started
+        sys.stdin = sys.__stdin__
+        if exit_code != 0 or 'error' in output.getvalue():
+            raise RuntimeError(f'{name} failed: {output.getvalue()}')
+        megabytes = (self._server.bytes_in + self._server.bytes_out) / 1048576
+        return {'name': name,
+                'command': ' '.join(args),
+                'seconds': seconds,
+                'mb_per_second': megabytes / seconds,
+                'requests': sum(self._server.request_counts.values()),
+                'throttled': self._server.throttled,
+                'request_counts': dict(self._server.request_counts)}
+
+    def run_all(self, file_count, file_size, large_file_size):
+        local = f'{self._work_dir}/local'
+        self.make_local_files(f'{local}/tree', file_count, file_size)
+        self.make_local_files(f'{local}/large', 1, large_file_size)
+        large_file = f'{local}/large/file-00000.bin'
+        directories = [f'/dirs/dir-{i:03}' for i in range(file_count)]
+        results = [self.run('mkdir', ['mkdir', '/dirs'] + directories),
+                   self.run('put', ['put', large_file, '/']),
+                   self.run('put -r', ['put', '-r', f'{local}/tree', '/']),
+                   self.run('put -r unchanged', ['put', '-r', f'{local}/tree', '/']),
+                   self.run('ls', ['ls', '/tree']),
+                   self.run('get', ['get', '/file-00000.bin', f'{local}/downloaded.bin']),
+                   self.run('get -r', ['get', '-r', '/tree', f'{local}/downloaded'], setup=lambda: shutil.rmtree(f'{local}/downloaded', ignore_errors=True)),
+                   self.run('rm', ['rm'] + directories)]
+        self._server.stop()
+        return results
+
+def print_results(results):
+    print(f'{"benchmark":<20}{"seconds":>10}{"MB/s":>10}{"requests":>10}{"throttled":>10}')
+    for result in results:
+        print(f'{result["name"]:<20}{result["seconds"]:>10.3f}{result["mb_per_second"]:>10.1f}{result["requests"]:>10}{result["throttled"]:>10}')
+
+def compare_results(results, baseline, tolerance):
+    # Request counts are deterministic, so any increase is a regression. Throughput varies from run to run, so it's
+    # only flagged once it has dropped by more than the tolerance.
+    regressions = []
+    baseline = {result['name']: result for result in baseline}
+    for result in results:
+        if (expected := baseline.get(result['name'])) is None:
+            continue
+        if result['requests'] > expected['requests']:
+            regressions.append(f'{result["name"]}: {result["requests"]} requests, was {expected["requests"]}')
+        if result['mb_per_second'] < expected['mb_per_second'] * (1 - tolerance):
+            regressions.append(f'{result["name"]}: {result["mb_per_second"]:.1f} MB/s, was {expected["mb_per_second"]:.1f} MB/s')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OneDriveCLI against a local mock of Microsoft Graph')
+    parser.add_argument('--files', type=int, default=100, help='number of files and directories to create')
+    parser.add_argument('--file-size', type=int, default=65536, help='size of each small file in bytes')
+    parser.add_argument('--large-file-size', type=int, default=67108864, help='size of the large file in bytes')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every request')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second for bodies (0 = unlimited)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='compare the results with those saved in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='throughput drop allowed by --compare')
+    args = parser.parse_args()
+
+    options = {key: value for key, value in vars(args).items() if key not in ['save', 'compare', 'tolerance']}
+    with tempfile.TemporaryDirectory(prefix='odc-benchmark-') as work_dir:
+        benchmark = Benchmark(work_dir, args.latency, args.bandwidth, args.throttle_rate)
+        results = benchmark.run_all(args.files, args.file_size, args.large_file_size)
+    print_results(results)
+
+    if args.save is not None:
+        with open(args.save, 'w') as results_file:
+            json.dump({'options': options, 'results': results}, results_file, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['options'] != options:
+            print(f'error: {args.compare} was made with different options: {baseline["options"]}')
+            sys.exit(1)
+        regressions = compare_results(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,566 @@
+import argparse
+import hashlib
+import itertools
+import json as jsonlib
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+
+# A stand-in for the parts of Microsoft Graph that OneDriveCLI talks to. Everything is held in memory and every
+# request is counted so that the benchmark harness can report round trips per command. Latency, bandwidth and
+# throttling can be dialled in to approximate a real link.
+
+DRIVE_ID = 'b0a1b2c3d4e5f607'
+API_PREFIX = '/v1.0'
+MAX_PAGE_SIZE = 1000
+
+class GraphError(Exception):
+
+    def __init__(self, status, code, message) -> None:
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+class MockItem:
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, parent=None, is_folder=False, content=b'') -> None:
+        self.id = f'{DRIVE_ID.upper()}!{next(self._ids)}'
+        self.name = name
+        self.parent = parent
+        self.is_folder = is_folder
+        self.children = {}
+        self.content = bytes(content)
+        self.version = 1
+        self.created = self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def path(self):
+        parts = []
+        item = self
+        while item.parent is not None:
+            parts.append(item.name)
+            item = item.parent
+        return '/' + '/'.join(reversed(parts))
+
+    def size(self):
+        if self.is_folder:
+            return sum(child.size() for child in self.children.values())
+        return len(self.content)
+
+    def touch(self):
+        self.version += 1
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+class MockDrive:
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self.root = MockItem('root', is_folder=True)
+        self.items = {self.root.id: self.root}
+        self.upload_sessions = {}
+        self.monitors = {}
+        self.changes = []
+        self._record_change(self.root)
+
+    def _record_change(self, item, deleted=False):
+        self.changes.append((item.id, deleted, item if deleted else None))
+
+    def lookup(self, item, path):
+        for part in [p for p in path.split('/') if p != '']:
+            if not item.is_folder or (child := self._find_child(item, part)) is None:
+                raise GraphError(404, 'itemNotFound', 'The resource could not be found.')
+            item = child
+        return item
+
+    def _find_child(self, folder, name):
+        return folder.children.get(name.lower())
+
+    def add(self, parent, name, is_folder=False, content=b'', conflict='fail'):
+        with self._lock:
+            if (existing := self._find_child(parent, name)) is not None:
+                if conflict == 'fail':
+                    raise GraphError(409, 'nameAlreadyExists', 'The specified item name already exists.')
+                if conflict == 'replace':
+                    if existing.is_folder or is_folder:
+                        self.delete(existing)
+                    else:
+                        existing.content = bytes(content)
+                        existing.touch()
+                        self._record_change(existing)
+                        return existing
+                else:
+                    stem, dot, ext = name.partition('.')
+                    name = next(candidate for n in itertools.count(1)
+                                if self._find_child(parent, candidate := f'{stem} {n}{dot}{ext}') is None)
+            item = MockItem(name, parent, is_folder, content)
+            parent.children[name.lower()] = item
+            parent.touch()
+            self.items[item.id] = item
+            self._record_change(item)
+            return item
+
+    def delete(self, item):
+        with self._lock:
+            for child in list(item.children.values()):
+                self.delete(child)
+            item.parent.children.pop(item.name.lower(), None)
+            item.parent.touch()
+            self.items.pop(item.id, None)
+            self._record_change(item, deleted=True)
+
+    def move(self, item, new_parent, new_name):
+        with self._lock:
+            if self._find_child(new_parent, new_name) not in (None, item):
+                raise GraphError(409, 'nameAlreadyExists', 'The specified item name already exists.')
+            item.parent.children.pop(item.name.lower())
+            item.parent.touch()
+            item.parent = new_parent
+            item.name = new_name
+            new_parent.children[new_name.lower()] = item
+            item.touch()
+            self._record_change(item)
+
+    def copy(self, item, new_parent, new_name):
+        with self._lock:
+            clone = self.add(new_parent, new_name, item.is_folder, item.content, conflict='fail')
+            for child in list(item.children.values()):
+                self.copy(child, clone, child.name)
+            return clone
+
+    def make_tree(self, path):
+        item = self.root
+        for part in [p for p in path.split('/') if p != '']:
+            item = self._find_child(item, part) or self.add(item, part, is_folder=True)
+        return item
+
+    def make_file(self, path, content):
+        parent, _, name = path.rpartition('/')
+        return self.add(self.make_tree(parent), name, content=content, conflict='replace')
+
+class MockGraphServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, bandwidth=0, throttle_rate=0.0, retry_after=1,
+                 hash_function=None) -> None:
+        super().__init__(address, MockGraphRequestHandler)
+        self.drive = MockDrive()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.hash_function = hash_function
+        self.upload_puts = 0
+        self.fail_upload_puts = set()
+        self.fail_downloads = False
+        self.delta_expired = False
+        self.shuffle_batch_responses = False
+        self.rejected_tokens = set()
+        self.expired_url_status = None
+        self._download_url_generation = 0
+        self._stats_lock = threading.Lock()
+        self._random = random.Random(0)
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.request_counts = Counter()
+            self.connections = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.throttled = 0
+
+    def count_request(self, method, template, bytes_in):
+        with self._stats_lock:
+            self.request_counts[f'{method} {template}'] += 1
+            self.bytes_in += bytes_in
+
+    def count_bytes_out(self, count):
+        with self._stats_lock:
+            self.bytes_out += count
+
+    def count_connection(self):
+        with self._stats_lock:
+            self.connections += 1
+
+    def should_throttle(self):
+        with self._stats_lock:
+            if self.throttle_rate > 0 and self._random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+            return False
+
+    def expire_download_urls(self, status=401):
+        # Every download url handed out so far stops working, as they do on Graph after a while
+        self._download_url_generation += 1
+        self.expired_url_status = status
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def item_json(self, item, select=None):
+        created = item.created.isoformat().replace('+00:00', 'Z')
+        modified = item.modified.isoformat().replace('+00:00', 'Z')
+        user = {'user': {'displayName': 'Mock User'}}
+        json = {
+            'id': item.id,
+            'name': item.name,
+            'size': item.size(),
+            'eTag': f'"{{{item.id}}},{item.version}"',
+            'cTag': f'"c:{{{item.id}}},{item.version}"',
+            'webUrl': f'https://1drv.ms/{"f" if item.is_folder else "b"}/s!{quote(item.id)}',
+            'createdBy': user,
+            'lastModifiedBy': user,
+            'createdDateTime': created,
+            'lastModifiedDateTime': modified,
+            'fileSystemInfo': {'createdDateTime': created, 'lastModifiedDateTime': modified},
+        }
+        if item.parent is not None:
+            parent_path = item.parent.path()
+            json['parentReference'] = {'driveId': DRIVE_ID, 'id': item.parent.id,
+                                       'path': f'/drive/root:{"" if parent_path == "/" else parent_path}'}
+        else:
+            json['root'] = {}
+        if item.is_folder:
+            json['folder'] = {'childCount': len(item.children)}
+        else:
+            json['file'] = {'mimeType': 'application/octet-stream'}
+            if self.hash_function is not None:
+                json['file']['hashes'] = {'quickXorHash': self.hash_function(item.content)}
+            json['@microsoft.graph.downloadUrl'] = f'{self.base_url}/download/{quote(item.id)}?v={item.version}&g={self._download_url_generation}'
+        if select:
+            json = {key: value for key, value in json.items() if key in select or key == 'id'}
+        return json
+
+    def route(self, method, raw_path, headers, body):
+        split = urlsplit(raw_path)
+        query = {key: values[0] for key, values in parse_qs(split.query).items()}
+        path = split.path
+        if path.startswith('/upload/'):
+            return self._route_upload(method, path[len('/upload/'):], headers, body)
+        if path.startswith('/download/'):
+            return self._route_download(method, unquote(path[len('/download/'):]), headers, query)
+        if path.startswith('/monitor/'):
+            return self._route_monitor(unquote(path[len('/monitor/'):]))
+        if not path.startswith(API_PREFIX):
+            raise GraphError(400, 'invalidRequest', f'unknown path {path}')
+        if not (authorization := headers.get('Authorization', '')).lower().startswith('bearer ') or authorization[7:] in self.rejected_tokens:
+            raise GraphError(401, 'unauthenticated', 'Must be authenticated to use this API.')
+        path = path[len(API_PREFIX):]
+        if path == '/$batch' and method == 'POST':
+            return self._route_batch(jsonlib.loads(body), headers)
+        if path == '/me/drive':
+            return 'GET /me/drive', 200, {}, {'id': DRIVE_ID, 'driveType': 'personal'}
+        if (match := re.match(r'^/drives/([^/]+)/(.*)$', path)) is None:
+            raise GraphError(400, 'invalidRequest', f'unknown path {path}')
+        return self._route_item(method, match.group(2), query, headers, body)
+
+    def _route_item(self, method, rest, query, headers, body):
+        template = []
+        if rest.startswith('root'):
+            item = self.drive.root
+            rest = rest[len('root'):]
+            template.append('root')
+        elif (match := re.match(r'^items/([^/:]+)(.*)$', rest)) is not None:
+            if (item := self.drive.items.get(unquote(match.group(1)))) is None:
+                raise GraphError(404, 'itemNotFound', 'The resource could not be found.')
+            rest = match.group(2)
+            template.append('items/{id}')
+        else:
+            raise GraphError(400, 'invalidRequest', f'unknown path {rest}')
+        name = None
+        if rest.startswith(':'):
+            end = rest.find(':', 1)
+            rel_path = unquote(rest[1:] if end == -1 else rest[1:end])
+            rest = '' if end == -1 else rest[end + 1:]
+            template.append(':/{path}:')
+            if method in ('PUT', 'POST') and rest in ('/content', '/createUploadSession'):
+                parent_path, _, name = rel_path.rpartition('/')
+                item = self.drive.lookup(item, parent_path)
+            else:
+                item = self.drive.lookup(item, rel_path)
+        action = rest.strip('/')
+        if action:
+            template.append(f'/{action}')
+        template = f'{method} /drives/{{drive}}/' + ''.join(template)
+        select = set(query['$select'].split(',')) if '$select' in query else None
+        if action == '' and method == 'GET':
+            return template, 200, {}, self.item_json(item, select)
+        if action == '' and method == 'DELETE':
+            if item is self.drive.root:
+                raise GraphError(403, 'accessDenied', 'Cannot delete the root.')
+            self.drive.delete(item)
+            return template, 204, {}, None
+        if action == '' and method == 'PATCH':
+            request = jsonlib.loads(body)
+            parent = item.parent
+            if 'parentReference' in request:
+                parent = self._resolve_reference(request['parentReference'])
+            self.drive.move(item, parent, request.get('name', item.name))
+            return template, 200, {}, self.item_json(item)
+        if action == 'children' and method == 'GET':
+            return template, 200, {}, self._page(item, query, select)
+        if action == 'children' and method == 'POST':
+            request = jsonlib.loads(body)
+            created = self.drive.add(item, request['name'], is_folder='folder' in request,
+                                     conflict=request.get('@microsoft.graph.conflictBehavior', 'fail'))
+            return template, 201, {}, self.item_json(created)
+        if action == 'content' and method == 'PUT':
+            created = self.drive.add(item, name, content=body, conflict='replace')
+            return template, 201, {}, self.item_json(created)
+        if action == 'content' and method == 'GET':
+            return template, 302, {'Location': self.item_json(item)['@microsoft.graph.downloadUrl']}, None
+        if action == 'createUploadSession' and method == 'POST':
+            session_id = hashlib.sha1(f'{item.id}/{name}/{time.time()}/{random.random()}'.encode()).hexdigest()
+            self.drive.upload_sessions[session_id] = {'parent': item, 'name': name, 'data': bytearray(),
+                                                      'received': [], 'size': None}
+            expiry = (datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+            return template, 200, {}, {'uploadUrl': f'{self.base_url}/upload/{session_id}',
+                                       'expirationDateTime': expiry, 'nextExpectedRanges': ['0-']}
+        if action == 'copy' and method == 'POST':
+            request = jsonlib.loads(body)
+            parent = self._resolve_reference(request['parentReference'])
+            clone = self.drive.copy(item, parent, request.get('name', item.name))
+            monitor_id = hashlib.sha1(f'{clone.id}/{time.time()}'.encode()).hexdigest()
+            self.drive.monitors[monitor_id] = {'polls': 0, 'resourceId': clone.id}
+            return template, 202, {'Location': f'{self.base_url}/monitor/{monitor_id}'}, None
+        if action == 'delta' and method == 'GET':
+            return template, 200, {}, self._delta(query, select)
+        raise GraphError(400, 'invalidRequest', f'unsupported: {template}')
+
+    def _resolve_reference(self, reference):
+        if 'id' in reference:
+            if (parent := self.drive.items.get(reference['id'])) is None:
+                raise GraphError(404, 'itemNotFound', 'The parent could not be found.')
+            return parent
+        return self.drive.lookup(self.drive.root, reference['path'].split('root:', 1)[-1])
+
+    def _page(self, folder, query, select):
+        top = min(int(query.get('$top', 200)), MAX_PAGE_SIZE)
+        skip = int(query.get('$skiptoken', 0))
+        children = sorted(folder.children.values(), key=lambda child: child.name.lower())
+        page = {'value': [self.item_json(child, select) for child in children[skip:skip + top]]}
+        if skip + top < len(children):
+            next_query = {key: value for key, value in query.items() if key != '$skiptoken'}
+            next_query['$skiptoken'] = skip + top
+            query_string = '&'.join(f'{key}={value}' for key, value in next_query.items())
+            page['@odata.nextLink'] = (f'{self.base_url}{API_PREFIX}/drives/{DRIVE_ID}/items/{quote(folder.id)}'
+                                       f'/children?{query_string}')
+        return page
+
+    def _delta(self, query, select):
+        top = min(int(query.get('$top', 200)), MAX_PAGE_SIZE)
+        token = int(query.get('token', 0))
+        if token != 0 and self.delta_expired:
+            raise GraphError(410, 'resyncRequired', 'The delta token is no longer valid.')
+        with self.drive._lock:
+            end = len(self.drive.changes)
+            if token == 0:
+                items = [self.item_json(item, select) for item in self._walk(self.drive.root)]
+            else:
+                latest = {}
+                for item_id, deleted, tombstone in self.drive.changes[token:end]:
+                    latest[item_id] = (deleted, tombstone)
+                items = []
+                for item_id, (deleted, tombstone) in latest.items():
+                    if deleted:
+                        items.append({'id': item_id, 'deleted': {'state': 'deleted'},
+                                      'parentReference': {'id': tombstone.parent.id if tombstone.parent else None}})
+                    elif (item := self.drive.items.get(item_id)) is not None:
+                        items.append(self.item_json(item, select))
+        skip = int(query.get('skip', 0))
+        page = {'value': items[skip:skip + top]}
+        base = f'{self.base_url}{API_PREFIX}/drives/{DRIVE_ID}/root/delta?token={token}'
+        if select:
+            base += f'&$select={",".join(sorted(select))}'
+        if skip + top < len(items):
+            page['@odata.nextLink'] = f'{base}&$top={top}&skip={skip + top}'
+        else:
+            page['@odata.deltaLink'] = base.replace(f'token={token}', f'token={end}')
+        return page
+
+    def _walk(self, item):
+        yield item
+        for child in item.children.values():
+            yield from self._walk(child)
+
+    def _route_batch(self, batch, headers):
+        responses = []
+        for request in batch['requests']:
+            body = jsonlib.dumps(request['body']).encode() if 'body' in request else b''
+            try:
+                if self.should_throttle():
+                    raise GraphError(429, 'activityLimitReached', 'Too many requests')
+                _, status, response_headers, json = self.route(request['method'], API_PREFIX + request['url'],
+                                                               headers, body)
+            except GraphError as error:
+                status, json = error.status, {'error': {'code': error.code, 'message': error.message}}
+                response_headers = {'Retry-After': str(self.retry_after)} if error.status == 429 else {}
+            response = {'id': request['id'], 'status': status, 'headers': response_headers}
+            if json is not None:
+                response['body'] = json
+            responses.append(response)
+        # Graph doesn't promise to answer in the order the requests were sent
+        if self.shuffle_batch_responses:
+            self._random.shuffle(responses)
+        return 'POST /$batch', 200, {}, {'responses': responses}
+
+    def _route_upload(self, method, session_id, headers, body):
+        if (session := self.drive.upload_sessions.get(session_id)) is None:
+            raise GraphError(404, 'itemNotFound', 'The upload session does not exist.')
+        template = f'{method} /upload/{{session}}'
+        if method == 'DELETE':
+            self.drive.upload_sessions.pop(session_id, None)
+            return template, 204, {}, None
+        if method == 'GET':
+            return template, 200, {}, {'nextExpectedRanges': self._expected_ranges(session)}
+        self.upload_puts += 1
+        if self.upload_puts in self.fail_upload_puts:
+            raise GraphError(500, 'generalException', 'Injected upload failure.')
+        # Like Graph, every fragment has to give the total size of the file, and it can't change
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)$', headers.get('Content-Range', ''))
+        if match is None:
+            raise GraphError(400, 'invalidRange', 'Content-Range is missing or invalid.')
+        start, end = int(match.group(1)), int(match.group(2))
+        if end - start + 1 != len(body):
+            raise GraphError(400, 'invalidRange', 'Content-Range does not match body length.')
+        if session['size'] not in (None, int(match.group(3))):
+            raise GraphError(400, 'invalidRange', 'Content-Range total does not match earlier fragments.')
+        session['size'] = int(match.group(3))
+        if len(session['data']) < end + 1:
+            session['data'].extend(b'\0' * (end + 1 - len(session['data'])))
+        session['data'][start:end + 1] = body
+        session['received'].append((start, end))
+        if session['size'] is not None and not self._expected_ranges(session):
+            self.drive.upload_sessions.pop(session_id, None)
+            item = self.drive.add(session['parent'], session['name'], content=session['data'][:session['size']],
+                                  conflict='replace')
+            return template, 201, {}, self.item_json(item)
+        return template, 202, {}, {'nextExpectedRanges': self._expected_ranges(session)}
+
+    def _expected_ranges(self, session):
+        missing = []
+        position = 0
+        for start, end in sorted(session['received']):
+            if start > position:
+                missing.append(f'{position}-{start - 1}')
+            position = max(position, end + 1)
+        if session['size'] is None:
+            missing.append(f'{position}-')
+        elif position < session['size']:
+            missing.append(f'{position}-{session["size"] - 1}')
+        return missing
+
+    def _route_download(self, method, item_id, headers, query):
+        item_id = item_id.split('?')[0]
+        if self.fail_downloads:
+            raise GraphError(500, 'generalException', 'Injected download failure.')
+        if int(query.get('g', 0)) < self._download_url_generation:
+            raise GraphError(self.expired_url_status, 'unauthenticated', 'The download url has expired.')
+        if (item := self.drive.items.get(item_id)) is None:
+            raise GraphError(404, 'itemNotFound', 'The resource could not be found.')
+        content = item.content
+        if (match := re.match(r'bytes=(\d+)-(\d*)', headers.get('Range', ''))) is not None:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(content) - 1
+            end = min(end, len(content) - 1)
+            return ('GET /download/{id} (range)', 206,
+                    {'Content-Range': f'bytes {start}-{end}/{len(content)}', 'Accept-Ranges': 'bytes'},
+                    content[start:end + 1])
+        return 'GET /download/{id}', 200, {'Accept-Ranges': 'bytes'}, content
+
+    def _route_monitor(self, monitor_id):
+        monitor = self.drive.monitors[monitor_id]
+        monitor['polls'] += 1
+        if monitor['polls'] < 2:
+            return 'GET /monitor/{id}', 202, {}, {'status': 'inProgress', 'percentageComplete': 50.0}
+        return 'GET /monitor/{id}', 200, {}, {'status': 'completed', 'percentageComplete': 100.0,
+                                             'resourceId': monitor['resourceId']}
+
+class MockGraphRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in one write, otherwise Nagle's algorithm and delayed ACKs add 40ms to every response
+    wbufsize = 65536
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if self.server.bandwidth:
+            time.sleep(len(body) / self.server.bandwidth)
+        return body
+
+    def _send(self, status, headers, payload):
+        if isinstance(payload, (dict, list)):
+            payload = jsonlib.dumps(payload).encode()
+            headers = {'Content-Type': 'application/json', **headers}
+        payload = payload or b''
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.server.bandwidth:
+            time.sleep(len(payload) / self.server.bandwidth)
+        self.wfile.write(payload)
+        self.wfile.flush()
+        self.server.count_bytes_out(len(payload))
+
+    def _handle(self):
+        body = self._read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        template = f'{self.command} {urlsplit(self.path).path}'
+        try:
+            if self.server.should_throttle():
+                self.server.count_request(self.command, 'throttled', len(body))
+                raise GraphError(429, 'activityLimitReached', 'The request has been throttled.')
+            template, status, headers, payload = self.server.route(self.command, self.path, self.headers, body)
+            self.server.count_request(self.command, template.split(' ', 1)[1], len(body))
+        except GraphError as error:
+            if error.status != 429:
+                self.server.count_request(self.command, template.split(' ', 1)[1], len(body))
+            status = error.status
+            headers = {'Retry-After': str(self.server.retry_after)} if error.status == 429 else {}
+            payload = {'error': {'code': error.code, 'message': error.message}}
+        self._send(status, headers, payload)
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _handle
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for Microsoft Graph')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second for bodies (0 = unlimited)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    args = parser.parse_args()
+    server = MockGraphServer(('127.0.0.1', args.port), args.latency, args.bandwidth, args.throttle_rate)
+    print(f'mock graph listening on {server.base_url}{API_PREFIX}')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
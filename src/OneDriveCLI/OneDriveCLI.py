@@ -1,80 +1,466 @@
+import time
+_import_started = time.perf_counter()
 import sqlite3
 import logging
-import requests
+import threading
 import json as jsonlib
 import os
 import sys
-from datetime import datetime
+import random
+import base64
+import shlex
+import contextvars
+import math
+import mmap
+import re
+import queue
+import fnmatch
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from datetime import datetime, timezone
+from itertools import chain
+from urllib.parse import quote, urlsplit
 if not (path := os.path.abspath(os.path.dirname(__file__))) in sys.path:
     sys.path.append(path)
-from OneDriveTokenHandler.OneDriveTokenHandler import OneDriveTokenHandler
+_import_seconds = time.perf_counter() - _import_started
+
+# requests (and the token handler, which pulls in MSAL) take most of the time needed to start up, so they're only
+# imported once a command needs to talk to OneDrive. See _get_http_session() and _token_handler.
+requests = None
+# The same goes for asyncio and aiohttp, which only AsyncOneDriveClient needs. See AsyncOneDriveClient.open().
+asyncio = None
+aiohttp = None
 
 logger = logging.getLogger(__name__)
-                           
-class OneDriveCLI:
+
+# Every HTTP request made while a command runs is recorded in this list (see run_command), including those made by the
+# command's worker threads
+command_requests = contextvars.ContextVar('command_requests', default=None)
+
+# The session (and so the working directory) of the command being run, when it isn't the OneDriveCLI object's own. The
+# daemon runs commands from many shells at once.
+command_session = contextvars.ContextVar('command_session', default=None)
+
+class OneDriveAPIError(Exception):
+
+    def __init__(self, status_code, code, message) -> None:
+        super().__init__(f'{code} | {message} (status code {status_code})')
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+class RequestScheduler:
+
+    # Every request to OneDrive waits for a slot here. The number of slots follows AIMD: each request that isn't
+    # throttled widens the window by 1/window, a throttled one halves it, and a Retry-After pauses everything until
+    # it has passed. Throttles from requests sent before the last cut are ignored so one burst only halves it once.
+
+    BACKOFF_BASE = 0.5
+    BACKOFF_CAP = 60
+
+    def __init__(self, max_in_flight) -> None:
+        self._logger = logger.getChild(__class__.__name__)
+        self._max_in_flight = max_in_flight
+        self._limit = float(max_in_flight)
+        self._in_flight = 0
+        self._generation = 0
+        self._resume_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while (delay := self._resume_at - time.monotonic()) > 0 or self._in_flight >= int(self._limit):
+                self._condition.wait(delay if delay > 0 else None)
+            self._in_flight += 1
+            return self._generation
+
+    def release(self, generation, throttled=False, retry_after=None):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._throttled(generation, retry_after)
+            else:
+                self._limit = min(float(self._max_in_flight), self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def throttled(self, retry_after=None):
+        # For throttles reported outside of a request's own response, e.g. in $batch sub-responses
+        with self._condition:
+            self._throttled(self._generation, retry_after)
+            self._condition.notify_all()
+
+    def _throttled(self, generation, retry_after):
+        if retry_after is not None:
+            self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+        if generation == self._generation:
+            self._generation += 1
+            self._limit = max(1.0, self._limit / 2)
+            self._logger.debug(f'throttled, requests in flight limited to {int(self._limit)}')
+
+    def backoff(self, attempt):
+        # Full jitter, so that threads throttled together don't all come back at the same moment
+        return random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt))
+
+class UploadChunkSizer:
+
+    # Upload session chunks must be a multiple of 320 KiB and smaller than 60 MiB. The size is adjusted after every
+    # chunk so that sending one takes about TARGET_SECONDS: fast links get fewer, bigger chunks, and a failed chunk
+    # halves the size so that less has to be sent again on a flaky link. Growth is limited to doubling each time.
+    UNIT = 327680
+    MAX_UNITS = 191
+    TARGET_SECONDS = 5.0
+
+    def __init__(self, initial_size) -> None:
+        self._lock = threading.Lock()
+        self._units = self._clamp(initial_size // self.UNIT)
+
+    def _clamp(self, units):
+        return max(1, min(self.MAX_UNITS, units))
+
+    @property
+    def size(self):
+        return self._units * self.UNIT
+
+    def succeeded(self, size, seconds):
+        with self._lock:
+            target_units = int(size / max(seconds, 0.001) * self.TARGET_SECONDS) // self.UNIT
+            self._units = self._clamp(min(target_units, self._units * 2))
+
+    def failed(self):
+        with self._lock:
+            self._units = self._clamp(self._units // 2)
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+
+    # Tasks run in a copy of the submitting thread's context, so output from worker threads goes to the same daemon
+    # client as the command that started them
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+class QuickXorHash:
+
+    # OneDrive's quickXorHash XORs byte n of a file into a 160 bit circular register at bit (11 * n) % 160. As 11 and
+    # 160 share no factors, every byte at the same offset modulo 160 lands on the same bits, so data is XORed together
+    # a stripe at a time as big integers and the 160 per-lane rotations are only worked out once, in digest().
+
+    WIDTH_IN_BITS = 160
+    SHIFT = 11
+    LANES = 160
+    STRIPE_SIZE = LANES * 256
+
+    def __init__(self, data=b'') -> None:
+        self._stripes = 0
+        self._tail = b''
+        self._length = 0
+        self.update(data)
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        self._length += len(data)
+        if self._tail:
+            fill = min(self.STRIPE_SIZE - len(self._tail), len(data))
+            self._tail += bytes(data[:fill])
+            data = data[fill:]
+            if len(self._tail) < self.STRIPE_SIZE:
+                return
+            self._stripes ^= int.from_bytes(self._tail, 'little')
+            self._tail = b''
+        aligned = len(data) - len(data) % self.STRIPE_SIZE
+        stripes = self._stripes
+        for start in range(0, aligned, self.STRIPE_SIZE):
+            stripes ^= int.from_bytes(data[start:start + self.STRIPE_SIZE], 'little')
+        self._stripes = stripes
+        self._tail = bytes(data[aligned:])
+
+    def digest(self):
+        lanes = self._stripes ^ int.from_bytes(self._tail, 'little')
+        bits = self.STRIPE_SIZE * 8
+        while bits > self.LANES * 8:
+            bits //= 2
+            lanes = (lanes & ((1 << bits) - 1)) ^ (lanes >> bits)
+        register = 0
+        for lane, byte in enumerate(lanes.to_bytes(self.LANES, 'little')):
+            if byte:
+                shifted = byte << (lane * self.SHIFT) % self.WIDTH_IN_BITS
+                register ^= (shifted & ((1 << self.WIDTH_IN_BITS) - 1)) ^ (shifted >> self.WIDTH_IN_BITS)
+        digest = bytearray(register.to_bytes(self.WIDTH_IN_BITS // 8, 'little'))
+        for index, byte in enumerate((self._length & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'little')):
+            digest[self.WIDTH_IN_BITS // 8 - 8 + index] ^= byte
+        return bytes(digest)
+
+    def b64digest(self):
+        return base64.b64encode(self.digest()).decode()
+
+class OneDriveCore:
+
+    # What odc's commands and AsyncOneDriveClient share: the settings db with the tunables, metadata cache, download
+    # urls and drive index kept in it, the access token, and how OneDrive paths map to Graph urls. OneDriveCLI builds
+    # its commands on top of it and AsyncOneDriveClient keeps one of its own, so both use the same caches in the same
+    # way. Every method is safe to call from any thread.
 
     ONEDRIVE_ENDPOINT = 'https://graph.microsoft.com/v1.0'
     CLIENT_ID='9806a116-6f7d-4154-a06e-0c887dd51eed'
     AUTHORITY='https://login.microsoftonline.com/consumers'
     SCOPES=['Files.ReadWrite.All', 'openid']
 
+    # Tunables can be overridden in the settings db with 'odc config <key> <value>'
+    DEFAULT_TUNABLES = {
+        'http_pool_size': '10',
+        'http_connect_timeout': '10',
+        'http_read_timeout': '60',
+        'http_max_in_flight': '10',
+        'http_max_retries': '5',
+        'upload_workers': '1',
+        'put_workers': '4',
+        'get_workers': '4',
+        'sync_workers': '4',
+        'walk_workers': '8',
+        'upload_chunk_size': '10485760',
+        'download_workers': '4',
+        'download_range_size': '10485760',
+        'metadata_cache_ttl': '300',
+        'download_url_ttl': '300',
+        'index_max_age': '0',
+        'ls_page_size': '1000',
+        'stats_history': '100',
+    }
+    # Timeouts are seconds and can be fractional, every other tunable is a whole number of at least 1 unless 0 turns
+    # off what it controls
+    SECONDS_TUNABLES = ['http_connect_timeout', 'http_read_timeout']
+    ZERO_DISABLES_TUNABLES = ['http_max_retries', 'metadata_cache_ttl', 'download_url_ttl', 'index_max_age']
+
+    LS_SELECT = ['id', 'name', 'size', 'eTag', 'parentReference', 'folder', 'file', 'webUrl', 'createdBy', 'lastModifiedBy', 'fileSystemInfo', '@microsoft.graph.downloadUrl']
+    SIMPLE_UPLOAD_LIMIT = 4194304
+    EXPIRED_URL_STATUS_CODES = [401, 403, 404, 410]
+    IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+    SCHEMA_VERSION = 4
+    DB_BUSY_TIMEOUT = 30
+    TOKEN_LIFETIME = 3600
+    TOKEN_REFRESH_MARGIN = 300
+    TOKEN_RETRY_INTERVAL = 30
+
 # private:
-    
-    def _dbg_print_json(self, json_data):
-        json_formatted_str = jsonlib.dumps(json_data, indent=2)
-        print(json_formatted_str)
 
-    def __init__(self, settings_db='./settings.db') -> None:
+    def __init__(self, settings_db) -> None:
+        started = time.perf_counter()
+        self._timings = {'imports': _import_seconds}
         self._logger = logger.getChild(__class__.__name__)
-        self._logger.debug('creating OneDriveSynch object')
+        self._settings_db_filepath = settings_db
         self._setup_db(settings_db)
-        self._token_handler = OneDriveTokenHandler(app_name='onedrive-synch', client_id=self.CLIENT_ID, scopes=self.SCOPES, db_filepath=settings_db)
-        if self._get_setting('is_initialised') == 'true':
+        self._token_handler_instance = None
+        self._token_lock = threading.Lock()
+        self._access_token = None
+        self._token_refresher = None
+        if self.get_setting('is_initialised') == 'true':
             self._initialised = True
-            self._drive_id = self._get_setting('drive_id')
-            self._root = self._get_setting('root')
-            self._cwd = self._get_setting('cwd')
-            if self._get_setting('debug_on') == 'true':
-                self.debug_on(True)
+            self._drive_id = self.get_setting('drive_id')
+            self._root = self.get_setting('root')
+            if self.get_setting('debug_on') == 'true':
+                self._set_log_level(True)
         else:
             self._initialised = False
             self._drive_id = None
             self._root = None
-            self._cwd = None
-        self._logger.debug(f'drive id set to "{self._drive_id}" (if this is "None" then DB is new and Initialise() needs to be run)')
+        self._record_timing('settings db', started)
+
+    @property
+    def _token_handler(self):
+        with self._db_lock:
+            if self._token_handler_instance is None:
+                started = time.perf_counter()
+                from OneDriveTokenHandler.OneDriveTokenHandler import OneDriveTokenHandler
+                self._token_handler_instance = OneDriveTokenHandler(app_name='onedrive-synch', client_id=self.CLIENT_ID, scopes=self.SCOPES, db_filepath=self._settings_db_filepath)
+                self._record_timing('token handler', started)
+        return self._token_handler_instance
+
+    def _get_token_expiry(self, token):
+        # Tokens for work accounts are JWTs that carry their own expiry. Personal account tokens are opaque, so they're
+        # taken to last TOKEN_LIFETIME from when we got them.
+        try:
+            payload = token.split('.')[1]
+            return float(jsonlib.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+        except (IndexError, ValueError, KeyError, TypeError):
+            return time.time() + self.TOKEN_LIFETIME
+
+    def _refresh_access_token_forever(self):
+        # Refreshes the token ahead of expiry so that long transfers (and the daemon) never wait for it
+        while True:
+            time.sleep(max(1.0, self._access_token[1] - time.time()))
+            try:
+                self.refresh_access_token()
+            except Exception as e:
+                self._logger.debug(f'background refresh of access token failed: {e}')
+                time.sleep(self.TOKEN_RETRY_INTERVAL)
+
+    def _record_timing(self, phase, started):
+        self._timings[phase] = self._timings.get(phase, 0) + time.perf_counter() - started
+
+    def _set_log_level(self, debug):
+        logging.getLogger().setLevel(logging.DEBUG if debug else logging.ERROR)
 
     def _setup_db(self, settings_db):
         self._logger.debug('initialising settings database')
-        self._settings_db = sqlite3.connect(settings_db)
+        # Transfers run on worker threads which share this connection, the lock serialises our use of it
+        self._db_lock = threading.RLock()
+        # Any number of odc processes can have the db open at once. Writes wait up to DB_BUSY_TIMEOUT seconds for
+        # another process's to finish rather than failing with 'database is locked'.
+        self._settings_db = sqlite3.connect(settings_db, check_same_thread=False, timeout=self.DB_BUSY_TIMEOUT)
         self._settings_db.autocommit = True
+        self._settings = {}
         cursor = self._settings_db.cursor()
+        # Safe in WAL mode, a crash can only lose the last few writes and never corrupts the db
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        # user_version records which version of the tables below the db already has, so they're only checked when
+        # it changes. SCHEMA_VERSION must be bumped whenever a table is added or altered.
+        if cursor.execute('PRAGMA user_version').fetchall()[0][0] != self.SCHEMA_VERSION:
+            self._create_tables(cursor)
+        self._settings = dict(cursor.execute('SELECT key, value FROM settings').fetchall())
+        cursor.close()
+        return
+
+    def _create_tables(self, cursor):
+        self._logger.debug(f'updating settings db tables to version {self.SCHEMA_VERSION}')
+        # In WAL mode readers never wait for a writer, or a writer for readers. It's kept by the db file so it only
+        # needs setting once, and can't be changed inside a transaction.
+        cursor.execute('PRAGMA journal_mode = WAL')
+        # Another odc process may be updating the tables at the same time, whichever gets the write lock first does it
+        cursor.execute('BEGIN IMMEDIATE')
+        if cursor.execute('PRAGMA user_version').fetchall()[0][0] == self.SCHEMA_VERSION:
+            cursor.execute('COMMIT')
+            return
         cursor.execute('SELECT name FROM sqlite_master WHERE type="table" and name="settings"')
         if len(cursor.fetchall()) == 0:
             self._logger.debug('no "settings" table in db, creating')
             self._create_settings_db()
-        cursor.close()
-        return
+        cursor.execute('CREATE TABLE IF NOT EXISTS item_cache (path TEXT COLLATE NOCASE, item_id TEXT, etag TEXT, parent_id TEXT, type TEXT, size INTEGER, cached_at REAL, quick_xor_hash TEXT, PRIMARY KEY (path))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS drive_index (item_id TEXT, parent_id TEXT, name TEXT COLLATE NOCASE, type TEXT, size INTEGER, etag TEXT, created_by TEXT, created_at TEXT, modified_by TEXT, modified_at TEXT, web_url TEXT, quick_xor_hash TEXT, PRIMARY KEY (item_id))')
+        # Databases created before file hashes were kept need the column adding
+        for table in ['item_cache', 'drive_index']:
+            if 'quick_xor_hash' not in [column[1] for column in cursor.execute(f'PRAGMA table_info({table})').fetchall()]:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN quick_xor_hash TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS drive_index_parent ON drive_index (parent_id, name)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS download_urls (path TEXT COLLATE NOCASE, item_id TEXT, url TEXT, size INTEGER, etag TEXT, quick_xor_hash TEXT, expires_at REAL, PRIMARY KEY (path))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS upload_sessions (local_filepath TEXT, remote_filepath TEXT, file_size INTEGER, mtime_ns INTEGER, upload_url TEXT, expiration TEXT, committed TEXT, PRIMARY KEY (local_filepath, remote_filepath))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS sync_state (local_dir TEXT, remote_dir TEXT COLLATE NOCASE, path TEXT COLLATE NOCASE, size INTEGER, mtime_ns INTEGER, quick_xor_hash TEXT, PRIMARY KEY (local_dir, remote_dir, path))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS local_hashes (path TEXT, inode INTEGER, size INTEGER, mtime_ns INTEGER, quick_xor_hash TEXT, PRIMARY KEY (path))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS command_stats (id INTEGER PRIMARY KEY, command TEXT, started_at REAL, seconds REAL, exit_code INTEGER)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS request_stats (command_id INTEGER, method TEXT, endpoint TEXT, requests INTEGER, errors INTEGER, retries INTEGER, wait REAL, bytes_sent INTEGER, bytes_received INTEGER, latency REAL, latency_histogram TEXT, PRIMARY KEY (command_id, method, endpoint))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS sessions (name TEXT, cwd TEXT, used_at REAL, PRIMARY KEY (name))')
+        cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        cursor.execute('COMMIT')
 
     def _create_settings_db(self):
         cursor = self._settings_db.cursor()
         cursor.execute('CREATE TABLE settings (key TEXT, value TEXT, PRIMARY KEY (key))')
         self._logger.debug('created settings db')
         cursor.close()
-        self._upsert_setting('is_initialised', 'false')
+        self.upsert_setting('is_initialised', 'false')
+
+    def _get_descendants_pattern(self, remote_path):
+        prefix = '' if remote_path == '/' else remote_path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'{prefix}/%'
+
+    def _cache_download_urls(self, items):
+        # Listings hand back a short lived download url for every file, which are kept so that a get soon afterwards
+        # can go straight to the download. Metadata without a url may be for a newer version of the file, so any url
+        # kept for it is dropped.
+        ttl = self.get_tunable('download_url_ttl')
+        expires_at = time.time() + ttl
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('DELETE FROM download_urls WHERE expires_at <= ?', (time.time(),))
+            cursor.executemany('DELETE FROM download_urls WHERE path = ?', [(remote_path,) for remote_path, json in items if ttl <= 0 or '@microsoft.graph.downloadUrl' not in json])
+            if ttl > 0:
+                cursor.executemany('INSERT INTO download_urls (path, item_id, url, size, etag, quick_xor_hash, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                                   'ON CONFLICT (path) DO UPDATE SET item_id = excluded.item_id, url = excluded.url, size = excluded.size, etag = excluded.etag, quick_xor_hash = excluded.quick_xor_hash, expires_at = excluded.expires_at',
+                                   [(remote_path, json['id'], json['@microsoft.graph.downloadUrl'], json.get('size'), json.get('eTag'), self.get_quick_xor_hash(json), expires_at)
+                                    for remote_path, json in items if '@microsoft.graph.downloadUrl' in json])
+            cursor.close()
+
+    def _index_rows(self, items):
+        return [(item['id'],
+                 item.get('parentReference', {}).get('id') if 'root' not in item else None,
+                 item.get('name'),
+                 'd' if 'folder' in item else 'f',
+                 item.get('size'),
+                 item.get('eTag'),
+                 item.get('createdBy', {}).get('user', {}).get('displayName', ''),
+                 item.get('fileSystemInfo', {}).get('createdDateTime'),
+                 item.get('lastModifiedBy', {}).get('user', {}).get('displayName', ''),
+                 item.get('fileSystemInfo', {}).get('lastModifiedDateTime'),
+                 item.get('webUrl'),
+                 self.get_quick_xor_hash(item)) for item in items]
+
+# public:
+
+    def is_initialised(self):
+        return self._initialised
 
-    def _upsert_setting(self, key, value):
+    def get_setting(self, key):
+        # Every setting is read in one query when the db is opened
+        return self._settings.get(key)
+
+    def upsert_setting(self, key, value):
         self._logger.debug(f'updating value "{key}" to "{value}" in settings db')
-        cursor = self._settings_db.cursor()
-        cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = ?;', (key, value, value))
-        cursor.close()
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = ?;', (key, value, value))
+            cursor.close()
+            self._settings[key] = value
 
-    def _get_setting(self, key):
-        self._logger.debug(f'getting value for "{key}" from settings db')
-        cursor = self._settings_db.cursor()
-        result = cursor.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchall()
-        return result[0][0] if len(result) > 0 else None
-       
-    def _get_absolute_path(self, old_path, new_path):
+    def delete_setting(self, key):
+        self._logger.debug(f'deleting value "{key}" from settings db')
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('DELETE FROM settings WHERE key = ?', (key,))
+            cursor.close()
+            self._settings.pop(key, None)
+
+    def get_tunable(self, key, cast=int):
+        value = self.get_setting(key)
+        return cast(value if value is not None else self.DEFAULT_TUNABLES[key])
+
+    def get_cached_access_token(self):
+        # The token held in memory, or None if it needs refreshing. Never blocks.
+        if (access_token := self._access_token) is not None and time.time() < access_token[1]:
+            return access_token[0]
+        return None
+
+    def get_access_token(self):
+        # The token is held in memory and only looked up again once it's close to expiring
+        if (token := self.get_cached_access_token()) is not None:
+            return token
+        return self.refresh_access_token()
+
+    def refresh_access_token(self, rejected_token=None):
+        with self._token_lock:
+            # Another thread may have refreshed the token while this one waited for the lock
+            if self._access_token is None or self._access_token[0] == rejected_token or time.time() >= self._access_token[1]:
+                token = self._token_handler.get_token()
+                # Refresh TOKEN_REFRESH_MARGIN before expiry, or half way there for tokens that don't last that long
+                expires_at = self._get_token_expiry(token)
+                self._access_token = (token, expires_at - min(self.TOKEN_REFRESH_MARGIN, (expires_at - time.time()) / 2))
+                self._logger.debug(f'access token refreshed, expires at {datetime.fromtimestamp(expires_at)}')
+                if self._token_refresher is None:
+                    self._token_refresher = threading.Thread(target=self._refresh_access_token_forever, daemon=True)
+                    self._token_refresher.start()
+            return self._access_token[0]
+
+    def get_retry_after(self, headers):
+        # Retry-After is either a number of seconds or an HTTP date
+        if (retry_after := headers.get('Retry-After')) is None:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def get_absolute_path(self, old_path, new_path):
         self._logger.debug(f"attempting to wrangle new path from '{old_path}' based on relative path as {new_path}") 
         if new_path == '/':
             return new_path
@@ -84,265 +470,2079 @@ class OneDriveCLI:
             old.pop() if path == '..' else old.append(path)
         return '/' if old == [] else ('/' + '/'.join(old))
 
+    def get_parent_path(self, remote_path):
+        parent_dir_list = [path for path in remote_path.split('/') if path not in ['','.']]
+        parent_dir_list.pop()
+        return '/' if parent_dir_list == [] else ('/' + '/'.join(parent_dir_list))
+
+    def get_item_url(self, remote_path):
+        return f'{self._root[:-1]}' if remote_path == '/' else f'{self._root}{quote(remote_path)}'
+
+    def get_quick_xor_hash(self, json):
+        return json.get('file', {}).get('hashes', {}).get('quickXorHash')
+
+    def get_cached_item(self, remote_path):
+        if (ttl := self.get_tunable('metadata_cache_ttl')) <= 0:
+            return None
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT item_id, etag, parent_id, type, size, quick_xor_hash FROM item_cache WHERE path = ? AND cached_at > ?', (remote_path, time.time() - ttl)).fetchall()
+            cursor.close()
+        if len(result) == 0:
+            return None
+        self._logger.debug(f'metadata cache hit for "{remote_path}"')
+        item_id, etag, parent_id, item_type, size, quick_xor_hash = result[0]
+        return {'id': item_id, 'eTag': etag, 'parent_id': parent_id, 'type': item_type, 'size': size, 'quickXorHash': quick_xor_hash}
+
+    def cache_item(self, remote_path, json):
+        self.cache_items([(remote_path, json)])
+
+    def cache_items(self, items):
+        # items is a list of (remote_path, item json) pairs. A folder's eTag changes when anything inside it changes, so
+        # when a cached folder comes back with a new eTag everything cached beneath it is thrown away.
+        if len(items) == 0:
+            return
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            for remote_path, json in items:
+                if 'folder' not in json:
+                    continue
+                result = cursor.execute('SELECT etag FROM item_cache WHERE path = ?', (remote_path,)).fetchall()
+                if len(result) > 0 and result[0][0] != json.get('eTag'):
+                    self._logger.debug(f'eTag for "{remote_path}" has changed, invalidating cached descendants')
+                    cursor.execute('DELETE FROM item_cache WHERE path LIKE ? ESCAPE \'\\\'', (self._get_descendants_pattern(remote_path),))
+            cached_at = time.time()
+            cursor.executemany('INSERT INTO item_cache (path, item_id, etag, parent_id, type, size, cached_at, quick_xor_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                               'ON CONFLICT (path) DO UPDATE SET item_id = excluded.item_id, etag = excluded.etag, parent_id = excluded.parent_id, type = excluded.type, size = excluded.size, cached_at = excluded.cached_at, quick_xor_hash = excluded.quick_xor_hash',
+                               [(remote_path, json['id'], json.get('eTag'), json.get('parentReference', {}).get('id'), 'd' if 'folder' in json else 'f', json.get('size'), cached_at, self.get_quick_xor_hash(json)) for remote_path, json in items])
+            cursor.close()
+        self._cache_download_urls(items)
+
+    def uncache_item(self, remote_path):
+        self._logger.debug(f'removing "{remote_path}" and its descendants from metadata cache')
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('DELETE FROM item_cache WHERE path = ? OR path LIKE ? ESCAPE \'\\\'', (remote_path, self._get_descendants_pattern(remote_path)))
+            cursor.execute('DELETE FROM download_urls WHERE path = ? OR path LIKE ? ESCAPE \'\\\'', (remote_path, self._get_descendants_pattern(remote_path)))
+            cursor.close()
+
+    def get_cached_download_url(self, remote_path):
+        if self.get_tunable('download_url_ttl') <= 0:
+            return None
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT item_id, url, size, etag, quick_xor_hash FROM download_urls WHERE path = ? AND expires_at > ?', (remote_path, time.time())).fetchall()
+            cursor.close()
+        if len(result) == 0:
+            return None
+        self._logger.debug(f'download url cache hit for "{remote_path}"')
+        item_id, url, size, etag, quick_xor_hash = result[0]
+        return {'id': item_id, 'url': url, 'eTag': etag, 'type': 'f', 'size': size, 'quickXorHash': quick_xor_hash}
+
+    def uncache_download_url(self, remote_path):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('DELETE FROM download_urls WHERE path = ?', (remote_path,))
+            cursor.close()
+
+    def index_is_fresh(self):
+        if (max_age := self.get_tunable('index_max_age')) <= 0 or (refreshed_at := self.get_setting('index_refreshed_at')) is None:
+            return False
+        return time.time() - float(refreshed_at) < max_age
+
+    def index_items(self, items):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.executemany('INSERT INTO drive_index (item_id, parent_id, name, type, size, etag, created_by, created_at, modified_by, modified_at, web_url, quick_xor_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                               'ON CONFLICT (item_id) DO UPDATE SET parent_id = excluded.parent_id, name = excluded.name, type = excluded.type, size = excluded.size, etag = excluded.etag, created_by = excluded.created_by, '
+                               'created_at = excluded.created_at, modified_by = excluded.modified_by, modified_at = excluded.modified_at, web_url = excluded.web_url, quick_xor_hash = excluded.quick_xor_hash',
+                               self._index_rows(items))
+            cursor.close()
+
+    def unindex_items(self, item_ids):
+        # Delta doesn't always report the descendants of a deleted folder, so anything left without a parent is
+        # removed a level at a time until nothing is orphaned
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.executemany('DELETE FROM drive_index WHERE item_id = ?', [(item_id,) for item_id in item_ids])
+            while cursor.execute('DELETE FROM drive_index WHERE parent_id IS NOT NULL AND parent_id NOT IN (SELECT item_id FROM drive_index)').rowcount > 0:
+                pass
+            cursor.close()
+
+    def get_indexed_item_id(self, remote_path):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            item_id = self.get_setting('index_root_id')
+            for name in [path for path in remote_path.split('/') if path != '']:
+                result = cursor.execute('SELECT item_id FROM drive_index WHERE parent_id = ? AND name = ?', (item_id, name)).fetchall()
+                if len(result) == 0:
+                    cursor.close()
+                    return None
+                item_id = result[0][0]
+            cursor.close()
+        return item_id
+
+    def get_indexed_item(self, remote_path):
+        self._logger.debug(f'looking up "{remote_path}" in drive index')
+        if (item_id := self.get_indexed_item_id(remote_path)) is None:
+            return None
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            item_id, etag, parent_id, item_type, size, quick_xor_hash = cursor.execute('SELECT item_id, etag, parent_id, type, size, quick_xor_hash FROM drive_index WHERE item_id = ?', (item_id,)).fetchall()[0]
+            cursor.close()
+        return {'id': item_id, 'eTag': etag, 'parent_id': parent_id, 'type': item_type, 'size': size, 'quickXorHash': quick_xor_hash}
+
+    def get_indexed_children(self, remote_path):
+        # Rows are shaped like the JSON returned by /children so that callers don't need to care where they came from
+        if (item_id := self.get_indexed_item_id(remote_path)) is None:
+            return None
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT item_id, parent_id, name, type, size, etag, created_by, created_at, modified_by, modified_at, web_url, quick_xor_hash FROM drive_index WHERE parent_id = ? ORDER BY name', (item_id,)).fetchall()
+            cursor.close()
+        return [{'id': item_id,
+                 'parentReference': {'id': parent_id},
+                 'name': name,
+                 'folder' if item_type == 'd' else 'file': {} if quick_xor_hash is None else {'hashes': {'quickXorHash': quick_xor_hash}},
+                 'size': size,
+                 'eTag': etag,
+                 'createdBy': {'user': {'displayName': created_by}},
+                 'lastModifiedBy': {'user': {'displayName': modified_by}},
+                 'fileSystemInfo': {'createdDateTime': created_at, 'lastModifiedDateTime': modified_at},
+                 'webUrl': web_url} for item_id, parent_id, name, item_type, size, etag, created_by, created_at, modified_by, modified_at, web_url, quick_xor_hash in result]
+
+class OneDriveCLI(OneDriveCore):
+
+    LS_LOOKAHEAD = 200
+    WALK_SELECT = ['id', 'name', 'size', 'eTag', 'parentReference', 'folder', 'file', '@microsoft.graph.downloadUrl']
+    FIND_SELECT = ['id', 'name', 'size', 'eTag', 'parentReference', 'folder', 'file']
+    BATCH_LIMIT = 20
+    HASH_READ_SIZE = 10485760
+    UNCHANGED = 'unchanged'
+    URL_EXPIRED = 'url expired'
+    RETRY_STATUS_CODES = [429, 503]
+    SESSION_MAX_AGE = 2592000
+    LATENCY_BUCKETS_PER_DOUBLING = 4
+    COPY_POLL_INTERVAL = 0.5
+    COPY_POLL_INTERVAL_CAP = 10.0
+
+# private:
+    
+    def _dbg_print_json(self, json_data):
+        json_formatted_str = jsonlib.dumps(json_data, indent=2)
+        print(json_formatted_str)
+
+    def __init__(self, settings_db='./settings.db', session=None, cwd=None) -> None:
+        super().__init__(settings_db)
+        started = time.perf_counter()
+        self._logger = logger.getChild(__class__.__name__)
+        self._logger.debug('creating OneDriveSynch object')
+        self._http_session = None
+        self._session = self._open_session(session, cwd)
+        self._logger.debug(f'drive id set to "{self._drive_id}" (if this is "None" then DB is new and Initialise() needs to be run)')
+        self._record_timing('settings db', started)
+
+    def _open_session(self, name, cwd=None):
+        # A session starts in the directory it was last in, or in the one last cd'd to without a session. A cwd given
+        # for a single command is relative to that, and isn't saved.
+        saved_cwd = self.get_setting('cwd')
+        if name is not None:
+            with self._db_lock:
+                cursor = self._settings_db.cursor()
+                result = cursor.execute('SELECT cwd FROM sessions WHERE name = ?', (name,)).fetchall()
+                cursor.close()
+            saved_cwd = result[0][0] if len(result) > 0 else saved_cwd
+        if cwd is not None and saved_cwd is not None:
+            return {'name': name, 'cwd': self.get_absolute_path(saved_cwd, cwd), 'save': False}
+        return {'name': name, 'cwd': saved_cwd, 'save': True}
+
+    @property
+    def _cwd(self):
+        return (command_session.get() or self._session)['cwd']
+
+    @_cwd.setter
+    def _cwd(self, cwd):
+        (command_session.get() or self._session)['cwd'] = cwd
+
+    def _save_cwd(self):
+        session = command_session.get() or self._session
+        if not session['save']:
+            return
+        if session['name'] is None:
+            self.upsert_setting('cwd', session['cwd'])
+            return
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO sessions (name, cwd, used_at) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET cwd = excluded.cwd, used_at = excluded.used_at', (session['name'], session['cwd'], time.time()))
+            cursor.execute('DELETE FROM sessions WHERE used_at < ?', (time.time() - self.SESSION_MAX_AGE,))
+            cursor.close()
+
     def _get_default_api_headers(self, token):
         return {"Authorization": f"bearer {token}", "Accept": "application/json"}
     
+    def _get_http_session(self):
+        # One pooled, keep-alive session is shared by every request so that only the first call to each host
+        # pays for the TCP+TLS handshake. The pool doesn't block: requests has no timeout for waiting on a free
+        # connection, so a connection that was never handed back would hang every later request. The scheduler
+        # already limits how many requests are in flight, and connections beyond pool_maxsize are closed after use.
+        if self._http_session is None:
+            started = time.perf_counter()
+            global requests
+            import requests
+            pool_size = self.get_tunable('http_pool_size')
+            self._logger.debug(f'creating http session with pool size {pool_size}')
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+            self._http_session = requests.Session()
+            self._http_session.mount('https://', adapter)
+            self._http_session.mount('http://', adapter)
+            self._http_session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            self._http_timeout = (self.get_tunable('http_connect_timeout', float), self.get_tunable('http_read_timeout', float))
+            self._http_max_retries = self.get_tunable('http_max_retries')
+            self._scheduler = RequestScheduler(self.get_tunable('http_max_in_flight'))
+            self._chunk_sizer = UploadChunkSizer(self.get_tunable('upload_chunk_size'))
+            self._record_timing('http session', started)
+        return self._http_session
+
+    def _http_request(self, method, url, endpoint=None, **kwargs):
+        # 429s are always retried because OneDrive hasn't acted on the request. 503s and connection errors are only
+        # retried for idempotent methods, as there's no telling whether a POST went through. endpoint names the
+        # request in 'odc stats', it's worked out from the url if it isn't given.
+        session = self._get_http_session()
+        kwargs.setdefault('timeout', self._http_timeout)
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        attempt = 0
+        started = time.perf_counter()
+        wait_seconds = 0.0
+        while True:
+            wait_started = time.perf_counter()
+            generation = self._scheduler.acquire()
+            wait_seconds += time.perf_counter() - wait_started
+            response = error = None
+            throttled, retry_after = False, None
+            try:
+                response = session.request(method, url, **kwargs)
+                throttled = response.status_code == 429 or (response.status_code == 503 and idempotent)
+                retry_after = self.get_retry_after(response.headers) if throttled else None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt >= self._http_max_retries:
+                    raise
+                error = e
+            finally:
+                # The slot is given back however the request ends, even on Ctrl-C, or the shell and daemon would
+                # run out of them. Only a response can tell the scheduler about throttling.
+                self._scheduler.release(generation, throttled, retry_after)
+                if response is None and error is None:
+                    self._record_request(method, url, endpoint, None, False, started, wait_seconds, attempt)
+            if error is not None:
+                self._logger.debug(f'{method.lower()} request to {url} failed, retrying: {error}')
+                wait_started = time.perf_counter()
+                time.sleep(self._scheduler.backoff(attempt))
+                wait_seconds += time.perf_counter() - wait_started
+                attempt += 1
+                continue
+            if not throttled or attempt >= self._http_max_retries:
+                self._record_request(method, url, endpoint, response, kwargs.get('stream', False), started, wait_seconds, attempt)
+                return response
+            self._logger.debug(f'{method.lower()} request to {url} throttled with status code {response.status_code}, retry after: {retry_after}')
+            # Reading the (small) body lets a streamed response hand its connection back to the pool
+            response.content
+            if retry_after is None:
+                wait_started = time.perf_counter()
+                time.sleep(self._scheduler.backoff(attempt))
+                wait_seconds += time.perf_counter() - wait_started
+            attempt += 1
+
+    def _get_endpoint_template(self, url):
+        # Drive ids, item ids and paths are replaced so that requests to the same API are counted together
+        path = urlsplit(url).path.removeprefix(urlsplit(self.ONEDRIVE_ENDPOINT).path)
+        path = re.sub(r'/drives/[^/]+', '/drives/{drive-id}', path)
+        path = re.sub(r'/items/[^/:]+', '/items/{item-id}', path)
+        return re.sub(r':/[^:]*(:|$)', r':{path}\1', path)
+
+    def _record_request(self, method, url, endpoint, response, streamed, started, wait_seconds, retries):
+        # Latency is the time spent on the request itself, without waiting for a free slot or for throttling to end.
+        # The body of a streamed response hasn't been read yet, so what's received is taken from its Content-Length.
+        latency = time.perf_counter() - started - wait_seconds
+        endpoint = endpoint or self._get_endpoint_template(url)
+        status = response.status_code if response is not None else None
+        body = response.request.body if response is not None else None
+        bytes_sent = len(body) if isinstance(body, (bytes, str, memoryview)) else 0
+        if response is None:
+            bytes_received = 0
+        else:
+            bytes_received = int(response.headers.get('Content-Length', 0)) if streamed else len(response.content)
+        self._logger.debug(f'{method} {endpoint} status: {status}, sent: {bytes_sent}, received: {bytes_received}, latency: {latency * 1000:.1f} ms, retries: {retries}, wait: {wait_seconds * 1000:.1f} ms')
+        if (requests_made := command_requests.get()) is not None:
+            requests_made.append((method, endpoint, status, bytes_sent, bytes_received, latency, retries, wait_seconds))
+
+    def _get_latency_bucket(self, latency):
+        # Latencies are kept as histograms with LATENCY_BUCKETS_PER_DOUBLING buckets for every doubling in milliseconds
+        return max(0, math.floor(math.log2(max(latency * 1000, 1)) * self.LATENCY_BUCKETS_PER_DOUBLING))
+
+    def _get_latency_percentile(self, histogram, percentile):
+        # Returns the middle of the bucket the percentile falls in, in milliseconds
+        target = percentile / 100 * sum(histogram.values())
+        count = 0
+        for bucket in sorted(histogram, key=int):
+            if (count := count + histogram[bucket]) >= target:
+                return 2 ** ((int(bucket) + 0.5) / self.LATENCY_BUCKETS_PER_DOUBLING)
+
+    def _record_command_stats(self, command, started_at, seconds, exit_code, requests_made):
+        # Requests are summed up per endpoint, and only the last 'stats_history' commands are kept
+        endpoints = {}
+        for method, endpoint, status, bytes_sent, bytes_received, latency, retries, wait_seconds in requests_made:
+            stats = endpoints.setdefault((method, endpoint), {'requests': 0, 'errors': 0, 'retries': 0, 'wait': 0.0, 'bytes_sent': 0, 'bytes_received': 0, 'latency': 0.0, 'latency_histogram': {}})
+            stats['requests'] += 1
+            stats['errors'] += status is None or status >= 400
+            stats['retries'] += retries
+            stats['wait'] += wait_seconds
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['latency'] += latency
+            bucket = str(self._get_latency_bucket(latency))
+            stats['latency_histogram'][bucket] = stats['latency_histogram'].get(bucket, 0) + 1
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO command_stats (command, started_at, seconds, exit_code) VALUES (?, ?, ?, ?)', (command, started_at, seconds, exit_code))
+            command_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO request_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               [(command_id, method, endpoint, stats['requests'], stats['errors'], stats['retries'], stats['wait'], stats['bytes_sent'], stats['bytes_received'], stats['latency'], jsonlib.dumps(stats['latency_histogram']))
+                                for (method, endpoint), stats in endpoints.items()])
+            oldest = command_id - self.get_tunable('stats_history')
+            cursor.execute('DELETE FROM command_stats WHERE id <= ?', (oldest,))
+            cursor.execute('DELETE FROM request_stats WHERE command_id <= ?', (oldest,))
+            cursor.close()
+
+    def _onedrive_api_request(self, method, url, headers=None, **kwargs):
+        self._logger.debug(f'sending {method.lower()} request to {url}')
+        api_headers = self._get_default_api_headers(token := self.get_access_token())
+        if headers is not None:
+            api_headers.update(headers)
+        # nextLink and deltaLink urls handed back by Graph are already absolute
+        url = url if '://' in url else self.ONEDRIVE_ENDPOINT + url
+        if (response := self._http_request(method, url, headers=api_headers, **kwargs)).status_code != 401:
+            return response
+        # The token was revoked or expired earlier than we thought. Nothing was done with the request, so it's safe to
+        # send it again whatever the method.
+        self._logger.debug(f'{method.lower()} request to {url} was unauthorised, refreshing access token and retrying')
+        response.content
+        api_headers['Authorization'] = f'bearer {self.refresh_access_token(rejected_token=token)}'
+        return self._http_request(method, url, headers=api_headers, **kwargs)
+
     def _onedrive_api_get(self, url):
-        self._logger.debug(f'sending get request to {url}')
-        response = requests.get(self.ONEDRIVE_ENDPOINT + url, headers=self._get_default_api_headers(self._token_handler.get_token()))
-        return response
+        return self._onedrive_api_request('GET', url)
     
+    def _batch_request(self, sub_requests):
+        # Graph's /$batch endpoint takes up to 20 sub-requests at a time. Sub-responses can come back in any order so
+        # they're matched up with their request by id, and a failed batch is reported against each of its requests.
+        # Sub-requests are throttled individually, so those are sent again in a later batch.
+        self._get_http_session()
+        responses = [None] * len(sub_requests)
+        pending = list(range(len(sub_requests)))
+        attempt = 0
+        while pending:
+            retry, retry_after = [], None
+            for start in range(0, len(pending), self.BATCH_LIMIT):
+                batch = [dict(sub_requests[index], id=str(index)) for index in pending[start:start + self.BATCH_LIMIT]]
+                self._logger.debug(f'sending batch of {len(batch)} requests')
+                response = self._onedrive_api_request('POST', '/$batch', json={'requests': batch})
+                if 'error' in (json := response.json()):
+                    for request in batch:
+                        responses[int(request['id'])] = {'id': request['id'], 'status': response.status_code, 'body': json}
+                    continue
+                for sub_response in json['responses']:
+                    responses[index := int(sub_response['id'])] = sub_response
+                    if sub_response['status'] == 429 or (sub_response['status'] == 503 and sub_requests[index]['method'] in self.IDEMPOTENT_METHODS):
+                        retry.append(index)
+                        if (sub_retry_after := self.get_retry_after({key.title(): value for key, value in sub_response.get('headers', {}).items()})) is not None:
+                            retry_after = max(retry_after or 0.0, sub_retry_after)
+            if not retry or attempt >= self._http_max_retries:
+                break
+            self._logger.debug(f'{len(retry)} batched requests throttled, retry after: {retry_after}')
+            self._scheduler.throttled(retry_after)
+            if retry_after is None:
+                time.sleep(self._scheduler.backoff(attempt))
+            pending = sorted(retry)
+            attempt += 1
+        return responses
+
+    def _batch_error(self, response):
+        if 'error' in (body := response.get('body') or {}):
+            return f'{body["error"]["code"]} | {body["error"]["message"]}'
+        return f'status {response["status"]}'
+
+    def _get_item_metadata(self, remote_path):
+        if (item := self.get_cached_item(remote_path)) is not None:
+            return item
+        if self.index_is_fresh():
+            return self.get_indexed_item(remote_path)
+        response = self._onedrive_api_get(self.get_item_url(remote_path))
+        if 'error' in (json := response.json()):
+            # Only a 404 means the item isn't there, anything else (including a throttle that outlasted the retries)
+            # is raised rather than being mistaken for a missing item
+            if response.status_code != 404:
+                raise OneDriveAPIError(response.status_code, json['error']['code'], json['error']['message'])
+            self._logger.debug(f'item "{remote_path}" doesn\'t exist: {json["error"]["code"]} | {json["error"]["message"]}')
+            self.uncache_item(remote_path)
+            return None
+        self.cache_item(remote_path, json)
+        return self._get_item_summary(json)
+
+    def _get_item_summary(self, json):
+        return {'id': json['id'], 'eTag': json.get('eTag'), 'parent_id': json.get('parentReference', {}).get('id'), 'type': 'd' if 'folder' in json else 'f', 'size': json.get('size'), 'quickXorHash': self.get_quick_xor_hash(json)}
+
     def _get_onedrive_item_id(self, remote_path):
         self._logger.debug(f'trying to get item id for "{remote_path}"')
-        url = f'{self._root[:-1]}' if remote_path == '/' else f'{self._root}{remote_path}'
-        response = self._onedrive_api_get(url)
-        if 'error' in (json := response.json()):
-            self._logger.debug(f'error returned from API (this is fine if problem is item doesn\'t exist): {json["error"]["code"]} | {json["error"]["message"]}')
+        if (item := self._get_item_metadata(remote_path)) is None:
             return ''
-        return json['id']
+        return item['id']
 
     def _get_parent_item_id(self, remote_path):
-        parent_dir_list = [path for path in remote_path.split('/') if path not in ['','.']]
-        parent_dir_list.pop()
-        parent_dir = '/' if parent_dir_list == [] else ('/' + '/'.join(parent_dir_list))
-        return self._get_onedrive_item_id(parent_dir)
-
-    def _put_item_exists(self, local_file, remote_path):
-        self._logger.debug(f'trying to get item id for "{local_file}" in "{remote_path}"')
-        url = f'{self._root}/{local_file}' if remote_path == '/' else f'{self._root}{remote_path}/{local_file}'
-        self._logger.debug(f'item url is {url}')
-        response = self._onedrive_api_get(url)
-        if not 'error' in (response.json()):
-            return True
-        return False
+        return self._get_onedrive_item_id(self.get_parent_path(remote_path))
+
+    def _get_local_hash(self, local_filepath):
+        # Hashes are stored against the file's inode, size and mtime so a file is only read again once it has changed
+        stat = os.stat(local_filepath)
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT quick_xor_hash FROM local_hashes WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?', (local_filepath, stat.st_ino, stat.st_size, stat.st_mtime_ns)).fetchall()
+            cursor.close()
+        if len(result) > 0:
+            return result[0][0]
+        self._logger.debug(f'calculating quickXorHash of {local_filepath}')
+        quick_xor_hash = QuickXorHash()
+        buffer = bytearray(self.HASH_READ_SIZE)
+        with open(local_filepath, 'rb') as local_file:
+            while (bytes_read := local_file.readinto(buffer)):
+                quick_xor_hash.update(memoryview(buffer)[:bytes_read])
+        self._record_local_hash(local_filepath, (digest := quick_xor_hash.b64digest()), stat)
+        return digest
+
+    def _record_local_hash(self, local_filepath, quick_xor_hash, stat):
+        # If the file has changed since stat was taken the hash may not be for what's in it now, so it isn't kept
+        if ((current := os.stat(local_filepath)).st_ino, current.st_size, current.st_mtime_ns) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO local_hashes (path, inode, size, mtime_ns, quick_xor_hash) VALUES (?, ?, ?, ?, ?) '
+                           'ON CONFLICT (path) DO UPDATE SET inode = excluded.inode, size = excluded.size, mtime_ns = excluded.mtime_ns, quick_xor_hash = excluded.quick_xor_hash',
+                           (local_filepath, stat.st_ino, stat.st_size, stat.st_mtime_ns, quick_xor_hash))
+            cursor.close()
+
+    def _is_unchanged(self, local_filepath, remote_item):
+        # An interrupted ranged download leaves a full size file behind, hashing it would only read gigabytes of it
+        # before the download is resumed anyway
+        if os.path.exists(f'{local_filepath}.odc-part'):
+            return False
+        if remote_item.get('quickXorHash') is None or remote_item.get('size') != os.path.getsize(local_filepath):
+            return False
+        return self._get_local_hash(os.path.abspath(local_filepath)) == remote_item['quickXorHash']
 
     def _put_get_upload_session(self, local_file, remote_path):
         self._logger.debug(f'getting upload session for upload of {local_file} to {remote_path}')
         if (dir_id := self._get_onedrive_item_id(remote_path=remote_path)) == '':
             print(f'error: item: {remote_path} doesn\'t exist')
-            return ''
-        url = f'/drives/{self._drive_id}/items/{dir_id}:/{local_file}:/createUploadSession'
+            return None
+        url = f'/drives/{self._drive_id}/items/{dir_id}:/{quote(local_file)}:/createUploadSession'
         self._logger.debug(f'using url: {url}')
-        headers = self._get_default_api_headers(self._token_handler.get_token())
-        headers['Content-Type'] = 'application/json'
-        self._logger.debug(f'headers = {headers}')
-        response = requests.post(self.ONEDRIVE_ENDPOINT + url, headers=headers, json='{ "item": { "@microsoft.graph.conflictBehavior": "replace" } }')
+        response = self._onedrive_api_request('POST', url, json={ "item": { "@microsoft.graph.conflictBehavior": "replace" } })
         if 'error' in (json := response.json()):
             print(f'error: {json['error']['code']} | {json['error']['message']}')
-            return ''
-        return json['uploadUrl']
-    
-    def _put_upload(self, local_filepath, upload_url):
-        chunk_size = 10485760 # Must be divisible by 327,680, according to MSFT
+            self.uncache_item(remote_path)
+            return None
+        return json
+
+    def _get_upload_session_record(self, local_filepath, remote_filepath):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT file_size, mtime_ns, upload_url, expiration, committed FROM upload_sessions WHERE local_filepath = ? AND remote_filepath = ?', (local_filepath, remote_filepath)).fetchall()
+            cursor.close()
+        return result[0] if len(result) > 0 else None
+
+    def _upsert_upload_session_record(self, local_filepath, remote_filepath, file_size, mtime_ns, upload_url, expiration, committed):
+        self._logger.debug(f'recording upload session for {local_filepath} -> {remote_filepath} ({len(committed)} committed range(s))')
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO upload_sessions (local_filepath, remote_filepath, file_size, mtime_ns, upload_url, expiration, committed) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                           'ON CONFLICT (local_filepath, remote_filepath) DO UPDATE SET file_size = excluded.file_size, mtime_ns = excluded.mtime_ns, upload_url = excluded.upload_url, expiration = excluded.expiration, committed = excluded.committed',
+                           (local_filepath, remote_filepath, file_size, mtime_ns, upload_url, expiration, jsonlib.dumps(committed)))
+            cursor.close()
+
+    def _update_upload_session_committed(self, local_filepath, remote_filepath, committed):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('UPDATE upload_sessions SET committed = ? WHERE local_filepath = ? AND remote_filepath = ?', (jsonlib.dumps(committed), local_filepath, remote_filepath))
+            cursor.close()
+
+    def _delete_upload_session_record(self, local_filepath, remote_filepath):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('DELETE FROM upload_sessions WHERE local_filepath = ? AND remote_filepath = ?', (local_filepath, remote_filepath))
+            cursor.close()
+
+    def _put_parse_ranges(self, ranges, file_size):
+        # nextExpectedRanges look like ["0-1048575", "2097152-"]; an open end means 'to the end of the file'
+        parsed = []
+        for byte_range in ranges:
+            start, _, end = byte_range.partition('-')
+            parsed.append((int(start), int(end) if end != '' else file_size - 1))
+        return parsed
+
+    def _put_next_chunk(self, pending, chunk_size):
+        # Cuts the next chunk off the front of the pending ranges
+        range_start, range_end = pending[0]
+        chunk = (range_start, min(range_start + chunk_size - 1, range_end))
+        if chunk[1] == range_end:
+            pending.popleft()
+        else:
+            pending[0] = (chunk[1] + 1, range_end)
+        return chunk
+
+    def _put_get_pending_ranges(self, upload_url, file_size):
+        try:
+            response = self._http_request('GET', upload_url, endpoint='uploadUrl', headers={"Accept": "application/json"})
+        except requests.RequestException as e:
+            self._logger.debug(f'could not get status of upload session: {e}')
+            return None
+        if response.status_code != 200:
+            self._logger.debug(f'upload session status request returned {response.status_code}: {response.text}')
+            return None
+        return self._put_parse_ranges(response.json().get('nextExpectedRanges', []), file_size)
+
+    def _put_resume_upload_session(self, local_filepath, remote_filepath):
+        if (record := self._get_upload_session_record(local_filepath, remote_filepath)) is None:
+            return None
+        file_size, mtime_ns, upload_url, expiration, committed = record
+        stat = os.stat(local_filepath)
+        try:
+            expired = expiration is not None and datetime.fromisoformat(expiration) <= datetime.now(timezone.utc)
+        except ValueError:
+            expired = False
+        if stat.st_size != file_size or stat.st_mtime_ns != mtime_ns or expired:
+            self._logger.debug(f'upload session for {local_filepath} is stale (expired: {expired}), discarding')
+            self._delete_upload_session_record(local_filepath, remote_filepath)
+            if not expired:
+                self._http_request('DELETE', upload_url, endpoint='uploadUrl')
+            return None
+        if (pending := self._put_get_pending_ranges(upload_url, file_size)) is None:
+            self._delete_upload_session_record(local_filepath, remote_filepath)
+            return None
+        committed_bytes = sum(end - start + 1 for start, end in jsonlib.loads(committed))
+        print(f'Resuming upload of [{local_filepath}] ({committed_bytes} of {file_size} bytes already uploaded)', flush=True)
+        return upload_url, pending, jsonlib.loads(committed)
+
+    def _put_upload_chunk(self, read_chunk, upload_url, chunk, file_size):
+        chunk_start, chunk_end = chunk
+        started = time.perf_counter()
+        try:
+            response = self._http_request('PUT',
+                                          upload_url,
+                                          endpoint='uploadUrl',
+                                          data=read_chunk(chunk_start, chunk_end),
+                                          headers={"Accept": "application/json",
+                                                   "Content-Length": f"{chunk_end - chunk_start + 1}",
+                                                   "Content-Range": f"bytes {chunk_start}-{chunk_end}/{file_size}"})
+        except requests.RequestException as e:
+            self._logger.debug(f'error uploading at chunk start: {chunk_start}, chunk_end: {chunk_end}: {e}')
+            self._chunk_sizer.failed()
+            return None
+        if response.status_code not in [202, 201, 200]:
+            self._logger.debug(f'error uploading at chunk start: {chunk_start}, chunk_end: {chunk_end} with HTTP status code as {response.status_code} and response as {response.text}')
+            self._chunk_sizer.failed()
+            return None
+        self._chunk_sizer.succeeded(chunk_end - chunk_start + 1, time.perf_counter() - started)
+        return response
+
+    def _put_upload_chunks(self, read_chunk, upload_url, ranges, file_size, workers, on_committed):
+        # Chunks are cut from the pending ranges as they're sent, at the size the chunk sizer has settled on. The final
+        # chunk completes the upload, so it is only sent once every other chunk has been accepted. Up to 'workers' of
+        # the remaining chunks are kept in flight at once, and chunks that fail are sent again (at the smaller size)
+        # until http_max_retries chunks have failed.
+        pending = deque(sorted(ranges))
+        in_flight = {}
+        failures = 0
+        response = None
+        with ContextThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or in_flight:
+                while pending and failures <= self._http_max_retries and len(in_flight) < workers:
+                    if (in_flight or len(pending) > 1) and pending[0][1] == file_size - 1 and pending[0][0] + self._chunk_sizer.size >= file_size:
+                        break
+                    chunk = self._put_next_chunk(pending, self._chunk_sizer.size)
+                    in_flight[executor.submit(self._put_upload_chunk, read_chunk, upload_url, chunk, file_size)] = chunk
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = in_flight.pop(future)
+                    if (chunk_response := future.result()) is None:
+                        failures += 1
+                        pending.appendleft(chunk)
+                        continue
+                    on_committed(chunk)
+                    if chunk[1] == file_size - 1:
+                        response = chunk_response
+        return None if pending else response
+
+    def _put_upload(self, local_filepath, remote_filepath, upload_url, pending, committed, progress=True):
+        self._get_http_session()
+        workers = self.get_tunable('upload_workers')
         file_size = os.path.getsize(local_filepath)
-        print(f'Uploading [{local_filepath}] ({file_size} bytes)',flush=True)
-        chunk_start = 0
-        chunk_end = 0
-        with open(local_filepath, 'rb') as upload_file:
-            while (bytes_read := upload_file.read(chunk_size)):
-                self._logger.debug(f'bytes_read = {len(bytes_read)}')
-                chunk_end = upload_file.tell()
-                if (response := requests.put(upload_url, 
-                                            bytes_read, 
-                                            headers={"Accept": "application/json", 
-                                                    "Content-Length": f"{file_size}", 
-                                                    "Content-Range": f"bytes {chunk_start}-{chunk_end-1}/{file_size}"})).status_code not in [202, 201, 200]:
-                    print(f'\nerror uploading file {local_filepath} with HTTP status code as {response.status_code} and response as {response.text}, partial upload you may need to delete manually')
-                    self._logger.debug(f'error uploading at chunk start: {chunk_start}, chunk_end: {chunk_end}')
-                    upload_file.close()
-                    return
+        if progress:
+            print(f'Uploading [{local_filepath}] ({file_size} bytes)',flush=True)
+
+        def on_committed(chunk):
+            committed.append(chunk)
+            self._update_upload_session_committed(local_filepath, remote_filepath, committed)
+            if progress:
                 print('.', end='', flush=True)
-                chunk_start = upload_file.tell()
-        print('Done')
-        response = requests.delete(upload_url) # Clean up
-        self._logger.debug(f'delete upload url response: {response.status_code}')
 
-    def _download(self, url, filename, destination):
-        chunk_size = 10485760
-        print(f'Downloading [{filename}] to [{destination}]', flush=True)
-        if (response := requests.get(url, stream=True)).status_code != 200:
-            print(f'error: could not download file: status code: {response.status_code}')
+        with open(local_filepath, 'rb') as upload_file:
+            # Chunks are sent straight from a memory map of the file rather than being copied into a new buffer each
+            # time. The map is released once the last view of it (the one in the final response's request) goes.
+            try:
+                mapped_file = memoryview(mmap.mmap(upload_file.fileno(), 0, access=mmap.ACCESS_READ))
+                read_chunk = lambda chunk_start, chunk_end: mapped_file[chunk_start:chunk_end + 1]
+            except (OSError, ValueError):
+                read_chunk = lambda chunk_start, chunk_end: os.pread(upload_file.fileno(), chunk_end - chunk_start + 1, chunk_start)
+            response = self._put_upload_chunks(read_chunk, upload_url, pending, file_size, workers, on_committed)
+            if response is None and workers > 1:
+                # Graph is entitled to reject fragments that arrive out of order, so anything still missing is sent
+                # again one chunk at a time before giving up
+                self._logger.debug('concurrent upload failed, retrying missing ranges sequentially')
+                if (pending := self._put_get_pending_ranges(upload_url, file_size)):
+                    response = self._put_upload_chunks(read_chunk, upload_url, pending, file_size, 1, on_committed)
+        if response is None:
+            print(f'\nerror uploading file {local_filepath}, upload interrupted. Run the same put command again to resume the upload')
+            return None
+        # The upload session is closed by Graph once the last chunk is accepted, so there is nothing left to delete
+        self._delete_upload_session_record(local_filepath, remote_filepath)
+        self.cache_item(remote_filepath, (json := response.json()))
+        self.index_items([json])
+        if progress:
+            print('Done')
+        return json
+
+    def _create_folder(self, parent_id, name, conflict_behavior):
+        url = f'/drives/{self._drive_id}/items/{parent_id}/children'
+        payload = (
+                    {
+                        "name": name,
+                        "folder": { },
+                        "@microsoft.graph.conflictBehavior": conflict_behavior
+                    }
+                  )
+        return self._onedrive_api_request('POST', url, json=payload)
+
+    def _put_ensure_folder(self, remote_path, parent_id):
+        if (item := self.get_cached_item(remote_path)) is not None:
+            return item['id']
+        if (response := self._create_folder(parent_id, remote_path.split('/')[-1], 'fail')).status_code == 201:
+            self.cache_item(remote_path, (json := response.json()))
+            self.index_items([json])
+            print(f'created: {remote_path}', flush=True)
+            return json['id']
+        if response.status_code == 409:
+            return self._get_onedrive_item_id(remote_path)
+        print(f'error: error occurred during creation of directory {remote_path}: {response.text}')
+        return ''
+
+    def _put_simple_upload(self, local_filepath, remote_path, remote_filepath, progress):
+        with open(local_filepath, 'rb') as upload_file:
+            bytes_read = upload_file.read()
+        if progress:
+            print(f'Uploading [{local_filepath}] ({len(bytes_read)} bytes)', flush=True)
+        if (json := self._put_content(bytes_read, remote_path, remote_filepath)) is not None and progress:
+            print('.Done')
+        return json
+
+    def _put_content(self, content, remote_path, remote_filepath):
+        # Graph accepts files smaller than 4MB in a single PUT, which saves creating (and tidying up) an upload session
+        if (dir_id := self._get_onedrive_item_id(remote_path=remote_path)) == '':
+            print(f'error: item: {remote_path} doesn\'t exist')
+            return None
+        url = f'/drives/{self._drive_id}/items/{dir_id}:/{quote(os.path.basename(remote_filepath))}:/content'
+        response = self._onedrive_api_request('PUT', url, data=content, headers={'Content-Type': 'application/octet-stream'})
+        if 'error' in (json := response.json()):
+            print(f'error: {json['error']['code']} | {json['error']['message']}')
+            self.uncache_item(remote_path)
+            return None
+        self.cache_item(remote_filepath, json)
+        self.index_items([json])
+        return json
+
+    def _read_fully(self, stream, buffer):
+        # Reads from a pipe can come back short, so keep reading until the buffer is full or the stream has ended
+        view = memoryview(buffer)
+        length = 0
+        while length < len(buffer) and (count := stream.readinto(view[length:])):
+            length += count
+        return length
+
+    def _put_stream(self, stream, remote_filepath):
+        # Every chunk sent to an upload session has to carry the total size of the file, which isn't known until stdin
+        # ends. Anything that fits in a single PUT is sent from memory, bigger streams are copied to an anonymous
+        # temporary file first and then uploaded from there like any other file.
+        remote_path = self.get_parent_path(remote_filepath)
+        buffer = bytearray(self.SIMPLE_UPLOAD_LIMIT)
+        length = self._read_fully(stream, buffer)
+        print(f'Uploading from stdin to [{remote_filepath}]', flush=True)
+        if length < self.SIMPLE_UPLOAD_LIMIT:
+            if (json := self._put_content(bytes(memoryview(buffer)[:length]), remote_path, remote_filepath)) is not None:
+                print(f'.Done ({length} bytes)')
+            return json
+        import shutil
+        import tempfile
+        with tempfile.TemporaryFile(prefix='odc-put-') as spool_file:
+            spool_file.write(buffer)
+            del buffer
+            shutil.copyfileobj(stream, spool_file, 1048576)
+            spool_file.flush()
+            file_size = spool_file.tell()
+            if (upload_session := self._put_get_upload_session(local_file=os.path.basename(remote_filepath), remote_path=remote_path)) is None:
+                return None
+            upload_url = upload_session['uploadUrl']
+            read_chunk = lambda chunk_start, chunk_end: os.pread(spool_file.fileno(), chunk_end - chunk_start + 1, chunk_start)
+            response = self._put_upload_chunks(read_chunk, upload_url, [(0, file_size - 1)], file_size, 1, lambda chunk: print('.', end='', flush=True))
+        if response is None:
+            print(f'\nerror: upload to {remote_filepath} failed, nothing has been saved')
+            self._http_request('DELETE', upload_url, endpoint='uploadUrl')
+            return None
+        self.cache_item(remote_filepath, (json := response.json()))
+        self.index_items([json])
+        print(f'Done ({file_size} bytes)')
+        return json
+
+    def _put_file(self, local_filepath, remote_path, progress=True):
+        remote_filepath = self.get_absolute_path(remote_path, os.path.basename(local_filepath))
+        stat = os.stat(local_filepath)
+        if stat.st_size < self.SIMPLE_UPLOAD_LIMIT:
+            json = self._put_simple_upload(local_filepath, remote_path, remote_filepath, progress)
+        else:
+            if (resumed := self._put_resume_upload_session(local_filepath, remote_filepath)) is not None:
+                upload_url, pending, committed = resumed
+            else:
+                if (upload_session := self._put_get_upload_session(local_file=os.path.basename(local_filepath), remote_path=remote_path)) is None:
+                    return None
+                upload_url = upload_session['uploadUrl']
+                pending = [(0, stat.st_size - 1)]
+                committed = []
+                self._upsert_upload_session_record(local_filepath, remote_filepath, stat.st_size, stat.st_mtime_ns, upload_url, upload_session.get('expirationDateTime'), committed)
+            json = self._put_upload(local_filepath=local_filepath, remote_filepath=remote_filepath, upload_url=upload_url, pending=pending, committed=committed, progress=progress)
+        # OneDrive hands back the hash of what it received, which saves reading the file again next time
+        if json is not None and (quick_xor_hash := self.get_quick_xor_hash(json)) is not None:
+            self._record_local_hash(local_filepath, quick_xor_hash, stat)
+        return json
+
+    def _put_file_if_changed(self, local_filepath, remote_path, remote_item):
+        if remote_item is not None and self._is_unchanged(local_filepath, remote_item):
+            return self.UNCHANGED
+        return self._put_file(local_filepath, remote_path, False)
+
+    def _put_recursive(self, local_dir, remote_path):
+        # Folders are created a level at a time (each level only needs its parents to exist) and files are then
+        # uploaded on a pool of put_workers threads. Existing remote files are replaced.
+        local_dir = os.path.abspath(local_dir)
+        remote_base = self.get_absolute_path(remote_path, os.path.basename(local_dir))
+        if (parent_id := self._get_onedrive_item_id(remote_path)) == '':
+            print(f'error: item: {remote_path} doesn\'t exist')
             return
-        with open(destination if not os.path.isdir(destination) else f'{destination}/{filename}', 'wb') as destination_file:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                print('.', end='', flush=True)
-                destination_file.write(chunk)
-        print('Done')
+        levels = {}
+        files = []
+        for dirpath, _, filenames in os.walk(local_dir):
+            rel_dir = os.path.relpath(dirpath, local_dir)
+            remote_dir = remote_base if rel_dir == '.' else self.get_absolute_path(remote_base, rel_dir)
+            levels.setdefault(0 if rel_dir == '.' else rel_dir.count(os.sep) + 1, []).append(remote_dir)
+            files += [(os.path.join(dirpath, filename), remote_dir) for filename in sorted(filenames) if os.path.isfile(os.path.join(dirpath, filename))]
+        # Listing what's already there up front gives the hashes needed to skip unchanged files in one request per folder
+        remote_items = {}
+        if (item := self._get_item_metadata(remote_base)) is not None and item['type'] == 'd':
+            remote_items = {item_path.lower(): self._get_item_summary(json) for item_path, json in self._walk_remote(remote_base, self.WALK_SELECT) if 'file' in json}
+        folder_ids = {self.get_parent_path(remote_base): parent_id}
+        failed = 0
+        unchanged = 0
+        with ContextThreadPoolExecutor(max_workers=self.get_tunable('put_workers')) as executor:
+            for depth in sorted(levels):
+                futures = {executor.submit(self._put_ensure_folder, remote_dir, folder_ids.get(self.get_parent_path(remote_dir), '')): remote_dir for remote_dir in levels[depth] if folder_ids.get(self.get_parent_path(remote_dir), '') != ''}
+                for future, remote_dir in futures.items():
+                    try:
+                        if (folder_id := future.result()) != '':
+                            folder_ids[remote_dir] = folder_id
+                    except OneDriveAPIError as e:
+                        print(f'error: could not create directory {remote_dir}: {e}')
+            futures = {executor.submit(self._put_file_if_changed, local_filepath, remote_dir, remote_items.get(self.get_absolute_path(remote_dir, os.path.basename(local_filepath)).lower())): (local_filepath, remote_dir)
+                       for local_filepath, remote_dir in files if remote_dir in folder_ids}
+            failed += len(files) - len(futures)
+            for future in as_completed(futures):
+                local_filepath, remote_dir = futures[future]
+                try:
+                    result = future.result()
+                except OneDriveAPIError as e:
+                    print(f'error: could not upload {local_filepath}: {e}')
+                    result = None
+                if result == self.UNCHANGED:
+                    unchanged += 1
+                    continue
+                if result is None:
+                    failed += 1
+                    continue
+                print(f'uploaded: {self.get_absolute_path(remote_dir, os.path.basename(local_filepath))}', flush=True)
+        print(f'Done: {len(files) - failed - unchanged} file(s) uploaded, {unchanged} unchanged, {failed} failed')
+
+    def _download_read_sidecar(self, sidecar_filepath, file_size, etag, range_size):
+        try:
+            with open(sidecar_filepath, 'r') as sidecar_file:
+                sidecar = jsonlib.load(sidecar_file)
+        except (OSError, ValueError):
+            return None
+        if sidecar.get('size') != file_size or sidecar.get('etag') != etag or sidecar.get('range_size') != range_size:
+            self._logger.debug(f'sidecar {sidecar_filepath} is for a different version of the file, ignoring')
+            return None
+        return [tuple(completed) for completed in sidecar['completed']]
+
+    def _download_write_sidecar(self, sidecar_filepath, file_size, etag, range_size, completed):
+        # Written to a temporary file first so an interrupted write can never leave a corrupt sidecar behind
+        with open(f'{sidecar_filepath}.tmp', 'w') as sidecar_file:
+            jsonlib.dump({'size': file_size, 'etag': etag, 'range_size': range_size, 'completed': completed}, sidecar_file)
+        os.replace(f'{sidecar_filepath}.tmp', sidecar_filepath)
+
+    def _download_range(self, url, fd, byte_range):
+        range_start, range_end = byte_range
+        try:
+            # Closing the response hands its connection back to the pool, whether or not the body was read
+            with self._http_request('GET', url, endpoint='downloadUrl', stream=True, headers={'Accept-Encoding': 'identity', 'Range': f'bytes={range_start}-{range_end}'}) as response:
+                if response.status_code != 206:
+                    self._logger.debug(f'range request {range_start}-{range_end} returned status code {response.status_code}')
+                    return False
+                offset = range_start
+                for chunk in response.iter_content(chunk_size=1048576):
+                    offset += os.pwrite(fd, chunk, offset)
+        except requests.RequestException as e:
+            self._logger.debug(f'error downloading range {range_start}-{range_end}: {e}')
+            return False
+        return offset == range_end + 1
+
+    def _cat_range(self, url, byte_range):
+        range_start, range_end = byte_range
+        response = self._http_request('GET', url, endpoint='downloadUrl', headers={'Accept-Encoding': 'identity', 'Range': f'bytes={range_start}-{range_end}'})
+        if response.status_code != 206 or len(response.content) != range_end - range_start + 1:
+            raise OneDriveAPIError(response.status_code, 'rangeNotSatisfied', f'could not read bytes {range_start}-{range_end}')
+        return response.content
+
+    def _download_ranges(self, url, destination_filepath, file_size, etag, progress=True):
+        # Each range is written straight to its offset in a preallocated file. Completed ranges are recorded in a
+        # sidecar next to the destination so that running the same get again only fetches what is missing.
+        range_size = self.get_tunable('download_range_size')
+        workers = self.get_tunable('download_workers')
+        sidecar_filepath = f'{destination_filepath}.odc-part'
+        completed = None
+        if os.path.exists(destination_filepath) and os.path.getsize(destination_filepath) == file_size:
+            completed = self._download_read_sidecar(sidecar_filepath, file_size, etag, range_size)
+        if completed is None:
+            completed = []
+            with open(destination_filepath, 'wb') as destination_file:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(destination_file.fileno(), 0, file_size)
+                else:
+                    destination_file.truncate(file_size)
+            self._download_write_sidecar(sidecar_filepath, file_size, etag, range_size, completed)
+        elif progress:
+            print(f'Resuming download ({sum(end - start + 1 for start, end in completed)} of {file_size} bytes already downloaded)', flush=True)
+        pending = [(start, min(start + range_size, file_size) - 1) for start in range(0, file_size, range_size)]
+        pending = deque(byte_range for byte_range in pending if byte_range not in completed)
+        in_flight = {}
+        failed = False
+        with open(destination_filepath, 'r+b') as destination_file, ContextThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or in_flight:
+                while pending and not failed and len(in_flight) < workers:
+                    byte_range = pending.popleft()
+                    in_flight[executor.submit(self._download_range, url, destination_file.fileno(), byte_range)] = byte_range
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    byte_range = in_flight.pop(future)
+                    if not future.result():
+                        failed = True
+                        continue
+                    completed.append(byte_range)
+                    self._download_write_sidecar(sidecar_filepath, file_size, etag, range_size, completed)
+                    if progress:
+                        print('.', end='', flush=True)
+        if failed:
+            print(f'\nerror: download of {destination_filepath} interrupted. Run the same get command again to resume the download')
+            return False
+        os.remove(sidecar_filepath)
+        return True
+
+    def _download(self, url, filename, destination, file_size=None, etag=None, progress=True, quick_xor_hash=None, cached_url=False):
+        # A url remembered from an earlier listing may have expired, in which case URL_EXPIRED is returned without
+        # anything being written so the caller can look up a new one
+        chunk_size = 10485760
+        destination_filepath = destination if not os.path.isdir(destination) else f'{destination}/{filename}'
+        if file_size is not None and file_size > self.get_tunable('download_range_size'):
+            if progress:
+                print(f'Downloading [{filename}] to [{destination}]', flush=True)
+            if not self._download_ranges(url, destination_filepath, file_size, etag, progress):
+                return False
+        else:
+            try:
+                with self._http_request('GET', url, endpoint='downloadUrl', stream=True, headers={'Accept-Encoding': 'identity'}) as response:
+                    if response.status_code != 200:
+                        if cached_url and response.status_code in self.EXPIRED_URL_STATUS_CODES:
+                            return self.URL_EXPIRED
+                        print(f'error: could not download file: status code: {response.status_code}')
+                        return False
+                    if progress:
+                        print(f'Downloading [{filename}] to [{destination}]', flush=True)
+                    with open(destination_filepath, 'wb') as destination_file:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if progress:
+                                print('.', end='', flush=True)
+                            destination_file.write(chunk)
+            except requests.RequestException as e:
+                print(f'error: could not download file {filename}: {e}')
+                return False
+        # The file now holds what OneDrive hashed, so it won't need hashing the next time it is compared
+        if quick_xor_hash is not None:
+            self._record_local_hash(os.path.abspath(destination_filepath), quick_xor_hash, os.stat(destination_filepath))
+        if progress:
+            print('Done')
         self._logger.debug(f'file downloaded to {destination}')
-        pass
+        return True
+
+    def _get_children_pages(self, remote_path, select, item_id=None):
+        # Graph only returns a page of children at a time, the rest have to be fetched through @odata.nextLink
+        if item_id is not None:
+            url = f'/drives/{self._drive_id}/items/{item_id}/children'
+        else:
+            url = f'{self.get_item_url(remote_path)}{"/children" if remote_path == "/" else ":/children"}'
+        url += f'?$select={",".join(select)}&$top={self.get_tunable("ls_page_size")}'
+        while url is not None:
+            yield (json := self._onedrive_api_get(url).json())
+            if 'error' in json:
+                return
+            url = json.get('@odata.nextLink')
+
+    def _ls_rows(self, remote_path):
+        time_fmt = '%Y-%m-%d %H:%M:%S'
+        if self.index_is_fresh():
+            if (indexed_children := self.get_indexed_children(remote_path)) is None:
+                yield f'error: itemNotFound | {remote_path} is not in the drive index'
+                return
+            pages = [{'value': indexed_children}]
+        else:
+            pages = self._get_children_pages(remote_path, self.LS_SELECT)
+        for page in pages:
+            if 'error' in page:
+                yield f'error: {page['error']['code']} | {page['error']['message']}'
+                return
+            self.cache_items([(self.get_absolute_path(remote_path, item['name']), item) for item in page['value']])
+            for item in page['value']:
+                yield {
+                        'type': 'd' if 'folder' in item else 'f',
+                        'webUrl': item['webUrl'],
+                        'createdBy' : item['createdBy']['user']['displayName'],
+                        'createdDateTime' : datetime.strftime(datetime.fromisoformat(item['fileSystemInfo']['createdDateTime']), time_fmt),
+                        'lastModifiedBy': item['lastModifiedBy']['user']['displayName'],
+                        'lastModifiedDateTime': datetime.strftime(datetime.fromisoformat(item['fileSystemInfo']['lastModifiedDateTime']), time_fmt),
+                        'size': item['size'],
+                        'name': item['name'],
+                      }
+
+    def _ls_format_row(self, row, field_lengths):
+        return (
+                 f'{row['type']:<{field_lengths['type']+2}}'
+                 f'{row['webUrl']:<{field_lengths['webUrl']+2}}'
+                 f'{row['createdBy']:<{field_lengths['createdBy']+2}}'
+                 f'{row['createdDateTime']:<{field_lengths['createdDateTime']+2}}'
+                 f'{row['lastModifiedBy']:<{field_lengths['lastModifiedBy']+2}}'
+                 f'{row['lastModifiedDateTime']:<{field_lengths['lastModifiedDateTime']}}'
+                 f'{row['size']:>{field_lengths['size']+2}}'
+                 f'  '
+                 f'{row['name']:<{field_lengths['name']+2}}'
+               )
+
+    def _walk_remote(self, remote_path, select, errors=None, descend=None):
+        # Breadth first walk of everything beneath remote_path, yielding (path, item json) pairs as each page of
+        # children arrives. Folders are listed on a pool of 'walk_workers' threads, each fetching every page of one
+        # folder, and are addressed by id below the top so their names never need encoding. Empty folders aren't
+        # listed at all, and descend(path, item json) can prune any others. Folders that couldn't be listed are added
+        # to errors, for callers that can't work from a partial listing.
+        pages = queue.Queue()
+        def list_folder(folder_path, folder_id):
+            try:
+                for page in self._get_children_pages(folder_path, select, item_id=folder_id):
+                    pages.put((folder_path, page))
+            except Exception as e:
+                pages.put((folder_path, e))
+            pages.put((folder_path, None))
+        executor = ContextThreadPoolExecutor(max_workers=self.get_tunable('walk_workers'))
+        try:
+            executor.submit(list_folder, remote_path, None)
+            listing = 1
+            while listing > 0:
+                folder_path, page = pages.get()
+                if page is None:
+                    listing -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                if 'error' in page:
+                    print(f'error: {page['error']['code']} | {page['error']['message']} ({folder_path})')
+                    if errors is not None:
+                        errors.append(folder_path)
+                    continue
+                items = [(self.get_absolute_path(folder_path, item['name']), item) for item in page['value']]
+                self.cache_items(items)
+                for item_path, item in items:
+                    if 'folder' in item and item['folder'].get('childCount', 1) > 0 and (descend is None or descend(item_path, item)):
+                        executor.submit(list_folder, item_path, item['id'])
+                        listing += 1
+                    yield item_path, item
+        finally:
+            # Folders still waiting to be listed are dropped if the caller stops early
+            executor.shutdown(cancel_futures=True)
+
+    def _get_recursive(self, remote_path, local_dir):
+        # Download urls come back with the listing, so files are handed to the download pool as soon as they are
+        # seen without a metadata request of their own
+        local_base = os.path.join(local_dir, os.path.basename(remote_path) if remote_path != '/' else '')
+        os.makedirs(local_base, exist_ok=True)
+        futures = {}
+        failed = 0
+        unchanged = 0
+        with ContextThreadPoolExecutor(max_workers=self.get_tunable('get_workers')) as executor:
+            for item_path, item in self._walk_remote(remote_path, self.WALK_SELECT):
+                local_filepath = os.path.join(local_base, os.path.relpath(item_path, remote_path))
+                if 'folder' in item:
+                    os.makedirs(local_filepath, exist_ok=True)
+                    continue
+                if '@microsoft.graph.downloadUrl' not in item:
+                    self._logger.debug(f'no download url for {item_path}, skipping')
+                    continue
+                futures[executor.submit(self._download_if_changed, item, local_filepath)] = (item_path, local_filepath)
+            for future in as_completed(futures):
+                item_path, local_filepath = futures[future]
+                if (result := future.result()) == self.UNCHANGED:
+                    unchanged += 1
+                    continue
+                if not result:
+                    failed += 1
+                    continue
+                print(f'downloaded: {local_filepath}', flush=True)
+        print(f'Done: {len(futures) - failed - unchanged} file(s) downloaded, {unchanged} unchanged, {failed} failed')
+
+    def _download_if_changed(self, item, local_filepath):
+        if os.path.isfile(local_filepath) and self._is_unchanged(local_filepath, self._get_item_summary(item)):
+            return self.UNCHANGED
+        return self._download(item['@microsoft.graph.downloadUrl'], item['name'], local_filepath, item['size'], item.get('eTag'), False, self.get_quick_xor_hash(item))
+
+    def _sync_local_snapshot(self, local_dir):
+        local_files = {}
+        for dirpath, _, filenames in os.walk(local_dir):
+            for filename in filenames:
+                # Partial downloads are left alone, get picks them up again
+                if filename.endswith(('.odc-part', '.odc-part.tmp')) or not os.path.isfile(local_filepath := os.path.join(dirpath, filename)):
+                    continue
+                stat = os.stat(local_filepath)
+                rel_path = os.path.relpath(local_filepath, local_dir)
+                local_files[rel_path.lower()] = {'path': rel_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return local_files
+
+    def _sync_remote_snapshot(self, remote_dir, folder_id):
+        remote_files = {}
+        remote_folders = {'': folder_id}
+        prefix_length = len('' if remote_dir == '/' else remote_dir) + 1
+        errors = []
+        for item_path, json in self._walk_remote(remote_dir, self.WALK_SELECT, errors):
+            rel_path = item_path[prefix_length:]
+            if 'folder' in json:
+                remote_folders[rel_path.lower()] = json['id']
+            elif 'file' in json:
+                remote_files[rel_path.lower()] = dict(self._get_item_summary(json), path=rel_path, downloadUrl=json.get('@microsoft.graph.downloadUrl'), name=json['name'])
+        if errors:
+            return None
+        return remote_files, remote_folders
+
+    def _sync_get_state(self, local_dir, remote_dir):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            result = cursor.execute('SELECT path, size, mtime_ns, quick_xor_hash FROM sync_state WHERE local_dir = ? AND remote_dir = ?', (local_dir, remote_dir)).fetchall()
+            cursor.close()
+        return {path.lower(): {'size': size, 'mtime_ns': mtime_ns, 'quickXorHash': quick_xor_hash} for path, size, mtime_ns, quick_xor_hash in result}
+
+    def _sync_set_state(self, local_dir, remote_dir, rel_path, size, mtime_ns, quick_xor_hash):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            cursor.execute('INSERT INTO sync_state (local_dir, remote_dir, path, size, mtime_ns, quick_xor_hash) VALUES (?, ?, ?, ?, ?, ?) '
+                           'ON CONFLICT (local_dir, remote_dir, path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, quick_xor_hash = excluded.quick_xor_hash',
+                           (local_dir, remote_dir, rel_path, size, mtime_ns, quick_xor_hash))
+            cursor.close()
+
+    def _sync_forget_state(self, local_dir, remote_dir, rel_paths):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            # path is COLLATE NOCASE, so the lower cased keys used by the planner match too
+            cursor.executemany('DELETE FROM sync_state WHERE local_dir = ? AND remote_dir = ? AND path = ?', [(local_dir, remote_dir, rel_path) for rel_path in rel_paths])
+            cursor.close()
+
+    def _sync_plan(self, local_files, remote_files, synced_files, same_content):
+        # A single pass over every path seen on either side or at the last sync. Local files are judged changed by
+        # size and mtime, remote ones by quickXorHash, against what was recorded when the last sync finished.
+        # same_content is only called when both sides exist and at least one has changed.
+        plan = []
+        for key in sorted(local_files.keys() | remote_files.keys() | synced_files.keys()):
+            local, remote, synced = local_files.get(key), remote_files.get(key), synced_files.get(key)
+            local_changed = local is not None and (synced is None or (local['size'], local['mtime_ns']) != (synced['size'], synced['mtime_ns']))
+            remote_changed = remote is not None and (synced is None or remote['quickXorHash'] != synced['quickXorHash'])
+            if local is not None and remote is not None:
+                if not local_changed and not remote_changed:
+                    continue
+                if same_content(key):
+                    action = 'record'
+                elif local_changed and remote_changed:
+                    action = 'conflict'
+                else:
+                    action = 'upload' if local_changed else 'download'
+            elif local is not None:
+                action = 'upload' if local_changed else 'delete_local'
+            elif remote is not None:
+                action = 'download' if remote_changed else 'delete_remote'
+            else:
+                action = 'forget'
+            plan.append((action, key))
+        return plan
+
+    def _sync_ensure_folders(self, remote_dir, rel_dirs, remote_folders):
+        # Parents are created before their children, and folders created here are added to remote_folders
+        for rel_dir in sorted(rel_dirs, key=lambda rel_dir: rel_dir.count('/')):
+            if rel_dir.lower() in remote_folders:
+                continue
+            if (parent_id := remote_folders.get(os.path.dirname(rel_dir).lower(), '')) == '':
+                continue
+            if (folder_id := self._put_ensure_folder(self.get_absolute_path(remote_dir, rel_dir), parent_id)) != '':
+                remote_folders[rel_dir.lower()] = folder_id
+
+    def _sync_upload(self, local_dir, remote_dir, local):
+        local_filepath = os.path.join(local_dir, local['path'])
+        stat = os.stat(local_filepath)
+        remote_path = self.get_absolute_path(remote_dir, os.path.dirname(local['path'])) if os.path.dirname(local['path']) != '' else remote_dir
+        if (json := self._put_file(local_filepath, remote_path, False)) is None:
+            return False
+        self._sync_set_state(local_dir, remote_dir, local['path'], stat.st_size, stat.st_mtime_ns, self.get_quick_xor_hash(json))
+        return True
+
+    def _sync_download(self, local_dir, remote_dir, remote):
+        local_filepath = os.path.join(local_dir, remote['path'])
+        os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
+        if not self._download(remote['downloadUrl'], remote['name'], local_filepath, remote['size'], remote['eTag'], False, remote['quickXorHash']):
+            return False
+        stat = os.stat(local_filepath)
+        self._sync_set_state(local_dir, remote_dir, remote['path'], stat.st_size, stat.st_mtime_ns, remote['quickXorHash'])
+        return True
+
+    def _sync_execute(self, local_dir, remote_dir, plan, local_files, remote_files, remote_folders):
+        counts = {'upload': 0, 'download': 0, 'delete_local': 0, 'delete_remote': 0, 'conflict': 0, 'failed': 0}
+        self._sync_ensure_folders(remote_dir, {os.path.dirname(local_files[key]['path']) for action, key in plan if action == 'upload'} - {''}, remote_folders)
+        forgotten = []
+        deleted_ids = []
+        with ContextThreadPoolExecutor(max_workers=self.get_tunable('sync_workers')) as executor:
+            futures = {}
+            for action, key in plan:
+                if action == 'upload':
+                    if os.path.dirname(local_files[key]['path']).lower() not in remote_folders:
+                        counts['failed'] += 1
+                        continue
+                    futures[executor.submit(self._sync_upload, local_dir, remote_dir, local_files[key])] = (action, local_files[key]['path'])
+                elif action == 'download':
+                    futures[executor.submit(self._sync_download, local_dir, remote_dir, remote_files[key])] = (action, remote_files[key]['path'])
+            # Deletions and bookkeeping happen here while the transfers run
+            for action, key in plan:
+                if action == 'record':
+                    self._sync_set_state(local_dir, remote_dir, local_files[key]['path'], local_files[key]['size'], local_files[key]['mtime_ns'], remote_files[key]['quickXorHash'])
+                elif action == 'forget':
+                    forgotten.append(key)
+                elif action == 'conflict':
+                    print(f'conflict: {local_files[key]['path']} has changed locally and on OneDrive, skipped', flush=True)
+                    counts['conflict'] += 1
+                elif action == 'delete_local':
+                    try:
+                        os.remove(os.path.join(local_dir, local_files[key]['path']))
+                    except OSError as e:
+                        print(f'error: could not delete {local_files[key]['path']}: {e}', flush=True)
+                        counts['failed'] += 1
+                        continue
+                    print(f'deleted local: {local_files[key]['path']}', flush=True)
+                    forgotten.append(key)
+                    counts['delete_local'] += 1
+            remote_deletes = [key for action, key in plan if action == 'delete_remote']
+            responses = self._batch_request([{'method': 'DELETE', 'url': f'/drives/{self._drive_id}/items/{remote_files[key]['id']}'} for key in remote_deletes])
+            for key, response in zip(remote_deletes, responses):
+                if response['status'] not in [204, 404]:
+                    print(f'error: could not delete {remote_files[key]['path']} from OneDrive: {self._batch_error(response)}', flush=True)
+                    counts['failed'] += 1
+                    continue
+                self.uncache_item(self.get_absolute_path(remote_dir, remote_files[key]['path']))
+                print(f'deleted remote: {remote_files[key]['path']}', flush=True)
+                forgotten.append(key)
+                deleted_ids.append(remote_files[key]['id'])
+                counts['delete_remote'] += 1
+            self.unindex_items(deleted_ids)
+            for future in as_completed(futures):
+                action, rel_path = futures[future]
+                try:
+                    succeeded = future.result()
+                except OneDriveAPIError as e:
+                    print(f'error: could not {action} {rel_path}: {e}', flush=True)
+                    succeeded = False
+                if not succeeded:
+                    counts['failed'] += 1
+                    continue
+                print(f'{action}ed: {rel_path}', flush=True)
+                counts[action] += 1
+        self._sync_forget_state(local_dir, remote_dir, forgotten)
+        return counts
+
+    def _transfer_get_targets(self, rel_source_paths, rel_dest_path, verb):
+        # As with the shell's cp and mv, sources go inside the destination if it's an existing directory. Otherwise
+        # there can only be one source and it takes the destination's name. Returns the id of the directory the items
+        # end up in and a list of (source path, new path) pairs, or None if the command can't go ahead. Sources that
+        # would end up where they are or inside themselves are reported and left out.
+        abs_source_paths = list(dict.fromkeys(self.get_absolute_path(self._cwd, path) for path in rel_source_paths))
+        abs_dest_path = self.get_absolute_path(self._cwd, rel_dest_path)
+        if '/' in abs_source_paths:
+            print(f'error: cannot {verb} the root directory')
+            return None
+        if (dest := self._get_item_metadata(abs_dest_path)) is not None and dest['type'] == 'd':
+            parent_id = dest['id']
+            targets = [(path, self.get_absolute_path(abs_dest_path, path.split('/')[-1])) for path in abs_source_paths]
+        elif len(abs_source_paths) > 1:
+            print(f'error: {abs_dest_path} is not a directory')
+            return None
+        elif dest is not None:
+            print(f'error: {abs_dest_path} already exists')
+            return None
+        elif (parent_id := self._get_parent_item_id(abs_dest_path)) == '':
+            print(f'error: parent directory of {abs_dest_path} doesn\'t exist')
+            return None
+        else:
+            targets = [(abs_source_paths[0], abs_dest_path)]
+        for source, target in targets:
+            if target == source:
+                print(f'error: {source} is already at {target}')
+            elif target.startswith(f'{source}/'):
+                print(f'error: cannot {verb} {source} into itself')
+        return parent_id, [(source, target) for source, target in targets if target != source and not target.startswith(f'{source}/')]
+
+    def _transfer_get_item_url(self, remote_path, action=''):
+        # Items we already know the id of are addressed by id, the rest by path, so no lookups are needed up front.
+        # The index is only trusted while it's fresh as the wrong item could be moved otherwise.
+        if (item := self.get_cached_item(remote_path)) is not None:
+            item_id = item['id']
+        else:
+            item_id = self.get_indexed_item_id(remote_path) if self.index_is_fresh() else None
+        if item_id is not None:
+            return f'/drives/{self._drive_id}/items/{item_id}{"/" + action if action else ""}'
+        return f'{self.get_item_url(remote_path)}{":/" + action if action else ""}'
+
+    def _cp_poll(self, monitor_url):
+        # Monitor urls are pre-authenticated, so no token is sent. A 303 points at the finished copy, which isn't
+        # followed as it would need one. Returns None while the copy is running, '' once it has completed, or what
+        # went wrong if it failed.
+        response = self._http_request('GET', monitor_url, endpoint='monitor', allow_redirects=False)
+        if response.status_code == 303:
+            return ''
+        try:
+            json = response.json()
+        except ValueError:
+            json = {}
+        if 'error' in json:
+            return f'{json["error"].get("code")} | {json["error"].get("message")}'
+        if response.status_code >= 400:
+            return f'status {response.status_code}'
+        match json.get('status'):
+            case 'completed':
+                return ''
+            case 'failed' | 'deleteFailed' | 'cancelled':
+                return f'copy {json["status"]}'
+        return None
+
+    def _cp_wait(self, monitor_urls):
+        # Copies run on OneDrive's side, so all we can do is poll them. Every unfinished copy is polled each round and
+        # the wait between rounds doubles up to COPY_POLL_INTERVAL_CAP, so copying a big folder only costs a handful
+        # of requests however long it takes. Yields (monitor url, error) as each copy finishes.
+        pending = list(monitor_urls)
+        interval = self.COPY_POLL_INTERVAL
+        with ContextThreadPoolExecutor(max_workers=self.get_tunable('http_max_in_flight')) as executor:
+            while pending:
+                time.sleep(interval)
+                results = list(zip(pending, executor.map(self._cp_poll, pending)))
+                pending = [monitor_url for monitor_url, error in results if error is None]
+                self._logger.debug(f'{len(results) - len(pending)} copies finished, {len(pending)} still running')
+                for monitor_url, error in results:
+                    if error is not None:
+                        yield monitor_url, error
+                interval = min(self.COPY_POLL_INTERVAL_CAP, interval * 2)
 
 # public:
     
     def debug_on(self, on):
-        if on:
-            logging.getLogger().setLevel(logging.DEBUG)
-            self._upsert_setting('debug_on', 'true')
-        else:
-            logging.getLogger().setLevel(logging.ERROR)
-            self._upsert_setting('debug_on', 'false')
+        self._set_log_level(on)
+        self.upsert_setting('debug_on', 'true' if on else 'false')
 
     def initialise(self):
         self._logger.debug("initialising ods")
-        token = self._token_handler.get_token()
         response = self._onedrive_api_get('/me/drive')
-        response = requests.get(f'{self.ONEDRIVE_ENDPOINT}/me/drive', headers=self._get_default_api_headers(token))
         if 'id' not in (json := response.json()):
             self._logger.error('could not get drive id from msft graph response')
             print("error! no drive id in response from msft graph, cannot initialise ods")
             return
         self._logger.debug('got drive id from MSFT Graph, inserting into Settings db')
         self._drive_id = json['id']
-        self._upsert_setting('drive_id', self._drive_id)
+        self.upsert_setting('drive_id', self._drive_id)
         self._root = f'/drives/{self._drive_id}/root:'
-        self._upsert_setting('root', self._root)
+        self.upsert_setting('root', self._root)
         self._cwd = '/'
-        self._upsert_setting('cwd', self._cwd)
-        self._upsert_setting('debug_on','false')
+        self.upsert_setting('cwd', self._cwd)
+        self.upsert_setting('debug_on','false')
         self._initialised = True
-        self._upsert_setting('is_initialised', 'true')
+        self.upsert_setting('is_initialised', 'true')
         self._logger.debug('initialisation complete')
         self.cd('/')
 
-    def is_initialised(self):
-        return self._initialised
+    def config(self, key=None, value=None):
+        if key is None:
+            return '\n'.join(f'{tunable:<24}{self.get_tunable(tunable, str)}' for tunable in self.DEFAULT_TUNABLES)
+        if key not in self.DEFAULT_TUNABLES:
+            return f'error: unknown setting: {key}'
+        if value is not None:
+            if key in self.SECONDS_TUNABLES:
+                try:
+                    valid = 0 < float(value) < math.inf
+                except ValueError:
+                    valid = False
+                if not valid:
+                    return f'error: value for {key} must be a number of seconds greater than 0'
+            else:
+                minimum = 0 if key in self.ZERO_DISABLES_TUNABLES else 1
+                try:
+                    valid = int(value) >= minimum
+                except ValueError:
+                    valid = False
+                if not valid:
+                    return f'error: value for {key} must be a whole number of at least {minimum}'
+                value = str(int(value))
+            self.upsert_setting(key, value)
+        return f'{key:<24}{self.get_tunable(key, str)}'
+
+    def index(self, rebuild=False):
+        delta_link = None if rebuild else self.get_setting('delta_link')
+        select = 'id,name,size,eTag,parentReference,folder,file,root,deleted,webUrl,createdBy,lastModifiedBy,fileSystemInfo'
+        url = delta_link if delta_link is not None else f'/drives/{self._drive_id}/root/delta?$select={select}'
+        self._logger.debug(f'refreshing drive index from {"delta link" if delta_link is not None else "scratch"}')
+        if delta_link is None:
+            # Until the enumeration has finished the index is incomplete, so it mustn't be used or built on if it fails
+            with self._db_lock:
+                self._settings_db.execute('BEGIN IMMEDIATE')
+                self.delete_setting('index_refreshed_at')
+                self.delete_setting('delta_link')
+                self._settings_db.execute('DELETE FROM drive_index')
+                self._settings_db.execute('COMMIT')
+        changes = 0
+        while url is not None:
+            response = self._onedrive_api_get(url)
+            if response.status_code == 410:
+                # The delta link is too old to be used, the only way forward is to enumerate everything again
+                self._logger.debug('delta link has expired, rebuilding index')
+                return self.index(rebuild=True)
+            if 'error' in (json := response.json()):
+                return f'error: {json['error']['code']} | {json['error']['message']}'
+            with self._db_lock:
+                self._settings_db.execute('BEGIN IMMEDIATE')
+                self.index_items([item for item in json['value'] if 'deleted' not in item])
+                self.unindex_items([item['id'] for item in json['value'] if 'deleted' in item])
+                for item in json['value']:
+                    if 'root' in item:
+                        self.upsert_setting('index_root_id', item['id'])
+                self._settings_db.execute('COMMIT')
+            changes += len(json['value'])
+            url = json.get('@odata.nextLink')
+            delta_link = json.get('@odata.deltaLink', delta_link)
+        self.upsert_setting('delta_link', delta_link)
+        self.upsert_setting('index_refreshed_at', str(time.time()))
+        with self._db_lock:
+            count = self._settings_db.execute('SELECT COUNT(*) FROM drive_index').fetchall()[0][0]
+        return f'indexed: {count} items ({changes} changes applied)'
+
+    def timings(self, command_started):
+        # Network set up happens during the command, so 'http session' and 'token handler' are part of 'command'
+        now = time.perf_counter()
+        timings = dict(self._timings, command=now - command_started, total=now - _import_started)
+        return '\n'.join(f'timing: {phase:<16}{seconds * 1000:>9.1f} ms' for phase, seconds in timings.items())
+
+    def stats(self, command=None):
+        with self._db_lock:
+            cursor = self._settings_db.cursor()
+            commands = cursor.execute('SELECT command, COUNT(*), SUM(exit_code != 0), SUM(seconds) FROM command_stats WHERE ? IS NULL OR command = ? GROUP BY command ORDER BY command', (command, command)).fetchall()
+            endpoints = cursor.execute('SELECT command, method, endpoint, requests, errors, retries, wait, bytes_sent, bytes_received, latency, latency_histogram FROM request_stats JOIN command_stats ON id = command_id WHERE ? IS NULL OR command = ?', (command, command)).fetchall()
+            cursor.close()
+        if commands == []:
+            yield 'no commands recorded yet' if command is None else f'no {command} commands recorded yet'
+            return
+        totals = {}
+        for row in endpoints:
+            for total_key in [row[0], (row[1], row[2])]:
+                total = totals.setdefault(total_key, {'requests': 0, 'errors': 0, 'retries': 0, 'wait': 0.0, 'bytes': 0, 'latency': 0.0, 'latency_histogram': {}})
+                total['requests'] += row[3]
+                total['errors'] += row[4]
+                total['retries'] += row[5]
+                total['wait'] += row[6]
+                total['bytes'] += row[7] + row[8]
+                total['latency'] += row[9]
+                for bucket, count in jsonlib.loads(row[10]).items():
+                    total['latency_histogram'][bucket] = total['latency_histogram'].get(bucket, 0) + count
+        empty = {'requests': 0, 'errors': 0, 'retries': 0, 'wait': 0.0, 'bytes': 0, 'latency': 0.0, 'latency_histogram': {}}
+        # MB/s for a command is over the whole time it ran, for an endpoint it's over the time spent on its requests
+        yield f'{"command":<12}{"runs":>8}{"failed":>8}{"avg s":>9}{"requests":>10}{"retries":>9}{"wait s":>9}{"MB":>10}{"MB/s":>9}'
+        for name, runs, failed, seconds in commands:
+            total = totals.get(name, empty)
+            yield f'{name:<12}{runs:>8}{failed:>8}{seconds / runs:>9.2f}{total["requests"]:>10}{total["retries"]:>9}{total["wait"]:>9.1f}{total["bytes"] / 1048576:>10.1f}{total["bytes"] / 1048576 / seconds if seconds else 0:>9.1f}'
+        yield ''
+        endpoint_length = max([len(f'{key[0]} {key[1]}') for key in totals if isinstance(key, tuple)], default=0)
+        yield f'{"endpoint":<{endpoint_length}}{"requests":>10}{"errors":>8}{"retries":>9}{"wait s":>9}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}{"MB/s":>9}'
+        for key, total in sorted((key, total) for key, total in totals.items() if isinstance(key, tuple)):
+            percentiles = [self._get_latency_percentile(total['latency_histogram'], percentile) for percentile in [50, 90, 99]]
+            yield f'{f"{key[0]} {key[1]}":<{endpoint_length}}{total["requests"]:>10}{total["errors"]:>8}{total["retries"]:>9}{total["wait"]:>9.1f}{percentiles[0]:>9.1f}{percentiles[1]:>9.1f}{percentiles[2]:>9.1f}{total["bytes"] / 1048576 / total["latency"] if total["latency"] else 0:>9.1f}'
 
     def cd(self, path):
         self._logger.debug(f'attempting to change directory to "{path}"')
-        nwd = self._get_absolute_path(self._cwd, path)
+        nwd = self.get_absolute_path(self._cwd, path)
         # Check path is valid
-        root = self._root[:-1] if nwd == '/' else self._root
-        response = self._onedrive_api_get(root + nwd)
-        if 'error' in response.json():
+        if self._get_item_metadata(nwd) is None:
             return f'error: invaid path ({self._root + nwd})'
         self._cwd = nwd
-        self._upsert_setting('cwd', self._cwd)
+        self._save_cwd()
         return self._root + self._cwd
 
     def pwd(self):
         return self._root + self._cwd
 
     def ls(self):
-        time_fmt = '%Y-%m-%d %H:%M:%S'
-        # If we're at root, lop off the : and just add /children
-        url = self._root[:-1] + '/children' if self._cwd == '/' else self._root + self._cwd + ':/children'
-        response = self._onedrive_api_get(url)
-        if 'error' in (json := response.json()):
-            return f'error: {json['error']['code']} | {json['error']['message']}'
-        # Now to get nice, justified outlook
-        items = []
-        field_lengths = {}
-        field_lengths['type'] = 1
-        self._download_url_cache = {}
-        for item in json['value']:
-            createdDateTime_str = datetime.strftime(datetime.fromisoformat(item['fileSystemInfo']['createdDateTime']), time_fmt)
-            lastModifiedDateTime_str = datetime.strftime(datetime.fromisoformat(item['fileSystemInfo']['lastModifiedDateTime']), time_fmt)
-            items.append(
-                            {
-                                'id': item['id'],
-                                'createdBy' : item['createdBy']['user']['displayName'],
-                                'createdDateTime' : createdDateTime_str,
-                                'lastModifiedDateTime': lastModifiedDateTime_str,
-                                'size': item['size'],
-                                'lastModifiedBy': item['lastModifiedBy']['user']['displayName'],
-                                'name': item['name'],
-                                'type': 'd' if 'folder' in item else 'f',
-                                'webUrl': item['webUrl'],
-                            }
-                        )
-            
-            field_lengths['id'] = max(len(item['id']), field_lengths.get(id, 0))
-            field_lengths['createdBy'] = max(len(item['createdBy']['user']['displayName']), field_lengths.get('displayName',0))
-            field_lengths['createdDateTime'] = max(len(createdDateTime_str), field_lengths.get('createdDateTime', 0))
-            field_lengths['lastModifiedDateTime'] = max(len(lastModifiedDateTime_str), field_lengths.get('lastModifiedDateTime',0))
-            field_lengths['size'] = max(len(str(item['size'])), field_lengths.get('size', 0))
-            field_lengths['lastModifiedBy'] = max(len(item['lastModifiedBy']['user']['displayName']), field_lengths.get('displayName',0))
-            field_lengths['name'] = max(len(item['name']), field_lengths.get('name',0))
-            field_lengths['webUrl'] = max(len(item['webUrl']), field_lengths.get('webUrl',0))
-
-        listing = ''
-        for item in items:
-            listing += ( 
-                         f'{item['type']:<{field_lengths['type']+2}}'
-                         f'{item['webUrl']:<{field_lengths['webUrl']+2}}'
-                         f'{item['createdBy']:<{field_lengths['createdBy']+2}}'
-                         f'{item['createdDateTime']:<{field_lengths['createdDateTime']+2}}'
-                         f'{item['lastModifiedBy']:<{field_lengths['lastModifiedBy']+2}}'
-                         f'{item['lastModifiedDateTime']:<{field_lengths['lastModifiedDateTime']}}'
-                         f'{item['size']:>{field_lengths['size']+2}}'
-                         f'  '
-                         f'{item['name']:<{field_lengths['name']+2}}'
-                         f'\n'
-                       )
-        listing += f'\n{self._root + self._cwd}\n'
-        return listing
-
-    def get(self, rel_remote_filepath, local_path):
+        # Rows are printed as soon as the first page arrives. Column widths are settled from the first LS_LOOKAHEAD
+        # rows; anything wider further down the listing just pushes its line out a little.
+        rows = self._ls_rows(self._cwd)
+        lookahead = []
+        for row in rows:
+            if isinstance(row, str):
+                yield row
+                return
+            lookahead.append(row)
+            if len(lookahead) == self.LS_LOOKAHEAD:
+                break
+        field_lengths = {field: max([len(str(row[field])) for row in lookahead], default=0) for field in ['type', 'webUrl', 'createdBy', 'createdDateTime', 'lastModifiedBy', 'lastModifiedDateTime', 'size', 'name']}
+        for row in chain(lookahead, rows):
+            if isinstance(row, str):
+                yield row
+                return
+            yield self._ls_format_row(row, field_lengths)
+        yield ''
+        yield f'{self._root + self._cwd}'
+        yield ''
+
+    def get(self, rel_remote_filepath, local_path, recursive=False):
         self._logger.debug(f'attempting download of {rel_remote_filepath} to {local_path}')
+        if recursive:
+            if (item := self._get_item_metadata(abs_remote_dir := self.get_absolute_path(self._cwd, rel_remote_filepath))) is None or item['type'] != 'd':
+                print(f'error: {abs_remote_dir} is not a directory')
+                return
+            self._get_recursive(abs_remote_dir, local_path)
+            return
         remote_file = os.path.basename(rel_remote_filepath)
         rel_remote_path = os.path.dirname(rel_remote_filepath)
-        abs_remote_path = self._cwd if rel_remote_path == '' else self._get_absolute_path(self._cwd, rel_remote_path)
-        url = f'{self._root}/{remote_file}' if abs_remote_path == '/' else f'{self._root}{abs_remote_path}/{remote_file}'
-        response = self._onedrive_api_get(url)
+        abs_remote_path = self._cwd if rel_remote_path == '' else self.get_absolute_path(self._cwd, rel_remote_path)
+        abs_remote_filepath = self.get_absolute_path(abs_remote_path, remote_file)
+        local_filepath = local_path if not os.path.isdir(local_path) else f'{local_path}/{remote_file}'
+        # A download url kept from a recent listing saves looking the file up. Large files are fetched in ranges which
+        # can't fall back part way through, so they are always looked up.
+        if (cached := self.get_cached_download_url(abs_remote_filepath)) is not None and cached['size'] <= self.get_tunable('download_range_size'):
+            if os.path.isfile(local_filepath) and self._is_unchanged(local_filepath, cached):
+                print(f'skipped: {local_filepath} is the same as {abs_remote_filepath}')
+                return
+            if self._download(cached['url'], remote_file, local_path, file_size=cached['size'], etag=cached['eTag'], quick_xor_hash=cached['quickXorHash'], cached_url=True) != self.URL_EXPIRED:
+                return
+            self._logger.debug(f'download url for "{abs_remote_filepath}" has expired, looking it up again')
+            self.uncache_download_url(abs_remote_filepath)
+        response = self._onedrive_api_get(self.get_item_url(abs_remote_filepath))
         if 'error' in (json := response.json()):
             print(f'error: {json['error']['code']} | {json['error']['message']}')
+            self.uncache_item(abs_remote_filepath)
+            return
+        self.cache_item(abs_remote_filepath, json)
+        if os.path.isfile(local_filepath) and self._is_unchanged(local_filepath, self._get_item_summary(json)):
+            print(f'skipped: {local_filepath} is the same as {abs_remote_filepath}')
             return
-        self._download(json['@microsoft.graph.downloadUrl'], remote_file, local_path)
+        self._download(json['@microsoft.graph.downloadUrl'], remote_file, local_path, file_size=json['size'], etag=json.get('eTag'), quick_xor_hash=self.get_quick_xor_hash(json))
 
-    def put(self, local_filepath, rel_remote_path, force=False):
+    def put(self, local_filepath, rel_remote_path, force=False, recursive=False):
+        if local_filepath == '-':
+            if (remote_item := self._get_item_metadata(remote_filepath := self.get_absolute_path(self._cwd, rel_remote_path))) is not None and remote_item['type'] == 'd':
+                print(f'error: {remote_filepath} is a directory, put - needs the name of the file to upload to')
+                return
+            self._put_stream(sys.stdin.buffer, remote_filepath)
+            return
         local_file = os.path.basename(local_filepath)
-        remote_path = self.cwd if rel_remote_path == '' else self._get_absolute_path(self._cwd, rel_remote_path) 
-        if force == False and self._put_item_exists(local_file=local_file, remote_path=remote_path):
+        local_filepath = os.path.abspath(local_filepath)
+        remote_path = self._cwd if rel_remote_path == '' else self.get_absolute_path(self._cwd, rel_remote_path)
+        if recursive:
+            if not os.path.isdir(local_filepath):
+                print(f'error: {local_filepath} is not a directory')
+                return
+            self._put_recursive(local_filepath, remote_path)
+            return
+        remote_filepath = self.get_absolute_path(remote_path, local_file)
+        # An upload that was interrupted has already been agreed to, so only ask about new ones
+        if self._get_upload_session_record(local_filepath, remote_filepath) is None and (remote_item := self._get_item_metadata(remote_filepath)) is not None:
+            if self._is_unchanged(local_filepath, remote_item):
+                print(f'skipped: {remote_filepath} is the same as {local_filepath}')
+                return
             self._logger.debug('file found on one-drive, checking with user')
-            if input(f'[{local_file}] already exists on OneDrive in [{remote_path}], do you want to replace? (Y/N): ').upper() == 'N':
+            if force == False and input(f'[{local_file}] already exists on OneDrive in [{remote_path}], do you want to replace? (Y/N): ').upper() == 'N':
                 return ''
-        if (upload_url := self._put_get_upload_session(local_file=local_file, remote_path=remote_path)) == '':
-            return
-        self._put_upload(local_filepath=local_filepath, upload_url=upload_url)
+        self._put_file(local_filepath, remote_path)
         
-    def rm(self, rel_remote_path, force=False):
-        abs_remote_path = self._get_absolute_path(self._cwd, rel_remote_path)
-        self._logger.debug(f'attempting to remove item: {abs_remote_path}')
-        if (item_id := self._get_onedrive_item_id(remote_path=abs_remote_path)) == '':
-            print('error: item does not exist')
+    def rm(self, rel_remote_paths, force=False):
+        if isinstance(rel_remote_paths, str):
+            rel_remote_paths = [rel_remote_paths]
+        abs_remote_paths = list(dict.fromkeys(self.get_absolute_path(self._cwd, path) for path in rel_remote_paths))
+        self._logger.debug(f'attempting to remove items: {abs_remote_paths}')
+        if '/' in abs_remote_paths:
+            print('error: cannot remove the root directory')
             return
-        if input(f'Are you sure you want to move item {abs_remote_path} to the recycle bin? (Y/N)').upper() == 'N':
-            return ''        
-        url = f'/drives/{self._drive_id}/items/{item_id}'
-        headers = self._get_default_api_headers(self._token_handler.get_token())
-        response = requests.delete(self.ONEDRIVE_ENDPOINT + url, headers=headers)
-        if response.status_code != 204:
-            print(f'error: error occurred during deletion of item: {response.text}')
+        if len(abs_remote_paths) == 1:
+            if self._get_onedrive_item_id(remote_path=abs_remote_paths[0]) == '':
+                print('error: item does not exist')
+                return
+            prompt = f'item {abs_remote_paths[0]}'
+        else:
+            prompt = f'{len(abs_remote_paths)} items'
+        if not force and input(f'Are you sure you want to move {prompt} to the recycle bin? (Y/N)').upper() == 'N':
+            return ''
+        # Items we already know the id of are deleted by id, the rest by path, so no lookups are needed up front. The
+        # index is only trusted while it's fresh, as the wrong item could be deleted otherwise.
+        index_is_fresh = self.index_is_fresh()
+        item_ids = [item['id'] if (item := self.get_cached_item(path)) is not None else self.get_indexed_item_id(path) if index_is_fresh else None for path in abs_remote_paths]
+        batch = [{'method': 'DELETE', 'url': self.get_item_url(path) if item_id is None else f'/drives/{self._drive_id}/items/{item_id}'}
+                 for path, item_id in zip(abs_remote_paths, item_ids)]
+        deleted_ids = []
+        for path, item_id, response in zip(abs_remote_paths, item_ids, self._batch_request(batch)):
+            if response['status'] == 404:
+                print(f'error: item does not exist: {path}')
+            elif response['status'] != 204:
+                print(f'error: error occurred during deletion of item {path}: {self._batch_error(response)}')
+            else:
+                self.uncache_item(path)
+                if item_id is not None:
+                    deleted_ids.append(item_id)
+                print(f'deleted: {path}')
+        self.unindex_items(deleted_ids)
+
+    def mv(self, rel_source_paths, rel_dest_path):
+        if isinstance(rel_source_paths, str):
+            rel_source_paths = [rel_source_paths]
+        if (transfer := self._transfer_get_targets(rel_source_paths, rel_dest_path, 'move')) is None:
             return
-        print(f'deleted: {abs_remote_path}')        
+        parent_id, targets = transfer
+        self._logger.debug(f'attempting to move items: {targets}')
+        # A move is a single PATCH of the item's parent and name however big it is, so they all go in batches
+        batch = [{'method': 'PATCH',
+                  'url': self._transfer_get_item_url(source),
+                  'headers': {'Content-Type': 'application/json'},
+                  'body': {'parentReference': {'id': parent_id}, 'name': target.split('/')[-1]}} for source, target in targets]
+        moved = []
+        for (source, target), response in zip(targets, self._batch_request(batch)):
+            if response['status'] == 404:
+                print(f'error: item does not exist: {source}')
+            elif response['status'] == 409:
+                print(f'error: item already exists: {target}')
+            elif response['status'] != 200:
+                print(f'error: error occurred during move of item {source}: {self._batch_error(response)}')
+            else:
+                self.uncache_item(source)
+                self.uncache_item(target)
+                moved.append((target, response['body']))
+                print(f'moved: {source} -> {target}')
+        self.cache_items(moved)
+        # Descendants are indexed by their parent's id, so only the moved items themselves need updating
+        self.index_items([json for _, json in moved])
 
-    def mkdir(self, rel_remote_path):
-        abs_remote_path = self._get_absolute_path(self._cwd, rel_remote_path)
-        self._logger.debug(f'attempting to mkdir path: {abs_remote_path}')
-        if self._get_onedrive_item_id(remote_path=abs_remote_path) != '':
-            print('error: directory already exists')
+    def cp(self, rel_source_paths, rel_dest_path):
+        if isinstance(rel_source_paths, str):
+            rel_source_paths = [rel_source_paths]
+        if (transfer := self._transfer_get_targets(rel_source_paths, rel_dest_path, 'copy')) is None:
             return
-        if (parent_item_id := self._get_parent_item_id(abs_remote_path)) == '':
-            print('error: parent directory specified does not exist')
+        parent_id, targets = transfer
+        self._logger.debug(f'attempting to copy items: {targets}')
+        batch = [{'method': 'POST',
+                  'url': self._transfer_get_item_url(source, 'copy'),
+                  'headers': {'Content-Type': 'application/json'},
+                  'body': {'parentReference': {'driveId': self._drive_id, 'id': parent_id}, 'name': target.split('/')[-1]}} for source, target in targets]
+        monitors = {}
+        for (source, target), response in zip(targets, self._batch_request(batch)):
+            headers = {key.title(): value for key, value in response.get('headers', {}).items()}
+            if response['status'] == 202 and 'Location' in headers:
+                monitors[headers['Location']] = (source, target)
+            elif response['status'] == 404:
+                print(f'error: item does not exist: {source}')
+            elif response['status'] == 409:
+                print(f'error: item already exists: {target}')
+            else:
+                print(f'error: error occurred during copy of item {source}: {self._batch_error(response)}')
+        copied = 0
+        for monitor_url, error in self._cp_wait(monitors):
+            source, target = monitors[monitor_url]
+            if error != '':
+                print(f'error: error occurred during copy of item {source}: {error}', flush=True)
+                continue
+            print(f'copied: {source} -> {target}', flush=True)
+            copied += 1
+        # Copies of folders bring their contents with them, which only a delta query will tell the index about
+        if copied > 0 and self.index_is_fresh():
+            self._logger.debug(f'updating drive index after copy: {self.index()}')
+
+    def mkdir(self, rel_remote_paths):
+        if isinstance(rel_remote_paths, str):
+            rel_remote_paths = [rel_remote_paths]
+        abs_remote_paths = list(dict.fromkeys(self.get_absolute_path(self._cwd, path) for path in rel_remote_paths))
+        self._logger.debug(f'attempting to mkdir paths: {abs_remote_paths}')
+        # Parents have to exist before their children can be created, so each depth goes in its own set of batches
+        for depth in sorted({path.count('/') for path in abs_remote_paths}):
+            paths = [path for path in abs_remote_paths if path.count('/') == depth and path != '/']
+            batch = []
+            for path in paths:
+                if (parent := self.get_cached_item(parent_path := self.get_parent_path(path))) is not None:
+                    url = f'/drives/{self._drive_id}/items/{parent["id"]}/children'
+                else:
+                    url = f'{self.get_item_url(parent_path)}{"/children" if parent_path == "/" else ":/children"}'
+                batch.append({'method': 'POST',
+                              'url': url,
+                              'headers': {'Content-Type': 'application/json'},
+                              'body': {'name': path.split('/')[-1], 'folder': {}, '@microsoft.graph.conflictBehavior': 'fail'}})
+            created = []
+            for path, response in zip(paths, self._batch_request(batch)):
+                if response['status'] == 409:
+                    print(f'error: directory already exists: {path}')
+                elif response['status'] == 404:
+                    print(f'error: parent directory specified does not exist: {path}')
+                elif response['status'] != 201:
+                    print(f'error: error occurred during creation of directory {path}: {self._batch_error(response)}')
+                else:
+                    created.append((path, response['body']))
+                    print(f'created: {path}')
+            self.cache_items(created)
+            self.index_items([json for _, json in created])
+
+    def stat(self, rel_remote_paths):
+        if isinstance(rel_remote_paths, str):
+            rel_remote_paths = [rel_remote_paths]
+        abs_remote_paths = [self.get_absolute_path(self._cwd, path) for path in rel_remote_paths]
+        select = ','.join(self.LS_SELECT)
+        responses = self._batch_request([{'method': 'GET', 'url': f'{self.get_item_url(path)}?$select={select}'} for path in abs_remote_paths])
+        time_fmt = '%Y-%m-%d %H:%M:%S'
+        rows = []
+        for path, response in zip(abs_remote_paths, responses):
+            if response['status'] != 200:
+                rows.append(f'error: {self._batch_error(response)} ({path})')
+                continue
+            json = response['body']
+            rows.append({
+                         'type': 'd' if 'folder' in json else 'f',
+                         'lastModifiedDateTime': datetime.strftime(datetime.fromisoformat(json['fileSystemInfo']['lastModifiedDateTime']), time_fmt),
+                         'size': str(json.get('size', 0)),
+                         'id': json['id'],
+                         'path': path,
+                       })
+        self.cache_items([(path, response['body']) for path, response in zip(abs_remote_paths, responses) if response['status'] == 200])
+        field_lengths = {key: max([len(row[key]) for row in rows if isinstance(row, dict)], default=0) for key in ['size', 'id']}
+        for row in rows:
+            if isinstance(row, str):
+                yield row
+                continue
+            yield f'{row["type"]:<3}{row["lastModifiedDateTime"]:<21}{row["size"]:>{field_lengths["size"]}}  {row["id"]:<{field_lengths["id"]+2}}{row["path"]}'
+
+    def du(self, rel_remote_path='.', max_depth=None):
+        # OneDrive gives a folder's size as the total of everything beneath it, so folders deeper than max_depth never
+        # need listing. Folders are shown as they're found, parents before their children. The top item is always
+        # fetched as a cached size could be out of date.
+        remote_path = self.get_absolute_path(self._cwd, rel_remote_path)
+        response = self._onedrive_api_get(f'{self.get_item_url(remote_path)}?$select={",".join(self.FIND_SELECT)}')
+        if 'error' in (json := response.json()):
+            yield f'error: {json['error']['code']} | {json['error']['message']} ({remote_path})'
             return
-        url = f'/drives/{self._drive_id}/items/{parent_item_id}/children'
-        headers = self._get_default_api_headers(self._token_handler.get_token())
-        headers['Content-Type'] = 'application/json'
-        self._logger.debug(f'headers = {headers}')
-        payload = (
-                    {
-                        "name": f"{rel_remote_path.split('/')[-1]}",
-                        "folder": { },
-                        "@microsoft.graph.conflictBehavior": "rename"
-                    }
-                  )
-        response = requests.post(self.ONEDRIVE_ENDPOINT + url, headers=headers, json=payload)
-        if response.status_code != 201:
-            print(f'error: error occurred during creation of directory: {response.text}')
+        self.cache_item(remote_path, json)
+        yield f'{json["size"]}\t{remote_path}'
+        if 'folder' not in json or max_depth == 0:
             return
-        print(f'created: {abs_remote_path}')
+        base_depth = 0 if remote_path == '/' else remote_path.count('/')
+        descend = lambda item_path, json: max_depth is None or item_path.count('/') - base_depth < max_depth
+        for item_path, json in self._walk_remote(remote_path, self.FIND_SELECT, descend=descend):
+            if 'folder' in json:
+                yield f'{json["size"]}\t{item_path}'
 
-    def cat(self, local_path):
-        pass
+    def find(self, pattern, rel_remote_path='.', min_size=0):
+        # Names are matched case insensitively, as OneDrive's are. A folder smaller than min_size can't hold anything
+        # that big, so it isn't listed. Matches are shown as soon as the page they're in arrives.
+        remote_path = self.get_absolute_path(self._cwd, rel_remote_path)
+        if (item := self._get_item_metadata(remote_path)) is None:
+            yield f'error: item does not exist: {remote_path}'
+            return
+        if item['type'] != 'd':
+            yield f'error: {remote_path} is not a directory'
+            return
+        pattern = pattern.lower()
+        for item_path, json in self._walk_remote(remote_path, self.FIND_SELECT, descend=lambda item_path, json: json['size'] >= min_size):
+            if json['size'] >= min_size and fnmatch.fnmatchcase(json['name'].lower(), pattern):
+                yield item_path
+
+    def sync(self, local_dir, rel_remote_dir, dry_run=False):
+        local_dir = os.path.abspath(local_dir)
+        remote_dir = self.get_absolute_path(self._cwd, rel_remote_dir)
+        self._logger.debug(f'attempting sync of {local_dir} with {remote_dir}')
+        if not os.path.isdir(local_dir):
+            print(f'error: {local_dir} is not a directory')
+            return
+        if (item := self._get_item_metadata(remote_dir)) is not None and item['type'] != 'd':
+            print(f'error: {remote_dir} is not a directory')
+            return
+        if item is None and not dry_run:
+            if (parent_id := self._get_parent_item_id(remote_dir)) == '':
+                print(f'error: parent directory of {remote_dir} doesn\'t exist')
+                return
+            if (folder_id := self._put_ensure_folder(remote_dir, parent_id)) == '':
+                return
+            item = {'id': folder_id}
+        local_files = self._sync_local_snapshot(local_dir)
+        if item is None:
+            remote_files, remote_folders = {}, {'': None}
+        elif (remote_snapshot := self._sync_remote_snapshot(remote_dir, item['id'])) is None:
+            print(f'error: {remote_dir} could not be listed completely, nothing has been synced')
+            return
+        else:
+            remote_files, remote_folders = remote_snapshot
+        plan = self._sync_plan(local_files, remote_files, self._sync_get_state(local_dir, remote_dir),
+                               lambda key: self._is_unchanged(os.path.join(local_dir, local_files[key]['path']), remote_files[key]))
+        if dry_run:
+            labels = {'upload': 'upload', 'download': 'download', 'delete_local': 'delete local', 'delete_remote': 'delete remote', 'conflict': 'conflict'}
+            counts = {action: 0 for action in labels}
+            for action, key in plan:
+                if action in labels:
+                    print(f'{labels[action]}: {(local_files.get(key) or remote_files[key])['path']}')
+                    counts[action] += 1
+            print(f'Plan: {counts['upload']} upload(s), {counts['download']} download(s), {counts['delete_local']} local delete(s), {counts['delete_remote']} remote delete(s), {counts['conflict']} conflict(s)')
+            return
+        counts = self._sync_execute(local_dir, remote_dir, plan, local_files, remote_files, remote_folders)
+        print(f'Done: {counts['upload']} uploaded, {counts['download']} downloaded, {counts['delete_local']} deleted locally, {counts['delete_remote']} deleted from OneDrive, {counts['conflict']} conflict(s), {counts['failed']} failed')
+
+    def cat(self, rel_remote_filepath, output=None):
+        # The file is written out a range at a time, with up to 'download_workers' ranges read ahead, so memory use
+        # doesn't depend on the size of the file. Errors go to stderr to keep them out of the piped output.
+        abs_remote_filepath = self.get_absolute_path(self._cwd, rel_remote_filepath)
+        response = self._onedrive_api_get(self.get_item_url(abs_remote_filepath))
+        if 'error' in (json := response.json()):
+            print(f'error: {json['error']['code']} | {json['error']['message']}', file=sys.stderr)
+            self.uncache_item(abs_remote_filepath)
+            return False
+        self.cache_item(abs_remote_filepath, json)
+        if 'folder' in json:
+            print(f'error: {abs_remote_filepath} is a directory', file=sys.stderr)
+            return False
+        output = output or sys.stdout.buffer
+        url, file_size = json['@microsoft.graph.downloadUrl'], json['size']
+        range_size = self.get_tunable('download_range_size')
+        workers = self.get_tunable('download_workers')
+        range_starts = iter(range(0, file_size, range_size))
+        read_ahead = deque()
+        with ContextThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    while len(read_ahead) < workers and (range_start := next(range_starts, None)) is not None:
+                        read_ahead.append(executor.submit(self._cat_range, url, (range_start, min(range_start + range_size, file_size) - 1)))
+                    if not read_ahead:
+                        break
+                    output.write(read_ahead.popleft().result())
+                output.flush()
+            except (OneDriveAPIError, requests.RequestException) as e:
+                print(f'error: could not read {abs_remote_filepath}: {e}', file=sys.stderr)
+                return False
+            except BrokenPipeError:
+                # Whatever is reading the output has stopped (head, for example). Python's own flush of stdout on exit
+                # would fail in the same way, so stdout is pointed at /dev/null.
+                if output is sys.stdout.buffer:
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            finally:
+                for future in read_ahead:
+                    future.cancel()
+        return True
+
+# What AsyncOneDriveClient hands back for an item. modified is the ISO 8601 time the file was last changed, and
+# quick_xor_hash is None for folders.
+DriveItem = namedtuple('DriveItem', ['path', 'id', 'name', 'is_folder', 'size', 'etag', 'modified', 'quick_xor_hash'])
+
+class ItemNotFoundError(OneDriveAPIError):
+    pass
+
+class ItemExistsError(OneDriveAPIError):
+    pass
+
+class AsyncOneDriveClient:
+
+    # Runs OneDrive operations on an asyncio event loop so that a service can have thousands going at once without a
+    # thread each. Every request waits for one of max_in_flight slots (http_max_in_flight by default) and a throttle
+    # pauses them all until its Retry-After has passed. Settings, the access token and the metadata cache come from a
+    # OneDriveCore of its own, so they're shared with odc through the settings db, which must have been set up with
+    # 'odc init'. Nothing is printed: items come back as DriveItems and failures are raised as OneDriveAPIErrors.
+    # Nothing that blocks runs on the event loop: the settings db is only used from a thread of its own and files are
+    # read and written on worker threads.
+
+    def __init__(self, settings_db=None, max_in_flight=None) -> None:
+        self._logger = logger.getChild(__class__.__name__)
+        self._core = OneDriveCore(settings_db or f'{os.path.expanduser("~")}/.config/OneDriveCLI/settings.db')
+        if not self._core.is_initialised():
+            raise OneDriveAPIError(None, 'notInitialised', 'initialisation has not been run, please run "odc init" first')
+        self._max_in_flight = max_in_flight or self._core.get_tunable('http_max_in_flight')
+        self._http_session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        global asyncio, aiohttp
+        import asyncio
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('AsyncOneDriveClient needs aiohttp, install it with "pip install OneDriveCLI[async]"') from None
+        self._slots = asyncio.Semaphore(self._max_in_flight)
+        self._resume_at = 0.0
+        self._max_retries = self._core.get_tunable('http_max_retries')
+        self._chunk_sizer = UploadChunkSizer(self._core.get_tunable('upload_chunk_size'))
+        timeout = aiohttp.ClientTimeout(sock_connect=self._core.get_tunable('http_connect_timeout', float), sock_read=self._core.get_tunable('http_read_timeout', float))
+        self._http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._max_in_flight), timeout=timeout)
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='odc-db')
+
+    async def close(self):
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+            await asyncio.to_thread(self._db_executor.shutdown)
+
+    async def _run_db(self, fn, *args):
+        # The settings db is behind a lock and can wait up to DB_BUSY_TIMEOUT for other odc processes, so it's only
+        # used from the db thread. Updates are made in the order they're asked for.
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, fn, *args)
+
+    async def _get_access_token(self, rejected_token=None):
+        if rejected_token is None and (token := self._core.get_cached_access_token()) is not None:
+            return token
+        return await asyncio.to_thread(self._core.refresh_access_token, rejected_token)
+
+    async def _read_body(self, response):
+        return await response.read()
+
+    async def _send(self, method, url, auth=True, headers=None, data=None, json=None, read=None):
+        # Retries follow _http_request. data may be a coroutine function, which is awaited for the body once a slot
+        # has been taken so that no more than max_in_flight request bodies are held in memory. read is given the
+        # response (of any status) and its result is returned along with the status and headers.
+        idempotent = method in OneDriveCore.IDEMPOTENT_METHODS
+        read = read or self._read_body
+        attempt = 0
+        rejected_token = None
+        refreshed = False
+        while True:
+            if (delay := self._resume_at - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            request_headers = {'Accept': 'application/json', **(headers or {})}
+            if auth:
+                token = await self._get_access_token(rejected_token)
+                request_headers['Authorization'] = f'bearer {token}'
+                rejected_token = None
+            retry_after = None
+            try:
+                async with self._slots:
+                    async with self._http_session.request(method, url, headers=request_headers, json=json, allow_redirects=False,
+                                                          data=(await data()) if callable(data) else data) as response:
+                        status = response.status
+                        throttled = status == 429 or (status == 503 and idempotent)
+                        if auth and status == 401 and not refreshed:
+                            self._logger.debug(f'access token rejected for {method} {url}, refreshing')
+                            rejected_token = token
+                            refreshed = True
+                            continue
+                        if not throttled or attempt >= self._max_retries:
+                            return status, response.headers, await read(response)
+                        retry_after = self._core.get_retry_after(response.headers)
+                        self._logger.debug(f'{method} {url} returned {status}, retry {attempt + 1} after {retry_after} s')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not idempotent or attempt >= self._max_retries:
+                    raise
+                self._logger.debug(f'{method} {url} failed with {e!r}, retry {attempt + 1}')
+            if retry_after is not None:
+                self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+            else:
+                await asyncio.sleep(random.uniform(0, min(RequestScheduler.BACKOFF_CAP, RequestScheduler.BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
+
+    def _raise_error(self, status, body, remote_path):
+        try:
+            error = jsonlib.loads(body)['error']
+            code, message = error['code'], error['message']
+        except (ValueError, KeyError, TypeError):
+            code, message = 'unknownError', body[:200].decode(errors='replace') if isinstance(body, bytes) else str(body)
+        error_class = ItemNotFoundError if status == 404 else ItemExistsError if status == 409 else OneDriveAPIError
+        raise error_class(status, code, f'{message} ({remote_path})')
+
+    async def _api_request(self, method, url, remote_path, expected=(200,), **kwargs):
+        status, _, body = await self._send(method, url if '://' in url else f'{self._core.ONEDRIVE_ENDPOINT}{url}', **kwargs)
+        if status not in expected:
+            self._raise_error(status, body, remote_path)
+        return jsonlib.loads(body) if body else None
+
+    def _get_absolute_path(self, remote_path):
+        return self._core.get_absolute_path('/', remote_path)
+
+    def _get_children_url(self, remote_path):
+        return f'{self._core.get_item_url(remote_path)}{"/children" if remote_path == "/" else ":/children"}'
+
+    def _drive_item(self, remote_path, json):
+        return DriveItem(remote_path, json['id'], json.get('name'), 'folder' in json, json.get('size'), json.get('eTag'),
+                         json.get('fileSystemInfo', {}).get('lastModifiedDateTime'), self._core.get_quick_xor_hash(json))
+
+    def _cache_and_index(self, remote_path, json):
+        self._core.cache_item(remote_path, json)
+        self._core.index_items([json])
+
+    async def stat(self, remote_path):
+        remote_path = self._get_absolute_path(remote_path)
+        json = await self._api_request('GET', f'{self._core.get_item_url(remote_path)}?$select={",".join(OneDriveCore.LS_SELECT)}', remote_path)
+        await self._run_db(self._core.cache_item, remote_path, json)
+        return self._drive_item(remote_path, json)
+
+    async def ls(self, remote_path='/'):
+        remote_path = self._get_absolute_path(remote_path)
+        url = f'{self._get_children_url(remote_path)}?$select={",".join(OneDriveCore.LS_SELECT)}&$top={self._core.get_tunable("ls_page_size")}'
+        while url is not None:
+            json = await self._api_request('GET', url, remote_path)
+            items = [(self._core.get_absolute_path(remote_path, item['name']), item) for item in json['value']]
+            # Cached like odc's listings, so a get soon afterwards can use the download urls that came with them
+            await self._run_db(self._core.cache_items, items)
+            for path, item in items:
+                yield self._drive_item(path, item)
+            url = json.get('@odata.nextLink')
+
+    async def mkdir(self, remote_path):
+        if (remote_path := self._get_absolute_path(remote_path)) == '/':
+            raise ValueError('cannot create the root directory')
+        parent_path = self._core.get_parent_path(remote_path)
+        json = await self._api_request('POST', self._get_children_url(parent_path), remote_path, expected=(201,),
+                                       json={'name': remote_path.rsplit('/', 1)[1], 'folder': {}, '@microsoft.graph.conflictBehavior': 'fail'})
+        await self._run_db(self._cache_and_index, remote_path, json)
+        return self._drive_item(remote_path, json)
+
+    async def rm(self, remote_path):
+        # Removes the item and everything in it, there's no prompt
+        if (remote_path := self._get_absolute_path(remote_path)) == '/':
+            raise ValueError('cannot remove the root directory')
+        # The index is only trusted while it's fresh, as its id for the path could belong to a different item otherwise
+        item_id = await self._run_db(self._core.get_indexed_item_id, remote_path) if self._core.index_is_fresh() else None
+        await self._api_request('DELETE', self._core.get_item_url(remote_path), remote_path, expected=(204,))
+        await self._run_db(self._core.uncache_item, remote_path)
+        if item_id is not None:
+            await self._run_db(self._core.unindex_items, [item_id])
+
+    async def get(self, remote_path, local_path):
+        # local_path may be a directory, in which case the file keeps its name. Returns the path it was saved to.
+        remote_path = self._get_absolute_path(remote_path)
+        if (cached := await self._run_db(self._core.get_cached_download_url, remote_path)) is not None:
+            url = cached['url']
+        else:
+            json = await self._api_request('GET', f'{self._core.get_item_url(remote_path)}?$select=id,name,folder,@microsoft.graph.downloadUrl', remote_path)
+            if 'folder' in json:
+                raise ValueError(f'{remote_path} is a directory')
+            url = json['@microsoft.graph.downloadUrl']
+        local_filepath = os.path.join(local_path, remote_path.rsplit('/', 1)[1]) if await asyncio.to_thread(os.path.isdir, local_path) else local_path
+
+        async def save(response):
+            if response.status != 200:
+                return await response.read()
+            local_file = await asyncio.to_thread(open, local_filepath, 'wb')
+            try:
+                async for data in response.content.iter_chunked(1048576):
+                    await asyncio.to_thread(local_file.write, data)
+            finally:
+                await asyncio.to_thread(local_file.close)
+            return None
+
+        status, _, body = await self._send('GET', url, auth=False, read=save)
+        if status in OneDriveCore.EXPIRED_URL_STATUS_CODES and cached is not None:
+            await self._run_db(self._core.uncache_download_url, remote_path)
+            return await self.get(remote_path, local_path)
+        if status != 200:
+            self._raise_error(status, body, remote_path)
+        return local_filepath
+
+    async def put(self, source, remote_path):
+        # source is the path of a local file or the content itself as bytes. remote_path is the path of the file on
+        # OneDrive, which is replaced if it's already there.
+        if (remote_path := self._get_absolute_path(remote_path)) == '/':
+            raise ValueError('cannot replace the root directory')
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            file_size = len(content := memoryview(source))
+            async def read_chunk(start, end):
+                return content[start:end + 1]
+        else:
+            file_size = await asyncio.to_thread(os.path.getsize, source)
+            def read_range(start, end):
+                with open(source, 'rb') as local_file:
+                    return os.pread(local_file.fileno(), end - start + 1, start)
+            async def read_chunk(start, end):
+                return await asyncio.to_thread(read_range, start, end)
+        item_url = self._core.get_item_url(remote_path)
+        if file_size < OneDriveCore.SIMPLE_UPLOAD_LIMIT:
+            json = await self._api_request('PUT', f'{item_url}:/content', remote_path, expected=(200, 201),
+                                           headers={'Content-Type': 'application/octet-stream'}, data=lambda: read_chunk(0, file_size - 1))
+        else:
+            json = await self._put_upload_session(read_chunk, file_size, item_url, remote_path)
+        await self._run_db(self._cache_and_index, remote_path, json)
+        return self._drive_item(remote_path, json)
+
+    async def _put_upload_session(self, read_chunk, file_size, item_url, remote_path):
+        upload_session = await self._api_request('POST', f'{item_url}:/createUploadSession', remote_path,
+                                                 json={'item': {'@microsoft.graph.conflictBehavior': 'replace'}})
+        upload_url = upload_session['uploadUrl']
+        chunk_start = 0
+        try:
+            while True:
+                chunk_end = min(chunk_start + self._chunk_sizer.size, file_size) - 1
+                started = time.perf_counter()
+                status, _, body = await self._send('PUT', upload_url, auth=False, data=lambda: read_chunk(chunk_start, chunk_end),
+                                                   headers={'Content-Range': f'bytes {chunk_start}-{chunk_end}/{file_size}'})
+                if status not in (200, 201, 202):
+                    self._chunk_sizer.failed()
+                    self._raise_error(status, body, remote_path)
+                self._chunk_sizer.succeeded(chunk_end - chunk_start + 1, time.perf_counter() - started)
+                if status != 202:
+                    return jsonlib.loads(body)
+                chunk_start = chunk_end + 1
+        except BaseException:
+            # Abandoned sessions would otherwise hold on to the uploaded chunks until they expire
+            try:
+                await self._send('DELETE', upload_url, auth=False)
+            except Exception as e:
+                self._logger.debug(f'could not delete upload session for {remote_path}: {e}')
+            raise
 
 def get_arg(arglist, index, default=None):
     try:
@@ -350,9 +2550,366 @@ def get_arg(arglist, index, default=None):
     except(IndexError):
         return default
 
+def pop_int_option(arglist, name):
+    # Removes '<name> <value>' from arglist and returns the value, None if the option isn't there, or raises
+    # ValueError if its value isn't a whole number
+    if name not in arglist:
+        return None
+    index = arglist.index(name)
+    if not (value := get_arg(arglist, index + 1, '')).isdigit():
+        raise ValueError(f'{name} must be followed by a whole number')
+    del arglist[index:index + 2]
+    return int(value)
+
+def run_command(odc, args, local_cwd=None, session=None):
+    # Runs a single command, given on the command line, read by 'odc shell' or sent to the daemon, and returns its
+    # exit code. The command runs in session if one is given, otherwise in odc's own. The HTTP requests it makes are
+    # recorded for 'odc stats'.
+    token = command_requests.set(requests_made := [])
+    session_token = command_session.set(session)
+    started_at, started = time.time(), time.perf_counter()
+    exit_code = 1
+    try:
+        exit_code = dispatch_command(odc, args, local_cwd)
+    finally:
+        command_requests.reset(token)
+        command_session.reset(session_token)
+        if requests_made != []:
+            try:
+                odc._record_command_stats(args[0], started_at, time.perf_counter() - started, exit_code, requests_made)
+            except sqlite3.Error as e:
+                odc._logger.debug(f'could not record stats for {args[0]}: {e}')
+    return exit_code
+
+def dispatch_command(odc, args, local_cwd=None):
+    # Local paths are relative to local_cwd if it's set (the daemon's working directory isn't the client's)
+    local_path = lambda path: path if local_cwd is None else os.path.normpath(os.path.join(local_cwd, path))
+    try:
+        match(args[0]):
+            case 'cd':
+                path = get_arg(args, 1, '/')
+                print(odc.cd(path))
+            case 'ls':
+                for line in odc.ls():
+                    print(line)
+            case 'pwd':
+                print(odc.pwd())
+            case 'get':
+                params = [arg for arg in args[1:] if arg != '-r']
+                if (source := get_arg(params, 0)) is None:
+                    print("error: no source file specified")
+                    return 1
+                destination = local_path(get_arg(params, 1, './'))
+                odc.get(source, destination, recursive='-r' in args[1:])
+            case 'put':
+                params = [arg for arg in args[1:] if arg != '-r']
+                if (source := get_arg(params, 0)) is None:
+                    print("error: no source file specified")
+                    return 1
+                destination = get_arg(params, 1, './')
+                odc.put(source if source == '-' else local_path(source), destination, recursive='-r' in args[1:])
+            case 'cat':
+                if (source := get_arg(args, 1)) is None:
+                    print('error: no source file specified')
+                    return 1
+                if not odc.cat(source):
+                    return 1
+            case 'mkdir':
+                if len(paths := args[1:]) == 0:
+                    print('error: no directory name specified')
+                    return 1
+                odc.mkdir(paths)
+            case 'rm':
+                if len(paths := args[1:]) == 0:
+                    print('error: no item to delete specified')
+                    return 1
+                odc.rm(paths)
+            case 'mv' | 'cp':
+                if len(paths := args[1:]) < 2:
+                    print('error: a source and a destination must be specified')
+                    return 1
+                (odc.mv if args[0] == 'mv' else odc.cp)(paths[:-1], paths[-1])
+            case 'stat':
+                if len(paths := args[1:]) == 0:
+                    print('error: no item specified')
+                    return 1
+                for line in odc.stat(paths):
+                    print(line)
+            case 'du':
+                try:
+                    max_depth = pop_int_option(params := args[1:], '-d')
+                except ValueError as e:
+                    print(f'error: {e}')
+                    return 1
+                for line in odc.du(get_arg(params, 0, '.'), max_depth):
+                    print(line, flush=True)
+            case 'find':
+                try:
+                    min_size = pop_int_option(params := args[1:], '--min-size')
+                except ValueError as e:
+                    print(f'error: {e}')
+                    return 1
+                if (pattern := get_arg(params, 0)) is None:
+                    print('error: no pattern specified')
+                    return 1
+                for line in odc.find(pattern, get_arg(params, 1, '.'), min_size or 0):
+                    print(line, flush=True)
+            case 'sync':
+                params = [arg for arg in args[1:] if arg != '--dry-run']
+                if (local_dir := get_arg(params, 0)) is None or (remote_dir := get_arg(params, 1)) is None:
+                    print('error: a local and a remote directory must be specified')
+                    return 1
+                odc.sync(local_path(local_dir), remote_dir, dry_run='--dry-run' in args[1:])
+            case 'index':
+                print(result := odc.index(rebuild=get_arg(args, 1) == '--rebuild'))
+                if result.startswith('error:'):
+                    return 1
+            case 'config':
+                print(result := odc.config(get_arg(args, 1), get_arg(args, 2)))
+                if result.startswith('error:'):
+                    return 1
+            case 'stats':
+                for line in odc.stats(get_arg(args, 1)):
+                    print(line)
+            case 'debug-on':
+                odc.debug_on(True)
+            case 'debug-off':
+                odc.debug_on(False)
+            case other:
+                print(f'ods: unknown command: {args[0]}')
+                return 1
+    except OneDriveAPIError as e:
+        print(f'error: {e}')
+        return 1
+    return 0
+
+def shell(odc, script_filepath=None):
+    # Every command runs against the same OneDriveCLI object, so the connection pool, token and caches stay warm
+    # for the whole session. Commands are read from script_filepath (or a pipe) if there is one.
+    interactive = script_filepath is None and sys.stdin.isatty()
+    if interactive:
+        try:
+            import readline
+        except ImportError:
+            pass
+        lines = None
+    else:
+        try:
+            lines = open(script_filepath) if script_filepath is not None else sys.stdin
+        except OSError as e:
+            print(f'error: could not open script: {e}')
+            return 1
+    exit_code = 0
+    while True:
+        try:
+            line = input(f'odc:{odc.pwd().split(":", 1)[-1]}> ') if interactive else lines.readline()
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+        if not interactive and line == '':
+            break
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as e:
+            print(f'error: {e}')
+            exit_code = 1
+            continue
+        if args == []:
+            continue
+        if args[0] in ['exit', 'quit']:
+            break
+        if args[0] in ['init', 'shell']:
+            print(f'error: {args[0]} can\'t be run from the shell')
+            exit_code = 1
+            continue
+        try:
+            if run_command(odc, args) != 0:
+                exit_code = 1
+        except KeyboardInterrupt:
+            print('\ninterrupted')
+            exit_code = 1
+    if lines is not None and lines is not sys.stdin:
+        lines.close()
+    return exit_code
+
+# The daemon and the odc processes that forward commands to it talk in JSON lines over a Unix socket. A client sends
+# {"args": [...], "cwd": ...} (or {"stop": true}), the daemon replies with {"out": ...} as the command prints,
+# {"input": true} when it needs a line of input, answered with {"stdin": ...}, and finally {"exit": <exit code>}.
+daemon_client = contextvars.ContextVar('daemon_client', default=None)
+
+class DaemonClient:
+
+    def __init__(self, rfile, wfile) -> None:
+        self._rfile = rfile
+        self._wfile = wfile
+        self._lock = threading.RLock()
+        self._buffer = ''
+
+    def send(self, **message):
+        with self._lock:
+            self._wfile.write(f'{jsonlib.dumps(message)}\n'.encode())
+            self._wfile.flush()
+
+    def write(self, text):
+        with self._lock:
+            self._buffer += text
+            if '\n' in text:
+                self.flush()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if self._buffer != '':
+                self.send(out=self._buffer)
+                self._buffer = ''
+
+    def readline(self):
+        self.flush()
+        self.send(input=True)
+        return jsonlib.loads(line).get('stdin', '') if (line := self._rfile.readline()) else ''
+
+    def isatty(self):
+        return False
+
+class DaemonStream:
+
+    # Replaces sys.stdout and sys.stdin in the daemon, passing reads and writes on to the client whose command is
+    # running in the current context, or to the daemon's own stream when there isn't one
+    def __init__(self, stream) -> None:
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(client if (client := daemon_client.get()) is not None else self._stream, name)
+
+def daemon(odc, socket_path):
+    import socket
+    import socketserver
+
+    class DaemonRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            if not (line := self.rfile.readline()):
+                return
+            request = jsonlib.loads(line)
+            client = DaemonClient(self.rfile, self.wfile)
+            if request.get('stop'):
+                client.send(exit=0)
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            daemon_client.set(client)
+            try:
+                exit_code = run_command(odc, request['args'], request['cwd'], odc._open_session(request.get('session'), request.get('remote_cwd')))
+            except (BrokenPipeError, ConnectionResetError):
+                odc._logger.debug('daemon client went away before its command finished')
+                return
+            except Exception as e:
+                print(f'error: {e}')
+                exit_code = 1
+            client.flush()
+            client.send(exit=exit_code)
+
+    class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(socket_path) == 0:
+                print(f'error: the odc daemon is already running ({socket_path})')
+                return 1
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(socket_path)
+    old_umask = os.umask(0o077)
+    try:
+        server = DaemonServer(socket_path, DaemonRequestHandler)
+    finally:
+        os.umask(old_umask)
+    stdout, stdin = sys.stdout, sys.stdin
+    sys.stdout, sys.stdin = DaemonStream(stdout), DaemonStream(stdin)
+    print(f'odc daemon listening on {socket_path}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        sys.stdout, sys.stdin = stdout, stdin
+    print('odc daemon stopped')
+    return 0
+
+def send_to_daemon(socket_path, request):
+    # Returns the exit code of the request, or None if there's no daemon listening on socket_path
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    with connection, connection.makefile('rb') as replies, connection.makefile('wb') as requests_file:
+        send = lambda **message: (requests_file.write(f'{jsonlib.dumps(message)}\n'.encode()), requests_file.flush())
+        try:
+            send(**request)
+            for line in replies:
+                message = jsonlib.loads(line)
+                if 'out' in message:
+                    sys.stdout.write(message['out'])
+                    sys.stdout.flush()
+                elif 'input' in message:
+                    send(stdin=sys.stdin.readline())
+                elif 'exit' in message:
+                    return message['exit']
+        except KeyboardInterrupt:
+            print('\ninterrupted')
+            return 1
+        except OSError:
+            pass
+    print('error: lost connection to the odc daemon')
+    return 1
+
+def get_session_name():
+    # Commands run from the same shell share a working directory. ODC_SESSION names the session explicitly, otherwise
+    # it's the process odc was started from, identified by its pid and (where /proc has it) its start time so that a
+    # later process given the same pid doesn't pick up its working directory.
+    if (name := os.environ.get('ODC_SESSION')) is not None:
+        return name
+    ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/stat') as stat_file:
+            # The process name can contain spaces and brackets, so fields are counted from after its last bracket
+            return f'{ppid}-{stat_file.read().rsplit(")", 1)[1].split()[19]}'
+    except (OSError, IndexError):
+        return str(ppid)
+
 def main():
+    # --timing can go anywhere on the command line. Where the time went is written to stderr when odc exits.
+    if (timing := '--timing' in sys.argv):
+        sys.argv.remove('--timing')
+    # As can --cwd, which runs the command in another remote directory without changing the session's
+    remote_cwd = None
+    if '--cwd' in sys.argv:
+        index = sys.argv.index('--cwd')
+        if (remote_cwd := get_arg(sys.argv, index + 1)) is None:
+            print('error: --cwd must be followed by a remote directory')
+            sys.exit(1)
+        del sys.argv[index:index + 2]
+    session = get_session_name()
+    config_dir = f'{os.path.expanduser('~')}/.config/OneDriveCLI'
+    socket_path = f'{config_dir}/odc.sock'
+    # Commands are run by the daemon if there is one, as it already has a warm connection pool, token and caches.
+    # --timing measures this process, so those commands are always run here, as are ones that need the terminal and
+    # ones that stream data through stdin or stdout.
+    streams = get_arg(sys.argv, 1) == 'cat' or (get_arg(sys.argv, 1) == 'put' and '-' in sys.argv[2:])
+    if get_arg(sys.argv, 1) not in [None, 'init', 'shell', 'daemon'] and not streams and not timing and os.environ.get('ODC_NO_DAEMON') is None:
+        if (exit_code := send_to_daemon(socket_path, {'args': sys.argv[1:], 'cwd': os.getcwd(), 'session': session, 'remote_cwd': remote_cwd})) is not None:
+            sys.exit(exit_code)
     logging.basicConfig()
-    odc = OneDriveCLI(f'{os.path.expanduser('~')}/.config/OneDriveCLI/settings.db')
+    odc = OneDriveCLI(f'{config_dir}/settings.db', session, remote_cwd)
+    if timing:
+        import atexit
+        atexit.register(lambda command_started=time.perf_counter(): print(odc.timings(command_started), file=sys.stderr))
 
     if get_arg(sys.argv, 1) == None:
         print("----------------------------------------------------------------------------------------------")
@@ -362,13 +2919,29 @@ def main():
         print("change directory                : 'odc cd <dir_name>'")
         print("list items in current directory : 'odc ls'")
         print("get current directory           : 'odc pwd'")
-        print("make new directory              : 'odc mkdir <remote_path>'")
-        print("delete item                     : 'odc rm <remote_path>'")
+        print("make new directories            : 'odc mkdir <remote_path> [remote_path...]'")
+        print("delete items                    : 'odc rm <remote_path> [remote_path...]'")
+        print("move or rename items            : 'odc mv <remote_path> [remote_path...] <remote_destination>'")
+        print("copy items                      : 'odc cp <remote_path> [remote_path...] <remote_destination>'")
+        print("show item details               : 'odc stat <remote_path> [remote_path...]'")
+        print("show folder sizes               : 'odc du [-d depth] [remote_dir]'")
+        print("find items by name              : 'odc find <pattern> [remote_dir] [--min-size bytes]'")
         print("get file from current directory : 'odc get <remote_path> [local_path]'")
+        print("get directory tree              : 'odc get -r <remote_dir> [local_dir]'")
         print("put file to current directory   : 'odc put <local_path> [remote_path]'")
-        print("put file to current directory   : 'odc put <local_path> [remote_path]'")
+        print("put directory tree              : 'odc put -r <local_dir> [remote_path]'")
+        print("write a file to stdout          : 'odc cat <remote_path>'")
+        print("put stdin to a file             : 'odc put - <remote_path>'")
+        print("sync local and remote folders   : 'odc sync <local_dir> <remote_dir> [--dry-run]'")
+        print("build or refresh drive index    : 'odc index [--rebuild]'")
+        print("show or change a setting        : 'odc config [key] [value]'")
+        print("show request statistics         : 'odc stats [command]'")
         print("enable debug traces             : 'odc debug-on' ")
         print("disable debug traces            : 'odc debug-off' ")
+        print("interactive shell               : 'odc shell [script_file]'")
+        print("run commands in a daemon        : 'odc daemon [stop]'")
+        print("show start up timings           : 'odc <command> --timing'")
+        print("run in another remote directory : 'odc <command> --cwd <remote_dir>'")
         print("")
         print("* <> = required parameter, [] = optional parameter")
         print("----------------------------------------------------------------------------------------------")
@@ -382,42 +2955,18 @@ def main():
         print('initialisation has not been run, please run "ods init" first')
         sys.exit(1)
 
-    match(sys.argv[1]):
-        case 'cd':
-            path = get_arg(sys.argv, 2, '/')
-            print(odc.cd(path))
-        case 'ls':
-            print(odc.ls())
-        case 'pwd':
-            print(odc.pwd())
-        case 'get':
-            if (source := get_arg(sys.argv,2)) is None:
-                print("error: no source file specified")
-                sys.exit(1)
-            destination = get_arg(sys.argv, 3, './')
-            odc.get(source, destination)
-        case 'put':
-            if (source := get_arg(sys.argv,2)) is None:
-                print("error: no source file specified")
-                sys.exit(1)
-            destination = get_arg(sys.argv,3, './')
-            odc.put(source, destination)
-        case 'mkdir':
-            if (path := get_arg(sys.argv, 2)) is None:
-                print('error: no directory name specified')
-                sys.exit(1)
-            odc.mkdir(path)
-        case 'rm':
-            if (path := get_arg(sys.argv, 2)) is None:
-                print('error: no item to delete specified')
+    if sys.argv[1] == 'shell':
+        sys.exit(shell(odc, get_arg(sys.argv, 2)))
+
+    if sys.argv[1] == 'daemon':
+        if get_arg(sys.argv, 2) == 'stop':
+            if send_to_daemon(socket_path, {'stop': True}) is None:
+                print('error: the odc daemon is not running')
                 sys.exit(1)
-            odc.rm(path)
-        case 'debug-on':
-            odc.debug_on(True)
-        case 'debug-off':
-            odc.debug_on(False)
-        case other:
-            print(f'ods: unknown command: {sys.argv[1]}')
+            sys.exit(0)
+        sys.exit(daemon(odc, socket_path))
+
+    sys.exit(run_command(odc, sys.argv[1:]))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
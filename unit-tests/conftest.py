@@ -1,4 +1,36 @@
 import sys
 import os
+import gc
+import time
+import pytest
 sys.path.append(os.path.join(os.path.dirname(__file__), '../src/OneDriveCLI'))
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def remove_test_settings_wal():
+    # The settings db is in WAL mode, so deleting it leaves its -wal and -shm files behind until the connection is
+    # closed. They're cleared up after each test so that they can't be mistaken for part of the next test's db.
+    yield
+    gc.collect()
+    for suffix in ['-wal', '-shm']:
+        if not os.path.exists('./test_settings.db') and os.path.exists(f'./test_settings.db{suffix}'):
+            os.remove(f'./test_settings.db{suffix}')
+
+@pytest.fixture
+def mock_graph():
+    # An initialised OneDriveCLI talking to the in-memory stand-in for Microsoft Graph from the benchmarks, with a
+    # token that never needs refreshing
+    from benchmarks.mock_graph_server import MockGraphServer
+    from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+    test_settings_file = './test_settings.db'
+    if os.path.exists(test_settings_file):
+        os.remove(test_settings_file)
+    server = MockGraphServer().start()
+    ods = OneDriveCLI(settings_db=test_settings_file)
+    ods.ONEDRIVE_ENDPOINT = f'{server.base_url}/v1.0'
+    ods._access_token = ('token', time.time() + 3600)
+    ods.initialise()
+    yield server, ods
+    server.stop()
+    ods._settings_db.close()
+    os.remove(test_settings_file)
@@ -13,7 +13,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
 
         cwd = '/'
-        nwd = ods._get_absolute_path(cwd, '/root/path/to/my/current/dir')
+        nwd = ods.get_absolute_path(cwd, '/root/path/to/my/current/dir')
         assert nwd == '/root/path/to/my/current/dir'
 
         if os.path.exists(test_settings_file):
@@ -26,7 +26,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
         
         cwd = '/path/to/my/current/dir'    
-        nwd = ods._get_absolute_path(cwd, '/path/to/../')
+        nwd = ods.get_absolute_path(cwd, '/path/to/../')
         assert nwd == '/path'
 
         if os.path.exists(test_settings_file):
@@ -39,7 +39,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
         
         cwd = '/path/to/my/current/dir'
-        nwd = ods._get_absolute_path(cwd, '../../')
+        nwd = ods.get_absolute_path(cwd, '../../')
         assert nwd == '/path/to/my'
 
         if os.path.exists(test_settings_file):
@@ -52,7 +52,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
         
         cwd = '/path/to/my/current/dir'
-        nwd = ods._get_absolute_path(cwd, '../../../my/../' )
+        nwd = ods.get_absolute_path(cwd, '../../../my/../' )
         assert nwd == '/path/to'
 
         if os.path.exists(test_settings_file):
@@ -65,7 +65,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
         
         cwd = '/path/to/my/current/dir'
-        nwd = ods._get_absolute_path(cwd, './')
+        nwd = ods.get_absolute_path(cwd, './')
         assert nwd == '/path/to/my/current/dir'
 
         if os.path.exists(test_settings_file):
@@ -79,7 +79,7 @@ class TestAbsolutePath:
 
         cwd = ('/path/to/my/current/dir')
         # Actual Test
-        nwd = ods._get_absolute_path(cwd, './new/path')
+        nwd = ods.get_absolute_path(cwd, './new/path')
         assert nwd == '/path/to/my/current/dir/new/path'
 
         if os.path.exists(test_settings_file):
@@ -92,7 +92,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
 
         cwd = '/path/to/my/current/dir'
-        nwd = ods._get_absolute_path(cwd, './new/./path')
+        nwd = ods.get_absolute_path(cwd, './new/./path')
         assert nwd == '/path/to/my/current/dir/new/path'
 
         if os.path.exists(test_settings_file):
@@ -105,7 +105,7 @@ class TestAbsolutePath:
         ods = OneDriveCLI(settings_db=test_settings_file)
 
         cwd = '/path/to/my/current/dir'
-        nwd = ods._get_absolute_path(cwd, '/')
+        nwd = ods.get_absolute_path(cwd, '/')
         assert nwd == '/'
 
         if os.path.exists(test_settings_file):
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+import asyncio
+import logging
+import pytest
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, OneDriveCore, AsyncOneDriveClient, ItemExistsError, ItemNotFoundError
+from benchmarks.mock_graph_server import MockGraphServer, DRIVE_ID
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestAsyncClient:
+
+    def test_async_client(self, tmp_path):
+        pytest.importorskip('aiohttp')
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.upsert_setting('drive_id', DRIVE_ID)
+        ods.upsert_setting('root', f'/drives/{DRIVE_ID}/root:')
+        ods.upsert_setting('is_initialised', 'true')
+        server = MockGraphServer(throttle_rate=0.05, retry_after=0).start()
+        client = AsyncOneDriveClient(settings_db=test_settings_file, max_in_flight=16)
+        client._core.ONEDRIVE_ENDPOINT = f'{server.base_url}/v1.0'
+        client._core._access_token = ('token-1', time.time() + 3600)
+        client._core.refresh_access_token = lambda rejected_token=None: 'token-2'
+
+        async def run():
+            async with client:
+                assert (await client.mkdir('/docs')).is_folder
+                with pytest.raises(ItemExistsError):
+                    await client.mkdir('docs')
+                with pytest.raises(ItemNotFoundError):
+                    await client.stat('/missing')
+
+                # Throttled requests are retried, so every upload gets there
+                items = await asyncio.gather(*(client.put(f'file {n}'.encode(), f'/docs/{n}.txt') for n in range(200)))
+                assert [item.size for item in items] == [len(f'file {n}') for n in range(200)]
+                assert sorted([item.path async for item in client.ls('/docs')]) == sorted(f'/docs/{n}.txt' for n in range(200))
+                # Listings land in the same cache as odc's, through a core of the client's own rather than an OneDriveCLI
+                assert type(client._core) is OneDriveCore
+                assert ods.get_cached_download_url('/docs/1.txt')['size'] == len('file 1')
+
+                # A rejected token is refreshed once and the request sent again
+                server.rejected_tokens.add('token-1')
+                big = os.urandom(OneDriveCLI.SIMPLE_UPLOAD_LIMIT + 1)
+                (local_file := tmp_path / 'big.bin').write_bytes(big)
+                assert (await client.put(str(local_file), '/docs/big.bin')).size == len(big)
+                assert await client.get('/docs/big.bin', str(tmp_path / 'copy.bin')) == str(tmp_path / 'copy.bin')
+                assert (tmp_path / 'copy.bin').read_bytes() == big
+
+                await client.rm('/docs/0.txt')
+                with pytest.raises(ItemNotFoundError):
+                    await client.stat('/docs/0.txt')
+
+        try:
+            asyncio.run(run())
+        finally:
+            server.stop()
+        os.remove(test_settings_file)
+
+    def test_event_loop_not_blocked_by_settings_db(self, mock_graph):
+        pytest.importorskip('aiohttp')
+        server, ods = mock_graph
+        server.drive.make_file('/a.txt', b'a')
+        client = AsyncOneDriveClient(settings_db='./test_settings.db')
+        client._core.ONEDRIVE_ENDPOINT = ods.ONEDRIVE_ENDPOINT
+        client._core._access_token = ('token', time.time() + 3600)
+        locked = threading.Event()
+
+        # Hold the settings db from another thread; other coroutines should keep running while stat waits for it
+        def hold_db():
+            with client._core._db_lock:
+                locked.set()
+                time.sleep(0.5)
+
+        async def run():
+            async with client:
+                holder = asyncio.get_running_loop().run_in_executor(None, hold_db)
+                await asyncio.to_thread(locked.wait)
+                stat = asyncio.ensure_future(client.stat('/a.txt'))
+                gaps = []
+                while not stat.done():
+                    started = time.monotonic()
+                    await asyncio.sleep(0.01)
+                    gaps.append(time.monotonic() - started)
+                await holder
+                assert (await stat).size == 1
+                assert max(gaps) < 0.2
+
+        asyncio.run(run())
@@ -0,0 +1,47 @@
+import logging
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestBatch:
+
+    def test_rm_ignores_stale_index(self, mock_graph, capsys):
+        server, ods = mock_graph
+        ods.upsert_setting('index_max_age', '3600')
+        ods.upsert_setting('metadata_cache_ttl', '0')
+        moved = server.drive.make_file('/report.txt', b'old')
+        ods.index()
+
+        # The indexed report.txt has since been moved and replaced, which a stale index doesn't know about
+        server.drive.move(moved, server.drive.make_tree('/archive'), 'report.txt')
+        server.drive.make_file('/report.txt', b'new')
+        ods.upsert_setting('index_refreshed_at', '0')
+        ods.rm(['report.txt'], force=True)
+        assert 'deleted: /report.txt' in capsys.readouterr().out
+        assert server.drive.lookup(server.drive.root, 'archive/report.txt') is moved
+        assert server.drive._find_child(server.drive.root, 'report.txt') is None
+
+    def test_batch_responses_matched_to_requests(self, mock_graph):
+        server, ods = mock_graph
+        server.shuffle_batch_responses = True
+        for n in range(0, 30, 2):
+            server.drive.make_file(f'/docs/{n}.txt', b'x' * n)
+
+        # More requests than fit in one batch, with answers that come back out of order
+        responses = ods._batch_request([{'method': 'GET', 'url': f'/drives/{ods._drive_id}/root:/docs/{n}.txt'} for n in range(30)])
+        assert [response['status'] for response in responses] == [200 if n % 2 == 0 else 404 for n in range(30)]
+        assert [response['body']['name'] for response in responses[::2]] == [f'{n}.txt' for n in range(0, 30, 2)]
+        assert server.request_counts['POST /$batch'] == 2
+
+    def test_throttled_sub_requests_resent(self, mock_graph):
+        server, ods = mock_graph
+        server.throttle_rate = 0.3
+        server.retry_after = 0
+        paths = [f'/dir{n}' for n in range(45)]
+
+        # Only the throttled sub-requests go again, so no folder is created twice
+        responses = ods._batch_request([{'method': 'POST', 'url': f'/drives/{ods._drive_id}/root/children', 'headers': {'Content-Type': 'application/json'},
+                                         'body': {'name': path[1:], 'folder': {}, '@microsoft.graph.conflictBehavior': 'fail'}} for path in paths])
+        assert server.throttled > 0
+        assert [response['status'] for response in responses] == [201] * 45
+        assert sorted(server.drive.root.children) == sorted(path[1:] for path in paths)
+        assert server.request_counts['POST /$batch'] > 3
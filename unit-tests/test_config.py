@@ -0,0 +1,30 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, run_command
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestConfig:
+
+    def test_config_rejects_unusable_values(self, capsys):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        for key, value in [('http_pool_size', '2.5'), ('http_max_in_flight', '0'), ('put_workers', '0'), ('get_workers', '-1'),
+                           ('walk_workers', 'many'), ('download_workers', ''), ('http_read_timeout', '0'), ('http_connect_timeout', 'inf'),
+                           ('http_connect_timeout', 'nan'), ('metadata_cache_ttl', '-5')]:
+            assert ods.config(key, value).startswith(f'error: value for {key} must be')
+            assert ods.get_setting(key) is None
+        assert run_command(ods, ['config', 'http_max_in_flight', '0']) == 1
+        assert capsys.readouterr().out.startswith('error:')
+
+        # 0 is allowed where it turns something off, timeouts can be fractional and whole numbers are stored as such
+        assert ods.config('index_max_age', '0').split() == ['index_max_age', '0']
+        assert ods.config('http_max_retries', '0').split() == ['http_max_retries', '0']
+        assert ods.config('http_read_timeout', '2.5').split() == ['http_read_timeout', '2.5']
+        assert ods.config('http_pool_size', ' 20').split() == ['http_pool_size', '20']
+        assert ods.get_tunable('http_pool_size') == 20
+        ods._settings_db.close()
+        os.remove(test_settings_file)
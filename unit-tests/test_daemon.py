@@ -0,0 +1,39 @@
+import os
+import time
+import threading
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, daemon, send_to_daemon
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestDaemon:
+
+    def test_forward_commands(self, capsys):
+        test_settings_file = './test_settings.db'
+        test_socket_file = './test_odc.sock'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        assert send_to_daemon(test_socket_file, {'args': ['config'], 'cwd': os.getcwd()}) is None
+
+        daemon_thread = threading.Thread(target=daemon, args=(ods, test_socket_file))
+        daemon_thread.start()
+        while not os.path.exists(test_socket_file):
+            time.sleep(0.01)
+        capsys.readouterr()
+
+        exit_codes = []
+        clients = [threading.Thread(target=lambda: exit_codes.append(send_to_daemon(test_socket_file, {'args': ['config', 'put_workers', '8'], 'cwd': os.getcwd()}))) for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert exit_codes == [0, 0, 0, 0]
+        assert capsys.readouterr().out.split('\n').count(f'{"put_workers":<24}8') == 4
+
+        assert send_to_daemon(test_socket_file, {'args': ['no-such-command'], 'cwd': os.getcwd()}) == 1
+        assert send_to_daemon(test_socket_file, {'stop': True}) == 0
+        daemon_thread.join()
+        assert not os.path.exists(test_socket_file)
+        os.remove(test_settings_file)
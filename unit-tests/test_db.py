@@ -22,7 +22,7 @@ class TestDB:
         assert len(result) == 0
         cursor.close()
 
-        ods._upsert_setting(key, val)
+        ods.upsert_setting(key, val)
 
         cursor = db.cursor()
         result = cursor.execute('SELECT value from settings WHERE key == ?', (key,)).fetchall()
@@ -48,7 +48,7 @@ class TestDB:
         assert len(result) == 0
         cursor.close()
 
-        ods._upsert_setting(key, val)
+        ods.upsert_setting(key, val)
 
         cursor = db.cursor()
         result = cursor.execute('SELECT value from settings WHERE key == ?', (key,)).fetchall()
@@ -57,7 +57,7 @@ class TestDB:
         cursor.close()
 
         val = 'new_value'
-        ods._upsert_setting(key, val)
+        ods.upsert_setting(key, val)
 
         cursor = db.cursor()
         result = cursor.execute('SELECT value from settings WHERE key == ?', (key,)).fetchall()
@@ -83,9 +83,29 @@ class TestDB:
         assert len(result) == 0
         cursor.close()
 
-        ods._upsert_setting(key, val)
-        setting = ods._get_setting(key)
+        ods.upsert_setting(key, val)
+        setting = ods.get_setting(key)
         assert setting == val
 
         os.remove(test_settings_file)
         assert not os.path.exists(test_settings_file)
+
+    def test_settings_loaded_with_db(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.upsert_setting('my_setting', 'value')
+        ods._settings_db.close()
+
+        db = sqlite3.connect(test_settings_file)
+        assert db.execute('PRAGMA user_version').fetchall()[0][0] == OneDriveCLI.SCHEMA_VERSION
+        db.close()
+
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        assert ods._settings['my_setting'] == 'value'
+        assert ods.get_setting('my_setting') == 'value'
+        assert ods.get_setting('no_such_setting') == None
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
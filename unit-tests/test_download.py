@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+from src.OneDriveCLI.OneDriveCLI import QuickXorHash
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestDownload:
+
+    def test_failed_downloads_release_connections(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        for n in range(25):
+            server.drive.make_file(f'/docs/{n}.txt', f'file {n}'.encode())
+        server.fail_downloads = True
+
+        # More failures than there are connections in the pool, each of which used to keep its connection
+        get = threading.Thread(target=ods.get, args=('docs', str(tmp_path)), kwargs={'recursive': True}, daemon=True)
+        get.start()
+        get.join(timeout=30)
+        assert not get.is_alive()
+        assert '25 failed' in capsys.readouterr().out
+
+    def _interrupted_download(self, server, ods, destination, content):
+        # Ranges are fetched one at a time and the sixth fails, which leaves the first five in the sidecar
+        item = server.drive.make_file('/big.bin', content)
+        json = server.item_json(item)
+        ods.upsert_setting('download_range_size', '1000')
+        ods.upsert_setting('download_workers', '1')
+        download_range = ods._download_range
+        ods._download_range = lambda url, fd, byte_range: False if byte_range[0] == 5000 else download_range(url, fd, byte_range)
+        assert not ods._download_ranges(json['@microsoft.graph.downloadUrl'], str(destination), len(content), json['eTag'])
+        ods._download_range = download_range
+        assert os.path.exists(f'{destination}.odc-part')
+        server.reset_stats()
+        return json
+
+    def test_download_ranges_resumed(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        content = os.urandom(10000)
+        json = self._interrupted_download(server, ods, destination := tmp_path / 'big.bin', content)
+
+        assert ods._download_ranges(json['@microsoft.graph.downloadUrl'], str(destination), len(content), json['eTag'])
+        assert 'Resuming download (5000 of 10000 bytes already downloaded)' in capsys.readouterr().out
+        assert server.request_counts['GET /download/{id} (range)'] == 5
+        assert destination.read_bytes() == content
+        assert not os.path.exists(f'{destination}.odc-part')
+
+    def test_get_resumes_without_hashing_partial_file(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        server.hash_function = lambda content: QuickXorHash(bytes(content)).b64digest()
+        content = os.urandom(10000)
+        self._interrupted_download(server, ods, destination := tmp_path / 'big.bin', content)
+
+        # The partial file is already the full size, but reading it to compare hashes would be wasted
+        hashed = []
+        get_local_hash = ods._get_local_hash
+        ods._get_local_hash = lambda local_filepath: hashed.append(local_filepath) or get_local_hash(local_filepath)
+        ods.get('big.bin', str(destination))
+        assert 'Resuming download (5000 of 10000 bytes already downloaded)' in capsys.readouterr().out
+        assert hashed == []
+        assert destination.read_bytes() == content
+
+    def test_download_ranges_restarted(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        content = os.urandom(10000)
+
+        # A different version of the file, or ranges of a different size, can't use what was downloaded before
+        for change in ['etag', 'size', 'range_size']:
+            json = self._interrupted_download(server, ods, destination := tmp_path / 'big.bin', content)
+            if change == 'etag':
+                json['eTag'] = '"{changed},2"'
+            elif change == 'size':
+                content = content + b'more'
+                json = server.item_json(server.drive.make_file('/big.bin', content))
+            else:
+                ods.upsert_setting('download_range_size', '2000')
+            assert ods._download_ranges(json['@microsoft.graph.downloadUrl'], str(destination), len(content), json['eTag'])
+            assert 'Resuming' not in capsys.readouterr().out
+            assert server.request_counts['GET /download/{id} (range)'] == (5 if change == 'range_size' else (len(content) + 999) // 1000)
+            assert destination.read_bytes() == content
+            content = os.urandom(10000)
+
+    def test_get_recursive_mirrors_tree(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        server.hash_function = lambda content: QuickXorHash(bytes(content)).b64digest()
+        ods.upsert_setting('download_range_size', '1000')
+        files = {'a.txt': b'a', 'sub/b.txt': b'b' * 10, 'sub/deeper/c.bin': os.urandom(3500)}
+        for path, content in files.items():
+            server.drive.make_file(f'/tree/{path}', content)
+        server.drive.make_tree('/tree/empty')
+
+        ods.get('tree', str(tmp_path), recursive=True)
+        assert 'Done: 3 file(s) downloaded, 0 unchanged, 0 failed' in capsys.readouterr().out
+        assert sorted(os.path.relpath(os.path.join(dirpath, name), tmp_path) for dirpath, dirnames, filenames in os.walk(tmp_path) for name in dirnames + filenames) == \
+            ['tree', 'tree/a.txt', 'tree/empty', 'tree/sub', 'tree/sub/b.txt', 'tree/sub/deeper', 'tree/sub/deeper/c.bin']
+        assert all((tmp_path / 'tree' / path).read_bytes() == content for path, content in files.items())
+
+        # Files that match what's on OneDrive aren't downloaded again
+        server.drive.make_file('/tree/sub/b.txt', b'changed')
+        ods.get('tree', str(tmp_path), recursive=True)
+        assert 'Done: 1 file(s) downloaded, 2 unchanged, 0 failed' in capsys.readouterr().out
+        assert (tmp_path / 'tree' / 'sub' / 'b.txt').read_bytes() == b'changed'
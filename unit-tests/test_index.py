@@ -0,0 +1,58 @@
+import logging
+from src.OneDriveCLI.OneDriveCLI import run_command
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestIndex:
+
+    def test_incremental_index(self, mock_graph):
+        server, ods = mock_graph
+        ods.upsert_setting('index_max_age', '3600')
+        server.drive.make_file('/docs/a.txt', b'a')
+        server.drive.make_file('/docs/old/b.txt', b'b')
+        assert ods.index() == 'indexed: 5 items (5 changes applied)'
+        assert ods.index_is_fresh()
+
+        # Only what has changed since the last run is fetched and applied
+        server.drive.make_file('/docs/c.txt', b'c')
+        server.drive.delete(server.drive.lookup(server.drive.root, 'docs/old'))
+        assert ods.index() == 'indexed: 4 items (3 changes applied)'
+        assert ods.get_indexed_item_id('/docs/c.txt') is not None
+        assert ods.get_indexed_item_id('/docs/old') is None
+        assert ods.get_indexed_item_id('/docs/old/b.txt') is None
+
+    def test_expired_delta_link_rebuilds(self, mock_graph):
+        server, ods = mock_graph
+        server.drive.make_file('/docs/a.txt', b'a')
+        ods.index()
+        server.drive.make_file('/docs/b.txt', b'b')
+
+        server.delta_expired = True
+        assert ods.index() == 'indexed: 4 items (4 changes applied)'
+        assert ods.get_indexed_item_id('/docs/b.txt') is not None
+
+    def test_failed_rebuild_not_fresh(self, mock_graph, capsys):
+        server, ods = mock_graph
+        ods.upsert_setting('index_max_age', '3600')
+        server.drive.make_file('/docs/a.txt', b'a')
+        ods.index()
+        assert ods.index_is_fresh()
+
+        # An index emptied for a rebuild that then failed mustn't be used, or be updated from the old delta link
+        ods._onedrive_api_get = lambda url: type('Response', (), {'status_code': 500, 'json': lambda self: {'error': {'code': 'generalException', 'message': 'failed'}}})()
+        assert run_command(ods, ['index', '--rebuild']) == 1
+        assert 'error: generalException | failed' in capsys.readouterr().out
+        assert not ods.index_is_fresh()
+        assert ods.get_setting('delta_link') is None
+
+    def test_unindex_orphans(self, mock_graph):
+        server, ods = mock_graph
+        server.drive.make_file('/docs/old/deeper/b.txt', b'b')
+        server.drive.make_file('/docs/a.txt', b'a')
+        ods.index()
+
+        # Only the folder is reported, everything beneath it goes too
+        ods.unindex_items([ods.get_indexed_item_id('/docs/old')])
+        assert ods.get_indexed_item_id('/docs/old/deeper') is None
+        assert ods.get_indexed_item_id('/docs/old/deeper/b.txt') is None
+        assert ods.get_indexed_item_id('/docs/a.txt') is not None
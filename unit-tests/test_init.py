@@ -32,6 +32,10 @@ class TestInitialisation:
         assert ods._root == None
         assert ods._cwd == None
 
+        # The token handler creates its table the first time it's needed
+        assert ods._token_handler_instance == None
+        ods._token_handler
+
         db = sqlite3.connect(test_settings_file)
         cursor = db.cursor()
         result = cursor.execute('SELECT name FROM sqlite_master WHERE type="table" AND name="token";').fetchall()
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestItemCache:
+
+    def _folder_json(self, item_id, etag, parent_id='ROOT'):
+        return {'id': item_id, 'eTag': etag, 'folder': {'childCount': 1}, 'size': 10, 'parentReference': {'id': parent_id}}
+
+    def _file_json(self, item_id, etag, parent_id, size=5):
+        return {'id': item_id, 'eTag': etag, 'file': {'hashes': {'quickXorHash': f'hash-{item_id}'}}, 'size': size, 'parentReference': {'id': parent_id}}
+
+    def test_cache_and_get_item(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        assert ods.get_cached_item('/docs/a.txt') == None
+        ods.cache_item('/docs/a.txt', self._file_json('A', 'etag-a', 'DOCS', 42))
+        item = ods.get_cached_item('/docs/a.txt')
+        assert item == {'id': 'A', 'eTag': 'etag-a', 'parent_id': 'DOCS', 'type': 'f', 'size': 42, 'quickXorHash': 'hash-A'}
+
+        # OneDrive paths are case insensitive
+        assert ods.get_cached_item('/DOCS/A.TXT')['id'] == 'A'
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
+
+    def test_expired_item_not_returned(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        ods.cache_item('/docs', self._folder_json('DOCS', 'etag-1'))
+        db = sqlite3.connect(test_settings_file)
+        db.autocommit = True
+        db.execute('UPDATE item_cache SET cached_at = cached_at - 3600')
+        assert ods.get_cached_item('/docs') == None
+
+        db.execute('UPDATE item_cache SET cached_at = cached_at + 3600')
+        assert ods.get_cached_item('/docs')['id'] == 'DOCS'
+        ods.upsert_setting('metadata_cache_ttl', '0')
+        assert ods.get_cached_item('/docs') == None
+        db.close()
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
+
+    def test_changed_folder_etag_invalidates_descendants(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        ods.cache_item('/docs', self._folder_json('DOCS', 'etag-1'))
+        ods.cache_item('/docs/a.txt', self._file_json('A', 'etag-a', 'DOCS'))
+        ods.cache_item('/docs_old/b.txt', self._file_json('B', 'etag-b', 'DOCS_OLD'))
+
+        ods.cache_item('/docs', self._folder_json('DOCS', 'etag-1'))
+        assert ods.get_cached_item('/docs/a.txt')['id'] == 'A'
+
+        ods.cache_item('/docs', self._folder_json('DOCS', 'etag-2'))
+        assert ods.get_cached_item('/docs')['eTag'] == 'etag-2'
+        assert ods.get_cached_item('/docs/a.txt') == None
+        assert ods.get_cached_item('/docs_old/b.txt')['id'] == 'B'
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
+
+    def test_uncache_item_removes_descendants(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        ods.cache_item('/docs', self._folder_json('DOCS', 'etag-1'))
+        ods.cache_item('/docs/a.txt', self._file_json('A', 'etag-a', 'DOCS'))
+        ods.cache_item('/docs2', self._folder_json('DOCS2', 'etag-2'))
+
+        ods.uncache_item('/docs')
+        assert ods.get_cached_item('/docs') == None
+        assert ods.get_cached_item('/docs/a.txt') == None
+        assert ods.get_cached_item('/docs2')['id'] == 'DOCS2'
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
+
+    def test_cache_download_urls(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        listed = dict(self._file_json('A', 'etag-a', 'DOCS', 42), **{'@microsoft.graph.downloadUrl': 'https://download/a'})
+        ods.cache_items([('/docs', self._folder_json('DOCS', 'etag-1')), ('/docs/a.txt', listed), ('/docs/b.txt', self._file_json('B', 'etag-b', 'DOCS'))])
+        assert ods.get_cached_download_url('/docs/a.txt') == {'id': 'A', 'url': 'https://download/a', 'eTag': 'etag-a', 'type': 'f', 'size': 42, 'quickXorHash': 'hash-A'}
+        assert ods.get_cached_download_url('/docs') == None
+        assert ods.get_cached_download_url('/docs/b.txt') == None
+
+        # Metadata without a url may be for a newer version of the file
+        ods.cache_item('/docs/a.txt', self._file_json('A', 'etag-a2', 'DOCS', 43))
+        assert ods.get_cached_download_url('/docs/a.txt') == None
+
+        ods.cache_item('/docs/a.txt', listed)
+        db = sqlite3.connect(test_settings_file)
+        db.autocommit = True
+        db.execute('UPDATE download_urls SET expires_at = expires_at - 3600')
+        assert ods.get_cached_download_url('/docs/a.txt') == None
+        db.close()
+
+        ods.cache_item('/docs/a.txt', listed)
+        ods.uncache_item('/docs')
+        assert ods.get_cached_download_url('/docs/a.txt') == None
+
+        ods.cache_item('/docs/a.txt', listed)
+        ods.upsert_setting('download_url_ttl', '0')
+        assert ods.get_cached_download_url('/docs/a.txt') == None
+
+        os.remove(test_settings_file)
+        assert not os.path.exists(test_settings_file)
+
+    def test_get_after_ls_uses_listed_download_url(self, mock_graph, tmp_path):
+        server, ods = mock_graph
+        server.drive.make_file('/docs/a.txt', b'hello')
+        ods.cd('/docs')
+        list(ods.ls())
+        server.reset_stats()
+
+        # The listing came with a download url, so the file isn't looked up first
+        ods.get('a.txt', str(tmp_path))
+        assert dict(server.request_counts) == {'GET /download/{id}': 1}
+        assert (tmp_path / 'a.txt').read_bytes() == b'hello'
+
+    def test_get_looks_up_rejected_download_url(self, mock_graph, tmp_path):
+        server, ods = mock_graph
+        server.drive.make_file('/docs/a.txt', b'hello')
+        ods.cd('/docs')
+
+        # Whichever way OneDrive turns down an old url, the file is looked up again and fetched from its new one
+        for status in OneDriveCLI.EXPIRED_URL_STATUS_CODES:
+            list(ods.ls())
+            server.expire_download_urls(status)
+            server.reset_stats()
+            ods.get('a.txt', str(tmp_path / f'{status}.txt'))
+            # Requests that fail are counted against their path on the mock server
+            downloads = sum(count for request, count in server.request_counts.items() if request.startswith('GET /download/'))
+            assert downloads == 2
+            assert sum(server.request_counts.values()) == 3
+            assert (tmp_path / f'{status}.txt').read_bytes() == b'hello'
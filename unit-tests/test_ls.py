@@ -0,0 +1,47 @@
+import logging
+from urllib.parse import urlsplit, parse_qs
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestLs:
+
+    def _record_urls(self, ods):
+        urls = []
+        onedrive_api_get = ods._onedrive_api_get
+        ods._onedrive_api_get = lambda url: urls.append(url) or onedrive_api_get(url)
+        return urls
+
+    def test_ls_follows_every_page(self, mock_graph):
+        server, ods = mock_graph
+        names = [f'{n:02}.txt' for n in range(25)]
+        for name in names:
+            server.drive.make_file(f'/docs/{name}', name.encode())
+        ods.upsert_setting('ls_page_size', '10')
+        ods.cd('/docs')
+        urls = self._record_urls(ods)
+
+        # Graph hands back a page at a time, so a folder bigger than a page needs its nextLinks followed
+        lines = list(ods.ls())
+        assert sorted(line.split()[-1] for line in lines[:-3]) == names
+        assert len(urls) == 3
+        query = parse_qs(urlsplit(urls[0]).query)
+        assert query['$top'] == ['10']
+        assert query['$select'] == [','.join(OneDriveCLI.LS_SELECT)]
+        assert all(url.startswith(server.base_url) for url in urls[1:])
+
+    def test_ls_streams_rows_before_last_page(self, mock_graph):
+        server, ods = mock_graph
+        for n in range(25):
+            server.drive.make_file(f'/docs/{n:02}.txt', b'x')
+        ods.upsert_setting('ls_page_size', '10')
+        ods.LS_LOOKAHEAD = 5
+        ods.cd('/docs')
+        urls = self._record_urls(ods)
+
+        # The first row is out once the lookahead is full, long before the later pages have been asked for
+        lines = ods.ls()
+        assert next(lines).split()[-1] == '00.txt'
+        assert len(urls) == 1
+        assert len([line for line in lines if line.rstrip().endswith('.txt')]) == 24
+        assert len(urls) == 3
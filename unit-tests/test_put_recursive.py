@@ -0,0 +1,35 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, QuickXorHash
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestPutRecursive:
+
+    def test_put_recursive_uploads_tree(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        server.hash_function = lambda content: QuickXorHash(bytes(content)).b64digest()
+        files = {'a.txt': b'a', 'empty.txt': b'', 'sub/b.txt': b'b' * 10, 'sub/deeper/c.bin': os.urandom(3500), 'sub/deeper/big.bin': os.urandom(OneDriveCLI.SIMPLE_UPLOAD_LIMIT)}
+        for path, content in files.items():
+            (local_filepath := tmp_path / 'tree' / path).parent.mkdir(parents=True, exist_ok=True)
+            local_filepath.write_bytes(content)
+
+        ods.put(str(tmp_path / 'tree'), '/', recursive=True)
+        out = capsys.readouterr().out
+        assert 'Done: 5 file(s) uploaded, 0 unchanged, 0 failed' in out
+        assert all(bytes(server.drive.lookup(server.drive.root, f'tree/{path}').content) == content for path, content in files.items())
+
+        # Each folder is created before anything inside it
+        created = [line.split(' ', 1)[1] for line in out.splitlines() if line.startswith('created: ')]
+        assert created == ['/tree', '/tree/sub', '/tree/sub/deeper']
+
+        # Only the file of SIMPLE_UPLOAD_LIMIT bytes needs an upload session, the rest go in a single PUT
+        assert server.request_counts['POST /drives/{drive}/items/{id}:/{path}:/createUploadSession'] == 1
+        assert server.request_counts['PUT /drives/{drive}/items/{id}:/{path}:/content'] == 4
+
+        # Nothing has changed, so the second run only lists the tree
+        server.reset_stats()
+        ods.put(str(tmp_path / 'tree'), '/', recursive=True)
+        assert 'Done: 0 file(s) uploaded, 5 unchanged, 0 failed' in capsys.readouterr().out
+        assert server.request_counts['PUT /drives/{drive}/items/{id}:/{path}:/content'] == 0
+        assert server.request_counts['POST /drives/{drive}/items/{id}:/{path}:/createUploadSession'] == 0
@@ -0,0 +1,33 @@
+import io
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, UploadChunkSizer
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class ShortReads(io.RawIOBase):
+
+    # Hands data back a little at a time, like a pipe
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readinto(self, buffer):
+        data = self._data.read(min(len(buffer), 100000))
+        buffer[:len(data)] = data
+        return len(data)
+
+class TestPutStream:
+
+    def test_put_stream_of_unknown_length(self, mock_graph, capsys):
+        server, ods = mock_graph
+        ods._get_http_session()
+
+        # The mock server, like Graph, rejects fragments that don't carry the total size of the file
+        for size in [1000, OneDriveCLI.SIMPLE_UPLOAD_LIMIT - 1, OneDriveCLI.SIMPLE_UPLOAD_LIMIT, OneDriveCLI.SIMPLE_UPLOAD_LIMIT * 2 + 1]:
+            ods._chunk_sizer = UploadChunkSizer(4 * UploadChunkSizer.UNIT)
+            server.upload_puts = 0
+            data = os.urandom(size)
+            assert ods._put_stream(ShortReads(data), '/stream.bin')['size'] == size
+            assert f'Done ({size} bytes)' in capsys.readouterr().out
+            assert bytes(server.drive.lookup(server.drive.root, 'stream.bin').content) == data
+            assert (server.upload_puts > 1) == (size >= OneDriveCLI.SIMPLE_UPLOAD_LIMIT)
@@ -0,0 +1,63 @@
+import os
+import base64
+import random
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, QuickXorHash
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestQuickXorHash:
+
+    def _reference_hash(self, data):
+        # Byte at a time, as described in OneDrive's documentation
+        register = 0
+        for index, byte in enumerate(data):
+            shifted = byte << (index * 11) % 160
+            register ^= (shifted & ((1 << 160) - 1)) ^ (shifted >> 160)
+        digest = bytearray(register.to_bytes(20, 'little'))
+        for index, byte in enumerate(len(data).to_bytes(8, 'little')):
+            digest[12 + index] ^= byte
+        return base64.b64encode(bytes(digest)).decode()
+
+    def test_empty(self):
+        assert QuickXorHash().b64digest() == 'AAAAAAAAAAAAAAAAAAAAAAAAAAA='
+
+    def test_matches_reference(self):
+        for size in [1, 159, 160, 161, 1000, QuickXorHash.STRIPE_SIZE - 1, QuickXorHash.STRIPE_SIZE, QuickXorHash.STRIPE_SIZE * 2 + 7]:
+            data = os.urandom(size)
+            assert QuickXorHash(data).b64digest() == self._reference_hash(data)
+
+    def test_streaming_updates(self):
+        data = os.urandom(100000)
+        quick_xor_hash = QuickXorHash()
+        position = 0
+        while position < len(data):
+            step = random.randint(1, 50000)
+            quick_xor_hash.update(data[position:position + step])
+            position += step
+        assert quick_xor_hash.b64digest() == QuickXorHash(data).b64digest()
+
+    def test_local_hash_index(self):
+        test_settings_file = './test_settings.db'
+        test_data_file = os.path.abspath('./test_hash_data.bin')
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        with open(test_data_file, 'wb') as data_file:
+            data_file.write(b'first version')
+
+        assert ods._get_local_hash(test_data_file) == self._reference_hash(b'first version')
+        assert ods._is_unchanged(test_data_file, {'size': 13, 'quickXorHash': self._reference_hash(b'first version')}) == True
+        assert ods._is_unchanged(test_data_file, {'size': 13, 'quickXorHash': None}) == False
+
+        # An unchanged stat means the stored hash is trusted without reading the file
+        stat = os.stat(test_data_file)
+        ods._record_local_hash(test_data_file, 'stored-hash', stat)
+        assert ods._get_local_hash(test_data_file) == 'stored-hash'
+
+        # A new mtime means the file is hashed again
+        os.utime(test_data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        assert ods._get_local_hash(test_data_file) == self._reference_hash(b'first version')
+
+        os.remove(test_data_file)
+        os.remove(test_settings_file)
@@ -0,0 +1,64 @@
+import logging
+import pytest
+import requests
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, RequestScheduler, command_requests
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestRequestScheduler:
+
+    def test_throttle_halves_limit_once_per_burst(self):
+        scheduler = RequestScheduler(8)
+        generations = [scheduler.acquire() for _ in range(4)]
+        for generation in generations:
+            scheduler.release(generation, throttled=True)
+        assert scheduler._limit == 4
+        assert scheduler._in_flight == 0
+
+        # A throttle on a request sent after the cut halves it again
+        scheduler.release(scheduler.acquire(), throttled=True)
+        assert scheduler._limit == 2
+
+    def test_successes_widen_limit_up_to_maximum(self):
+        scheduler = RequestScheduler(4)
+        scheduler.release(scheduler.acquire(), throttled=True)
+        assert scheduler._limit == 2
+        scheduler.release(scheduler.acquire())
+        assert scheduler._limit == 2.5
+        for _ in range(20):
+            scheduler.release(scheduler.acquire())
+        assert scheduler._limit == 4
+
+    def test_retry_after_pauses_requests(self):
+        scheduler = RequestScheduler(4)
+        scheduler.throttled(retry_after=30)
+        assert scheduler._resume_at > 0
+        assert scheduler._limit == 2
+
+    def test_get_retry_after(self):
+        ods = OneDriveCLI.__new__(OneDriveCLI)
+        assert ods.get_retry_after({}) == None
+        assert ods.get_retry_after({'Retry-After': '7'}) == 7
+        assert 0 < ods.get_retry_after({'Retry-After': format_datetime(datetime.now(timezone.utc) + timedelta(seconds=120), usegmt=True)}) <= 120
+        assert ods.get_retry_after({'Retry-After': 'soon'}) == None
+
+    def test_failed_requests_give_back_their_slot(self, mock_graph):
+        server, ods = mock_graph
+        session = ods._get_http_session()
+
+        def broken_body(*args, **kwargs):
+            raise requests.exceptions.ChunkedEncodingError('connection broken')
+
+        # Requests that fail with anything but a connection error or timeout must still hand back their slot
+        session.request = broken_body
+        token = command_requests.set(requests_made := [])
+        try:
+            for _ in range(3):
+                with pytest.raises(requests.exceptions.ChunkedEncodingError):
+                    ods._http_request('GET', f'{ods.ONEDRIVE_ENDPOINT}/me/drive')
+        finally:
+            command_requests.reset(token)
+        assert ods._scheduler._in_flight == 0
+        assert [(method, status) for method, _, status, *_ in requests_made] == [('GET', None)] * 3
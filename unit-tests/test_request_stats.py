@@ -0,0 +1,34 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestRequestStats:
+
+    def test_endpoint_template(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        assert ods._get_endpoint_template('https://graph.microsoft.com/v1.0/drives/539fb3f9a5fe3189/root:/books/a%20b.pdf?$select=id') == '/drives/{drive-id}/root:{path}'
+        assert ods._get_endpoint_template('https://graph.microsoft.com/v1.0/drives/539fb3f9a5fe3189/root:/books:/children') == '/drives/{drive-id}/root:{path}:/children'
+        assert ods._get_endpoint_template('https://graph.microsoft.com/v1.0/drives/539fb3f9a5fe3189/items/539FB3F9A5FE3189!1234:/a.txt:/content') == '/drives/{drive-id}/items/{item-id}:{path}:/content'
+        os.remove(test_settings_file)
+
+    def test_stats_history(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.upsert_setting('stats_history', '3')
+
+        for latency in [0.001, 0.01, 0.1, 1.0]:
+            ods._record_command_stats('ls', 0, 2.0, 0, [('GET', '/drives/{drive-id}/root:{path}:/children', 200, 0, 1048576, latency, 1, 0.5)])
+        lines = list(ods.stats('ls'))
+        assert lines[1].split() == ['ls', '3', '0', '2.00', '3', '3', '1.5', '3.0', '0.5']
+        p50, p90, p99 = [float(value) for value in lines[4].split()[6:9]]
+        assert 80 < p50 < 125 and 800 < p90 < 1250 and p90 == p99
+        assert list(ods.stats('get')) == ['no get commands recorded yet']
+        os.remove(test_settings_file)
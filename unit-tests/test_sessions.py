@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, run_command
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestSessions:
+
+    def test_session_cwd(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.upsert_setting('cwd', '/')
+
+        db = sqlite3.connect(test_settings_file)
+        assert db.execute('PRAGMA journal_mode').fetchall()[0][0] == 'wal'
+        db.close()
+
+        # Sessions start in the directory last cd'd to without one, and then keep their own
+        shell_1 = OneDriveCLI(settings_db=test_settings_file, session='shell-1')
+        shell_2 = OneDriveCLI(settings_db=test_settings_file, session='shell-2')
+        assert shell_1._cwd == '/'
+        shell_1._cwd = '/docs'
+        shell_1._save_cwd()
+        shell_2._cwd = '/photos'
+        shell_2._save_cwd()
+        assert OneDriveCLI(settings_db=test_settings_file, session='shell-1')._cwd == '/docs'
+        assert OneDriveCLI(settings_db=test_settings_file, session='shell-2')._cwd == '/photos'
+        assert OneDriveCLI(settings_db=test_settings_file)._cwd == '/'
+
+        # A cwd given for one command is relative to the session's and isn't saved
+        one_off = OneDriveCLI(settings_db=test_settings_file, session='shell-1', cwd='reports/../2024')
+        assert one_off._cwd == '/docs/2024'
+        one_off._save_cwd()
+        assert OneDriveCLI(settings_db=test_settings_file, session='shell-1')._cwd == '/docs'
+        os.remove(test_settings_file)
+
+    def test_command_session(self, capsys):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods._cwd = '/'
+        ods._save_cwd()
+        ods._root = '/drives/drive-id/root:'
+
+        # The daemon runs each command in the session of the shell that sent it
+        assert run_command(ods, ['pwd'], session={'name': 'shell-1', 'cwd': '/docs', 'save': True}) == 0
+        assert run_command(ods, ['pwd']) == 0
+        assert run_command(ods, ['pwd'], session=ods._open_session('shell-2', '/photos')) == 0
+        assert capsys.readouterr().out.split('\n') == ['/drives/drive-id/root:/docs', '/drives/drive-id/root:/', '/drives/drive-id/root:/photos', '']
+        os.remove(test_settings_file)
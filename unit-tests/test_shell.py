@@ -0,0 +1,41 @@
+import io
+import sys
+import logging
+from src.OneDriveCLI.OneDriveCLI import shell
+from benchmarks.mock_graph_server import DRIVE_ID
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestShell:
+
+    def test_shell_runs_script(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        server.drive.make_tree('/docs')
+        (script := tmp_path / 'script.odc').write_text('# look around\n'
+                                                       '\n'
+                                                       'cd docs   # a trailing comment\n'
+                                                       'pwd\n'
+                                                       'cat missing.txt\n'
+                                                       "cd 'unterminated\n"
+                                                       'init\n'
+                                                       'exit\n'
+                                                       'pwd\n')
+
+        # Failing commands don't stop the script, but they do make the shell exit with 1. Nothing after exit runs.
+        assert shell(ods, str(script)) == 1
+        captured = capsys.readouterr()
+        assert captured.out.splitlines() == [f'/drives/{DRIVE_ID}/root:/docs'] * 2 + ['error: No closing quotation', "error: init can't be run from the shell"]
+        assert captured.err.startswith('error: itemNotFound')
+
+    def test_shell_reads_pipe(self, mock_graph, capsys, monkeypatch):
+        server, ods = mock_graph
+        server.drive.make_tree('/docs')
+        monkeypatch.setattr(sys, 'stdin', io.StringIO('cd /docs\npwd\n'))
+
+        assert shell(ods) == 0
+        assert capsys.readouterr().out.splitlines() == [f'/drives/{DRIVE_ID}/root:/docs'] * 2
+
+    def test_shell_missing_script(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        assert shell(ods, str(tmp_path / 'missing.odc')) == 1
+        assert capsys.readouterr().out.startswith('error: could not open script:')
@@ -0,0 +1,68 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestSyncPlan:
+
+    def _local(self, path, size, mtime_ns):
+        return {path.lower(): {'path': path, 'size': size, 'mtime_ns': mtime_ns}}
+
+    def _remote(self, path, size, quick_xor_hash):
+        return {path.lower(): {'path': path, 'size': size, 'quickXorHash': quick_xor_hash}}
+
+    def _synced(self, path, size, mtime_ns, quick_xor_hash):
+        return {path.lower(): {'size': size, 'mtime_ns': mtime_ns, 'quickXorHash': quick_xor_hash}}
+
+    def test_sync_plan(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        local_files = {**self._local('unchanged.txt', 1, 100),
+                       **self._local('Local-Edit.txt', 2, 200),
+                       **self._local('remote-edit.txt', 3, 300),
+                       **self._local('both-edit.txt', 4, 400),
+                       **self._local('same-edit.txt', 5, 500),
+                       **self._local('new-local.txt', 6, 600),
+                       **self._local('deleted-remote.txt', 7, 700),
+                       **self._local('new-both.txt', 8, 800)}
+        remote_files = {**self._remote('unchanged.txt', 1, 'h1'),
+                        **self._remote('local-edit.txt', 2, 'h2'),
+                        **self._remote('remote-edit.txt', 3, 'h3-new'),
+                        **self._remote('both-edit.txt', 4, 'h4-new'),
+                        **self._remote('same-edit.txt', 5, 'h5-new'),
+                        **self._remote('new-remote.txt', 9, 'h9'),
+                        **self._remote('deleted-local.txt', 10, 'h10'),
+                        **self._remote('new-both.txt', 8, 'h8')}
+        synced_files = {**self._synced('unchanged.txt', 1, 100, 'h1'),
+                        **self._synced('local-edit.txt', 2, 199, 'h2'),
+                        **self._synced('remote-edit.txt', 3, 300, 'h3'),
+                        **self._synced('both-edit.txt', 4, 399, 'h4'),
+                        **self._synced('same-edit.txt', 5, 499, 'h5'),
+                        **self._synced('deleted-remote.txt', 7, 700, 'h7'),
+                        **self._synced('deleted-local.txt', 10, 1000, 'h10'),
+                        **self._synced('deleted-both.txt', 11, 1100, 'h11')}
+        compared = []
+        def same_content(key):
+            compared.append(key)
+            return key in ['same-edit.txt', 'new-both.txt']
+
+        plan = ods._sync_plan(local_files, remote_files, synced_files, same_content)
+        assert plan == [('conflict', 'both-edit.txt'),
+                        ('forget', 'deleted-both.txt'),
+                        ('delete_remote', 'deleted-local.txt'),
+                        ('delete_local', 'deleted-remote.txt'),
+                        ('upload', 'local-edit.txt'),
+                        ('record', 'new-both.txt'),
+                        ('upload', 'new-local.txt'),
+                        ('download', 'new-remote.txt'),
+                        ('download', 'remote-edit.txt'),
+                        ('record', 'same-edit.txt')]
+
+        # Content is only compared where both sides exist and something has changed
+        assert sorted(compared) == ['both-edit.txt', 'local-edit.txt', 'new-both.txt', 'remote-edit.txt', 'same-edit.txt']
+
+        os.remove(test_settings_file)
@@ -0,0 +1,49 @@
+import os
+import json
+import time
+import base64
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class FakeTokenHandler:
+
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def get_token(self):
+        self.calls += 1
+        payload = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + self.lifetime}).encode()).decode().rstrip('=')
+        return f'header.{payload}.{self.calls}'
+
+class TestTokenCache:
+
+    def test_token_reused_until_close_to_expiry(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods._token_handler_instance = FakeTokenHandler(lifetime=3600)
+
+        token = ods.get_access_token()
+        for _ in range(100):
+            assert ods.get_access_token() == token
+        assert ods._token_handler_instance.calls == 1
+
+        ods._token_handler_instance.lifetime = 0
+        assert (new_token := ods.refresh_access_token(rejected_token=token)) != token
+        assert ods._token_handler_instance.calls == 2
+        assert ods.get_access_token() not in [token, new_token]
+        assert ods._token_handler_instance.calls == 3
+        os.remove(test_settings_file)
+
+    def test_opaque_token_expiry(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+
+        assert abs(ods._get_token_expiry('EwBwA8l6BAAU') - (time.time() + ods.TOKEN_LIFETIME)) < 5
+        os.remove(test_settings_file)
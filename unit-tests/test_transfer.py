@@ -0,0 +1,52 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestTransfer:
+
+    def test_get_targets(self, capsys):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods._cwd = '/docs'
+        items = {'/': {'id': 'root-id', 'type': 'd'}, '/docs': {'id': 'docs-id', 'type': 'd'}, '/docs/a.txt': {'id': 'a-id', 'type': 'f'}}
+        ods._get_item_metadata = lambda remote_path: items.get(remote_path)
+
+        assert ods._transfer_get_targets(['a.txt', 'b.txt'], '/', 'move') == ('root-id', [('/docs/a.txt', '/a.txt'), ('/docs/b.txt', '/b.txt')])
+        assert ods._transfer_get_targets(['a.txt'], 'c.txt', 'move') == ('docs-id', [('/docs/a.txt', '/docs/c.txt')])
+        assert ods._transfer_get_targets(['a.txt', 'b.txt'], 'c.txt', 'move') is None
+        assert ods._transfer_get_targets(['b.txt'], 'a.txt', 'copy') is None
+        assert ods._transfer_get_targets(['b.txt'], '/missing/c.txt', 'copy') is None
+        assert ods._transfer_get_targets(['/'], '/docs', 'move') is None
+        # Sources that would stay put or end up inside themselves are left out, the rest still go
+        assert ods._transfer_get_targets(['/docs', 'a.txt', '/b.txt'], '/docs', 'move') == ('docs-id', [('/b.txt', '/docs/b.txt')])
+        assert capsys.readouterr().out.split('\n') == ['error: /docs/c.txt is not a directory',
+                                                       'error: /docs/a.txt already exists',
+                                                       'error: parent directory of /missing/c.txt doesn\'t exist',
+                                                       'error: cannot move the root directory',
+                                                       'error: cannot move /docs into itself',
+                                                       'error: /docs/a.txt is already at /docs/a.txt',
+                                                       '']
+        os.remove(test_settings_file)
+
+    def test_cp_wait(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.COPY_POLL_INTERVAL = 0.001
+        # Each monitor reports that it's still running until it has been polled the given number of times
+        polls = {'quick': 1, 'slow': 4, 'failed': 2}
+        results = {'quick': '', 'slow': '', 'failed': 'copy failed'}
+        polled = []
+        def poll(monitor_url):
+            polled.append(monitor_url)
+            return results[monitor_url] if polled.count(monitor_url) == polls[monitor_url] else None
+        ods._cp_poll = poll
+
+        assert list(ods._cp_wait(['quick', 'slow', 'failed'])) == [('quick', ''), ('failed', 'copy failed'), ('slow', '')]
+        assert sorted(polled) == ['failed'] * 2 + ['quick'] + ['slow'] * 4
+        os.remove(test_settings_file)
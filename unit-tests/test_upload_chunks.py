@@ -0,0 +1,54 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI, UploadChunkSizer
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestUploadChunks:
+
+    def test_chunk_sizer(self):
+        sizer = UploadChunkSizer(10485760)
+        assert sizer.size == 32 * UploadChunkSizer.UNIT
+
+        # Growth is capped at doubling, and at the service maximum
+        sizer.succeeded(sizer.size, 0.01)
+        assert sizer.size == 64 * UploadChunkSizer.UNIT
+        for _ in range(5):
+            sizer.succeeded(sizer.size, 0.01)
+        assert sizer.size == UploadChunkSizer.MAX_UNITS * UploadChunkSizer.UNIT
+
+        # A slow chunk shrinks the size to what can be sent in TARGET_SECONDS, a failure halves it
+        sizer.succeeded(sizer.size, sizer.size / (10 * UploadChunkSizer.UNIT) * UploadChunkSizer.TARGET_SECONDS)
+        assert sizer.size == 10 * UploadChunkSizer.UNIT
+        sizer.failed()
+        assert sizer.size == 5 * UploadChunkSizer.UNIT
+        for _ in range(5):
+            sizer.failed()
+        assert sizer.size == UploadChunkSizer.UNIT
+
+    def test_failed_chunks_resent_and_final_chunk_last(self):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods._http_max_retries = 5
+        ods._chunk_sizer = UploadChunkSizer(4 * UploadChunkSizer.UNIT)
+        file_size = 20 * UploadChunkSizer.UNIT + 1000
+
+        sent = []
+        def upload_chunk(read_chunk, upload_url, chunk, file_size):
+            sent.append(chunk)
+            if len(sent) in [2, 5]:
+                ods._chunk_sizer.failed()
+                return None
+            return f'response {chunk}'
+        ods._put_upload_chunk = upload_chunk
+        committed = []
+
+        response = ods._put_upload_chunks(None, 'upload-url', [(0, file_size - 1)], file_size, 3, committed.append)
+        assert response == f'response {committed[-1]}'
+        assert committed[-1][1] == file_size - 1 and sent[-1] == committed[-1]
+        # Every byte is committed exactly once
+        ranges = sorted(committed)
+        assert ranges[0][0] == 0 and all(previous[1] + 1 == following[0] for previous, following in zip(ranges, ranges[1:]))
+        os.remove(test_settings_file)
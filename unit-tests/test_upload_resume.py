@@ -0,0 +1,64 @@
+import os
+import json
+import logging
+from src.OneDriveCLI.OneDriveCLI import UploadChunkSizer
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestUploadResume:
+
+    def _interrupted_put(self, server, ods, local_file, data):
+        # The first chunk is one unit and the next two units, then the third fails and isn't retried
+        local_file.write_bytes(data)
+        ods._get_http_session()
+        ods._http_max_retries = 0
+        ods._chunk_sizer = UploadChunkSizer(UploadChunkSizer.UNIT)
+        server.upload_puts = 0
+        server.fail_upload_puts = {3}
+        ods.put(str(local_file), '/', force=True)
+        server.fail_upload_puts = set()
+        record = ods._get_upload_session_record(str(local_file), '/big.bin')
+        assert record is not None and json.loads(record[4]) == [[0, UploadChunkSizer.UNIT - 1], [UploadChunkSizer.UNIT, 3 * UploadChunkSizer.UNIT - 1]]
+        return record
+
+    def test_resume_from_next_expected_ranges(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        data = os.urandom(16 * UploadChunkSizer.UNIT + 1000)
+        self._interrupted_put(server, ods, local_file := tmp_path / 'big.bin', data)
+        assert 'upload interrupted' in capsys.readouterr().out
+
+        # Only what OneDrive says is still missing is sent the second time
+        server.reset_stats()
+        ods.put(str(local_file), '/', force=True)
+        assert f'Resuming upload of [{local_file}] ({3 * UploadChunkSizer.UNIT} of {len(data)} bytes already uploaded)' in capsys.readouterr().out
+        assert server.bytes_in == len(data) - 3 * UploadChunkSizer.UNIT
+        assert bytes(server.drive.lookup(server.drive.root, 'big.bin').content) == data
+        assert ods._get_upload_session_record(str(local_file), '/big.bin') is None
+
+    def test_stale_session_discarded(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        self._interrupted_put(server, ods, local_file := tmp_path / 'big.bin', os.urandom(16 * UploadChunkSizer.UNIT + 1000))
+
+        # The file changed since the session was started, so the session is deleted and the upload starts again
+        data = os.urandom(16 * UploadChunkSizer.UNIT + 1000)
+        local_file.write_bytes(data)
+        os.utime(local_file, ns=(0, 0))
+        server.reset_stats()
+        ods.put(str(local_file), '/', force=True)
+        assert 'Resuming' not in capsys.readouterr().out
+        assert server.request_counts['DELETE /upload/{session}'] == 1
+        assert server.bytes_in > len(data)
+        assert bytes(server.drive.lookup(server.drive.root, 'big.bin').content) == data
+
+    def test_expired_session_discarded(self, mock_graph, tmp_path, capsys):
+        server, ods = mock_graph
+        data = os.urandom(16 * UploadChunkSizer.UNIT + 1000)
+        file_size, mtime_ns, upload_url, _, committed = self._interrupted_put(server, ods, local_file := tmp_path / 'big.bin', data)
+        ods._upsert_upload_session_record(str(local_file), '/big.bin', file_size, mtime_ns, upload_url, '2000-01-01T00:00:00Z', json.loads(committed))
+
+        # An expired session has already gone from OneDrive, so it's forgotten without being deleted
+        server.reset_stats()
+        ods.put(str(local_file), '/', force=True)
+        assert 'Resuming' not in capsys.readouterr().out
+        assert server.request_counts['DELETE /upload/{session}'] == 0
+        assert bytes(server.drive.lookup(server.drive.root, 'big.bin').content) == data
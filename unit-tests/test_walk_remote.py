@@ -0,0 +1,44 @@
+import os
+import logging
+from src.OneDriveCLI.OneDriveCLI import OneDriveCLI
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+class TestWalkRemote:
+
+    def test_walk_remote(self, capsys):
+        test_settings_file = './test_settings.db'
+        if os.path.exists(test_settings_file):
+            os.remove(test_settings_file)
+        ods = OneDriveCLI(settings_db=test_settings_file)
+        ods.upsert_setting('metadata_cache_ttl', '0')
+        folder = lambda item_id, name, size, child_count: {'id': item_id, 'name': name, 'size': size, 'folder': {'childCount': child_count}}
+        file = lambda item_id, name, size: {'id': item_id, 'name': name, 'size': size, 'file': {}}
+        # Children of each folder id, a page at a time. None is the folder the walk starts from.
+        children = {None: [[folder('a', 'a', 30, 2), folder('empty', 'empty', 0, 0)], [file('1', 'one.bak', 5)]],
+                    'a': [[file('2', 'two.bak', 10), folder('b', 'b', 20, 1)]],
+                    'b': [[file('3', 'three.txt', 20)]]}
+        listed = []
+        def get_children_pages(remote_path, select, item_id=None):
+            listed.append(item_id)
+            yield from ({'value': page} for page in children[item_id])
+        ods._get_children_pages = get_children_pages
+
+        assert sorted(path for path, _ in ods._walk_remote('/top', [])) == ['/top/a', '/top/a/b', '/top/a/b/three.txt', '/top/a/two.bak', '/top/empty', '/top/one.bak']
+        # Empty folders are never listed
+        assert sorted(listed, key=str) == [None, 'a', 'b']
+
+        listed.clear()
+        assert sorted(path for path, _ in ods._walk_remote('/top', [], descend=lambda path, json: json['size'] >= 25)) == ['/top/a', '/top/a/b', '/top/a/two.bak', '/top/empty', '/top/one.bak']
+        assert sorted(listed, key=str) == [None, 'a']
+
+        children['b'] = [[]]
+        del children['a']
+        def get_children_pages(remote_path, select, item_id=None):
+            yield {'error': {'code': 'itemNotFound', 'message': 'gone'}} if item_id not in children else {'value': children[item_id][0]}
+        ods._get_children_pages = get_children_pages
+        errors = []
+        assert sorted(path for path, _ in ods._walk_remote('/top', [], errors)) == ['/top/a', '/top/empty']
+        assert errors == ['/top/a']
+        assert 'error: itemNotFound | gone (/top/a)' in capsys.readouterr().out
+        os.remove(test_settings_file)